@@ -0,0 +1,285 @@
+"""
+Columnar batch valuation engine
+Vectorized counterpart of PropertyValuationModel.estimate_value for large portfolios
+"""
+
+import time
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from metrics import STAGE_SECONDS
+from valuation_model import (
+    PropertyValuationModel,
+    PROPERTY_TYPE_MULTIPLIERS,
+    LOCATION_TIER_MULTIPLIERS,
+)
+
+# Amenity bonuses, in the order estimate_value accumulates them
+AMENITY_BONUSES = [
+    ('hasParking', 0.05),
+    ('hasElevator', 0.03),
+    ('hasPool', 0.10),
+    ('hasSeaView', 0.15),
+    ('hasGarden', 0.08),
+]
+
+# Stage timers of the columnar path, resolved once
+_STAGE_TIMERS = {
+    stage: STAGE_SECONDS.labels('batch', stage)
+    for stage in ('extract', 'base_price', 'multipliers', 'learned_model', 'comparables', 'insights', 'assembly')
+}
+
+# Values beyond this cannot be truncated to int64 safely
+MAX_VECTOR_VALUE = 2.0 ** 62
+
+
+def _encode(values: List) -> Tuple[np.ndarray, List]:
+    """Integer-code a column, returning the codes and the distinct values"""
+    distinct = {}
+    codes = np.fromiter(
+        (distinct.setdefault(value, len(distinct)) for value in values),
+        dtype=np.intp,
+        count=len(values)
+    )
+    return codes, list(distinct)
+
+
+class BatchValuationEngine:
+    """
+    Value a batch of properties in one columnar pass
+
+    The batch is turned into NumPy arrays (size, floor, amenity flags,
+    encoded location and type) so every multiplier, range and score is
+    computed once per column instead of once per row. Rules are evaluated
+    once per distinct location/type through the wrapped model, so results
+    are identical to calling estimate_value row by row.
+    """
+
+    def __init__(self, model: PropertyValuationModel):
+        self.model = model
+
+    def estimate(self, properties: List[Dict], include_insights: bool = True,
+                 include_breakdown: bool = True) -> List[Union[Dict, Exception]]:
+        """
+        Value every property in the batch
+
+        Returns one entry per input, in order: the dict estimate_value would
+        return, or the exception it would have raised.
+        """
+        count = len(properties)
+        if count == 0:
+            return []
+
+        model = self.model
+        started = time.perf_counter()
+
+        # Extract columns
+        governorates = [p.get('governorate', '') for p in properties]
+        delegations = [p.get('delegation', '') for p in properties]
+        property_types = [p.get('propertyType', 'APARTMENT') for p in properties]
+        sizes = [p.get('size', 0) for p in properties]
+        floors = [p.get('floor') for p in properties]
+        listing_prices = [p.get('price') for p in properties]
+
+        # Rows the columnar path cannot represent go through estimate_value
+        numeric_size = np.array(
+            [isinstance(s, (int, float)) and not isinstance(s, bool) for s in sizes],
+            dtype=bool
+        )
+        size = np.array(
+            [s if ok else 0.0 for s, ok in zip(sizes, numeric_size)],
+            dtype=np.float64
+        )
+
+        timed = time.perf_counter()
+        _STAGE_TIMERS['extract'].observe(timed - started)
+
+        # Encoded location, resolved through the model's compiled price index
+        index = model.price_index
+        region_codes = np.fromiter(
+            (index.region_code(g, d) for g, d in zip(governorates, delegations)),
+            dtype=np.intp,
+            count=count
+        )
+        region_prices = index.base_prices
+        base_price_per_m2 = np.array(region_prices, dtype=np.float64)[region_codes]
+        started, timed = timed, time.perf_counter()
+        _STAGE_TIMERS['base_price'].observe(timed - started)
+
+        tiers = np.fromiter((index.tier(d) for d in delegations), dtype=np.intp, count=count)
+        location_multiplier = np.array(LOCATION_TIER_MULTIPLIERS, dtype=np.float64)[tiers]
+
+        type_codes, distinct_types = _encode(property_types)
+        type_multiplier = np.array(
+            [PROPERTY_TYPE_MULTIPLIERS.get(t, 1.0) for t in distinct_types],
+            dtype=np.float64
+        )[type_codes]
+
+        # Amenities
+        amenities_bonus = np.zeros(count, dtype=np.float64)
+        amenities_count = np.zeros(count, dtype=np.int64)
+        has_any_amenity = np.zeros(count, dtype=bool)
+        for field, bonus in AMENITY_BONUSES:
+            flags = np.fromiter((bool(p.get(field)) for p in properties), dtype=bool, count=count)
+            amenities_bonus = amenities_bonus + np.where(flags, bonus, 0.0)
+            amenities_count += flags
+            has_any_amenity |= flags
+
+        # Floor adjustment (apartments only)
+        has_floor = np.fromiter((f is not None for f in floors), dtype=bool, count=count)
+        floor = np.array([f if f is not None else 0 for f in floors], dtype=np.float64)
+        is_apartment = np.array([t == 'APARTMENT' for t in distinct_types], dtype=bool)[type_codes]
+        floor_multiplier = np.select(
+            [floor <= 0, (1 <= floor) & (floor <= 3), (4 <= floor) & (floor <= 6)],
+            [0.95, 1.0, 1.02],
+            default=1.05
+        )
+        floor_multiplier = np.where(is_apartment & has_floor, floor_multiplier, 1.0)
+
+        age_multiplier = model.estimate_property_age_impact({})
+
+        # Final calculation, in the same operation order as estimate_value
+        # (overflowing rows are detected below and re-valued per row)
+        with np.errstate(over='ignore', invalid='ignore'):
+            base_value = base_price_per_m2 * size
+            raw_value = (
+                base_value
+                * location_multiplier
+                * type_multiplier
+                * (1 + amenities_bonus)
+                * floor_multiplier
+                * age_multiplier
+            )
+            started, timed = timed, time.perf_counter()
+            _STAGE_TIMERS['multipliers'].observe(timed - started)
+
+            # Blend with the learned model, if one is plugged in
+            learned_price_per_m2 = None
+            predictor = model.predictor
+            if predictor is not None:
+                try:
+                    learned_price_per_m2 = predictor.predict(properties)
+                except (TypeError, ValueError):
+                    # Some row cannot be encoded: let estimate_value report each row
+                    learned_price_per_m2 = np.full(count, np.nan)
+                raw_value = (
+                    (1 - model.blend_weight) * raw_value
+                    + model.blend_weight * learned_price_per_m2 * size
+                )
+                started, timed = timed, time.perf_counter()
+                _STAGE_TIMERS['learned_model'].observe(timed - started)
+
+        vectorizable = (
+            numeric_size
+            & np.isfinite(raw_value)
+            & (np.abs(raw_value) < MAX_VECTOR_VALUE)
+            & (np.abs(size) < MAX_VECTOR_VALUE)
+        )
+        estimated_value = np.where(vectorizable, raw_value, 0.0).astype(np.int64)
+
+        # Confidence
+        comparables = model.find_comparables_batch(properties)
+        comparables_count = np.fromiter((len(c) for c in comparables), dtype=np.float64, count=count)
+        has_bedrooms = np.fromiter((p.get('bedrooms') is not None for p in properties), dtype=bool, count=count)
+        has_bathrooms = np.fromiter((p.get('bathrooms') is not None for p in properties), dtype=bool, count=count)
+        confidence = np.full(count, 0.7)
+        confidence = confidence + np.where(comparables_count > 0, np.minimum(0.15, comparables_count * 0.03), 0.0)
+        confidence = confidence + np.where(has_bedrooms, 0.02, 0.0)
+        confidence = confidence + np.where(has_bathrooms, 0.02, 0.0)
+        confidence = np.minimum(confidence, 0.95)
+        started, timed = timed, time.perf_counter()
+        _STAGE_TIMERS['comparables'].observe(timed - started)
+
+        # Range (±7%)
+        min_value = (estimated_value * 0.93).astype(np.int64)
+        max_value = (estimated_value * 1.07).astype(np.int64)
+
+        # Scores
+        location_score = (location_multiplier * 85).astype(np.int64)
+        size_score = np.minimum(100, np.where(vectorizable, 60 + (size / 10), 0.0).astype(np.int64))
+        amenities_score = 60 + (amenities_count * 8)
+
+        # Price fairness
+        has_listing_price = np.fromiter((p is not None for p in listing_prices), dtype=bool, count=count)
+        vectorizable &= ~(has_listing_price & (estimated_value == 0))
+        listing_price = np.array(
+            [p if p is not None else 0 for p in listing_prices],
+            dtype=np.float64
+        )
+        ratio = listing_price / np.where(estimated_value == 0, 1, estimated_value)
+        price_fairness = np.select(
+            [~has_listing_price, ratio < 0.90, ratio < 0.95, ratio <= 1.05, ratio <= 1.15],
+            ['unknown', 'excellent', 'good', 'fair', 'high'],
+            default='very_high'
+        )
+
+        # Assemble per-row results
+        estimated_values = estimated_value.tolist()
+        min_values = min_value.tolist()
+        max_values = max_value.tolist()
+        confidences = confidence.tolist()
+        location_scores = location_score.tolist()
+        size_scores = size_score.tolist()
+        amenities_scores = amenities_score.tolist()
+        fairness = price_fairness.tolist()
+        location_multipliers = location_multiplier.tolist()
+        type_multipliers = type_multiplier.tolist()
+        amenities_bonuses = amenities_bonus.tolist()
+        floor_multipliers = floor_multiplier.tolist()
+        any_amenity = has_any_amenity.tolist()
+        learned_prices = learned_price_per_m2.tolist() if learned_price_per_m2 is not None else None
+        region_codes = region_codes.tolist()
+
+        insights_seconds = 0.0
+        results = []
+        for i, ok in enumerate(vectorizable.tolist()):
+            property_data = properties[i]
+            if not ok:
+                try:
+                    results.append(model.estimate_value(property_data, include_insights, include_breakdown))
+                except Exception as e:
+                    results.append(e)
+                continue
+
+            region_price = region_prices[region_codes[i]]
+            insights = None
+            if include_insights:
+                insights_started = time.perf_counter()
+                insights = model.generate_insights(property_data, estimated_values[i], region_price)
+                insights_seconds += time.perf_counter() - insights_started
+            breakdown = None
+            if include_breakdown:
+                breakdown = {
+                    'basePricePerM2': region_price,
+                    'baseValue': region_price * sizes[i],
+                    'locationMultiplier': location_multipliers[i],
+                    'typeMultiplier': type_multipliers[i],
+                    'amenitiesBonus': amenities_bonuses[i] if any_amenity[i] else 0,
+                    'floorMultiplier': floor_multipliers[i],
+                    'ageMultiplier': age_multiplier,
+                }
+                if learned_prices is not None:
+                    breakdown['learnedPricePerM2'] = learned_prices[i]
+                    breakdown['blendWeight'] = model.blend_weight
+
+            results.append({
+                'estimatedValue': estimated_values[i],
+                'minValue': min_values[i],
+                'maxValue': max_values[i],
+                'confidenceScore': confidences[i],
+                'locationScore': location_scores[i],
+                'sizeScore': size_scores[i],
+                'conditionScore': 80,
+                'amenitiesScore': amenities_scores[i],
+                'comparables': comparables[i],
+                'aiInsights': insights,
+                'isPriceFair': fairness[i],
+                'breakdown': breakdown
+            })
+
+        # Assembly covers ranges, scores and result dicts; fallback rows are timed by estimate_value
+        if include_insights:
+            _STAGE_TIMERS['insights'].observe(insights_seconds)
+        _STAGE_TIMERS['assembly'].observe(time.perf_counter() - timed - insights_seconds)
+        return results
@@ -0,0 +1,310 @@
+"""
+Valuation benchmarks
+Measures single, batch and streaming throughput and latency, in-process and through the FastAPI app
+
+Usage:
+    python benchmark.py --count 5000 --output bench.json
+    python benchmark.py --compare bench.json   # exit code 1 on regression
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from functools import partial
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from valuation_model import TUNISIA_REGIONAL_PRICES, PROPERTY_TYPE_MULTIPLIERS
+
+BENCHMARK_SCHEMA_VERSION = 1
+
+# Approximate governorate centres (lat, lng) for synthetic coordinates
+GOVERNORATE_CENTRES = {
+    'Tunis': (36.8065, 10.1815),
+    'Ariana': (36.8625, 10.1956),
+    'Ben Arous': (36.7531, 10.2189),
+    'Sousse': (35.8256, 10.6084),
+    'Nabeul': (36.4561, 10.7376),
+    'Sfax': (34.7406, 10.7603),
+    'Bizerte': (37.2744, 9.8739),
+    'Monastir': (35.7643, 10.8113),
+    'Mahdia': (35.5047, 11.0622),
+    'Kairouan': (35.6781, 10.0963),
+    'Gabes': (33.8815, 10.0982),
+    'Tozeur': (33.9197, 8.1335),
+}
+INLAND_GOVERNORATES = {'Kairouan', 'Tozeur'}
+
+# Listing mix: type -> (share, median size m², size spread as lognormal sigma)
+PROPERTY_MIX = {
+    'APARTMENT': (0.55, 110, 0.35),
+    'HOUSE': (0.15, 180, 0.35),
+    'VILLA': (0.12, 320, 0.40),
+    'LAND': (0.08, 500, 0.60),
+    'COMMERCIAL': (0.06, 120, 0.50),
+    'OFFICE': (0.04, 90, 0.45),
+}
+# Share of listings with a delegation missing from the regional price table
+UNKNOWN_DELEGATION_SHARE = 0.05
+
+
+def generate_properties(count: int, seed: int = 42) -> List[Dict]:
+    """
+    Deterministic synthetic Tunisian listings in the API's feature format
+
+    Governorates and delegations are drawn from TUNISIA_REGIONAL_PRICES,
+    sizes from per-type lognormal distributions and amenities with
+    type- and location-dependent probabilities. The same seed always
+    yields the same properties.
+    """
+    rng = random.Random(seed)
+    regions = [
+        (governorate, delegation)
+        for governorate, delegations in TUNISIA_REGIONAL_PRICES.items()
+        for delegation in delegations
+    ]
+    types = list(PROPERTY_MIX)
+    type_weights = [PROPERTY_MIX[t][0] for t in types]
+
+    properties = []
+    for _ in range(count):
+        governorate, delegation = rng.choice(regions)
+        if rng.random() < UNKNOWN_DELEGATION_SHARE:
+            delegation = f"{delegation} Sud"
+        property_type = rng.choices(types, type_weights)[0]
+        _, median_size, sigma = PROPERTY_MIX[property_type]
+        size = round(median_size * math.exp(rng.gauss(0, sigma)), 1)
+
+        residential = property_type in ('APARTMENT', 'HOUSE', 'VILLA')
+        coastal = governorate not in INLAND_GOVERNORATES
+        latitude, longitude = GOVERNORATE_CENTRES.get(governorate, (36.8, 10.18))
+
+        base_price = TUNISIA_REGIONAL_PRICES[governorate].get(delegation, 1500)
+        listing_price = None
+        if rng.random() < 0.6:
+            listing_price = int(base_price * size * PROPERTY_TYPE_MULTIPLIERS[property_type]
+                                * math.exp(rng.gauss(0, 0.15)))
+
+        properties.append({
+            'governorate': governorate,
+            'delegation': delegation,
+            'propertyType': property_type,
+            'transactionType': 'SALE' if rng.random() < 0.8 else 'RENT',
+            'size': size,
+            'bedrooms': max(1, min(8, int(size // 45))) if residential else None,
+            'bathrooms': max(1, min(5, int(size // 90))) if residential and rng.random() < 0.7 else None,
+            'floor': rng.choice([0, 1, 2, 3, 4, 5, 6, 8, 10]) if property_type == 'APARTMENT' else None,
+            'hasParking': rng.random() < (0.6 if residential else 0.3),
+            'hasElevator': property_type == 'APARTMENT' and rng.random() < 0.5,
+            'hasGarden': property_type in ('HOUSE', 'VILLA') and rng.random() < 0.7,
+            'hasPool': property_type == 'VILLA' and rng.random() < 0.45,
+            'hasSeaView': coastal and residential and rng.random() < 0.15,
+            'latitude': round(latitude + rng.uniform(-0.05, 0.05), 6),
+            'longitude': round(longitude + rng.uniform(-0.05, 0.05), 6),
+            'price': listing_price,
+        })
+    return properties
+
+
+def summarize(latencies: List[float], rows: int, total_seconds: float) -> Dict:
+    """Throughput and latency percentiles of one benchmark"""
+    samples = np.asarray(latencies) * 1000
+    return {
+        'calls': len(latencies),
+        'rows': rows,
+        'totalSeconds': round(total_seconds, 6),
+        'rowsPerSecond': round(rows / total_seconds, 1) if total_seconds > 0 else None,
+        'p50Ms': round(float(np.percentile(samples, 50)), 4),
+        'p99Ms': round(float(np.percentile(samples, 99)), 4),
+        'meanMs': round(float(samples.mean()), 4),
+        'maxMs': round(float(samples.max()), 4),
+    }
+
+
+# Timed passes per benchmark; the fastest is reported, which damps scheduler noise
+REPEAT = 3
+
+
+def run_timed(calls: List[Callable[[], int]], warmup: int = 1) -> Dict:
+    """Time every call (each returns its row count) over REPEAT passes, after a warm-up"""
+    for call in calls[:warmup]:
+        call()
+    best = None
+    for _ in range(max(1, REPEAT)):
+        latencies = []
+        rows = 0
+        started = time.perf_counter()
+        for call in calls:
+            call_started = time.perf_counter()
+            rows += call()
+            latencies.append(time.perf_counter() - call_started)
+        summary = summarize(latencies, rows, time.perf_counter() - started)
+        if best is None or summary['rowsPerSecond'] > best['rowsPerSecond']:
+            best = summary
+    return best
+
+
+def chunked(items: List, size: int) -> List[List]:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def as_requests(properties: List[Dict]) -> List[Dict]:
+    return [{'propertyId': f"bench-{i}", 'features': p} for i, p in enumerate(properties)]
+
+
+def bench_in_process(main, properties: List[Dict], batch_size: int, stream_chunk_size: int) -> Dict:
+    """Model, batch engine and streaming chunk path without HTTP"""
+    entry = main.model_registry.active
+    model, engine = entry.model, entry.engine
+    results = {}
+
+    def single(property_data: Dict) -> int:
+        model.estimate_value(property_data)
+        return 1
+
+    def batch(chunk: List[Dict]) -> int:
+        return len(engine.estimate(chunk))
+
+    results['inprocess.single'] = run_timed([partial(single, p) for p in properties], warmup=10)
+    results['inprocess.batch'] = run_timed([partial(batch, b) for b in chunked(properties, batch_size)])
+
+    rows = [main.ValuationRequest(**request) for request in as_requests(properties)]
+
+    loop = asyncio.new_event_loop()
+
+    def stream_chunk(chunk: List) -> int:
+        return len(loop.run_until_complete(
+            main._value_stream_chunk(entry, chunk, True, True, main.NDJSON_MEDIA_TYPE)
+        ))
+
+    try:
+        results['inprocess.stream'] = run_timed([partial(stream_chunk, c) for c in chunked(rows, stream_chunk_size)])
+    finally:
+        loop.close()
+    return results
+
+
+def bench_http(client, properties: List[Dict], batch_size: int, single_count: int) -> Dict:
+    """The same paths through the FastAPI app with the test client"""
+    requests = as_requests(properties)
+    results = {}
+
+    def single(request: Dict) -> int:
+        client.post('/api/v1/valuations/estimate', json=request).raise_for_status()
+        return 1
+
+    def batch(chunk: List[Dict]) -> int:
+        client.post('/api/v1/valuations/batch', json={'properties': chunk}).raise_for_status()
+        return len(chunk)
+
+    def stream(batch: List[Dict]) -> int:
+        body = "".join(json.dumps(r) + "\n" for r in batch)
+        with client.stream('POST', '/api/v1/valuations/batch/stream', content=body) as response:
+            response.raise_for_status()
+            return sum(1 for line in response.iter_lines() if line)
+
+    results['http.single'] = run_timed([partial(single, r) for r in requests[:single_count]], warmup=10)
+    results['http.batch'] = run_timed([partial(batch, b) for b in chunked(requests, batch_size)])
+    results['http.stream'] = run_timed([partial(stream, b) for b in chunked(requests, batch_size)])
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Benchmarks whose throughput dropped or p99 grew by more than tolerance"""
+    regressions = []
+    for name, current in results['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        if previous.get('rowsPerSecond') and current['rowsPerSecond'] < previous['rowsPerSecond'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['rowsPerSecond']} -> {current['rowsPerSecond']} rows/s")
+        if previous.get('p99Ms') and current['p99Ms'] > previous['p99Ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {previous['p99Ms']} -> {current['p99Ms']} ms")
+    return regressions
+
+
+def run(count: int, seed: int, batch_size: int, stream_chunk_size: int, single_count: int,
+        http: bool = True, cache: bool = False) -> Dict:
+    """Run every benchmark and return the machine-readable report"""
+    # Valuations must be computed, not served from the cache, unless asked otherwise
+    if not cache:
+        os.environ['VALUATION_CACHE_SIZE'] = '0'
+    os.environ.setdefault('MODEL_WATCH_SECONDS', '0')
+    import main
+    from fastapi.testclient import TestClient
+
+    properties = generate_properties(count, seed)
+    # The app's lifespan loads the model on entry and stops its worker pools on exit
+    with TestClient(main.app) as client:
+        results = bench_in_process(main, properties, batch_size, stream_chunk_size)
+        if http:
+            results.update(bench_http(client, properties, batch_size, single_count))
+
+    return {
+        'schema': BENCHMARK_SCHEMA_VERSION,
+        'timestamp': datetime.utcnow().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpuCount': os.cpu_count(),
+            'numpy': np.__version__,
+            'modelVersion': main.model_registry.active.version,
+            'workers': main.model_registry.pool_options.get('workers', 0),
+        },
+        'parameters': {
+            'count': count,
+            'seed': seed,
+            'batchSize': batch_size,
+            'streamChunkSize': stream_chunk_size,
+            'singleCount': single_count,
+            'repeat': REPEAT,
+            'cache': cache,
+        },
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the valuation model and service")
+    parser.add_argument("--count", type=int, default=5000, help="Synthetic properties to value")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--stream-chunk-size", type=int, default=256)
+    parser.add_argument("--single-count", type=int, default=1000, help="Properties sent one request at a time over HTTP")
+    parser.add_argument("--no-http", action="store_true", help="Only run the in-process benchmarks")
+    parser.add_argument("--cache", action="store_true", help="Leave the valuation cache enabled")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", help="Baseline report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Timed passes per benchmark (best is kept)")
+    args = parser.parse_args()
+    REPEAT = args.repeat
+
+    report = run(args.count, args.seed, args.batch_size, args.stream_chunk_size,
+                 args.single_count, http=not args.no_http, cache=args.cache)
+
+    for name, result in report['results'].items():
+        print(f"{name:18} {result['rowsPerSecond']:>12} rows/s  p50 {result['p50Ms']:>9} ms  "
+              f"p99 {result['p99Ms']:>9} ms", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,414 @@
+"""
+Comparable properties from gold-layer listings
+In-memory spatial grid over latitude/longitude, partitioned by property and transaction type
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Grid cell size in degrees (~2 km in Tunisia)
+CELL_SIZE_DEG = 0.02
+# Search radius limit, in rings of cells around the query cell
+MAX_SEARCH_RINGS = 25
+# Comparables returned per query
+DEFAULT_COMPARABLES = 5
+# Queries answered together by one distance matrix
+MAX_GROUP_QUERIES = 512
+# Accepted size ratio between a comparable and the subject property
+MIN_SIZE_RATIO = 0.5
+MAX_SIZE_RATIO = 2.0
+
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LNG_EQUATOR = 111.320
+
+
+def distance_matrix_km(lat1: np.ndarray, lng1: np.ndarray, lat2: np.ndarray, lng2: np.ndarray) -> np.ndarray:
+    """Equirectangular distances between every query and every listing (rows x columns)"""
+    lat1 = lat1[:, None]
+    lng1 = lng1[:, None]
+    dy = (lat2[None, :] - lat1) * KM_PER_DEG_LAT
+    dx = (lng2[None, :] - lng1) * KM_PER_DEG_LNG_EQUATOR * np.cos(np.radians((lat1 + lat2[None, :]) / 2))
+    return np.sqrt(dx * dx + dy * dy)
+
+
+def cell_of(latitude: float, longitude: float) -> Tuple[int, int]:
+    return (math.floor(latitude / CELL_SIZE_DEG), math.floor(longitude / CELL_SIZE_DEG))
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+class Listing:
+    """A gold-layer listing reduced to what comparables need"""
+
+    __slots__ = ('latitude', 'longitude', 'size', 'price', 'price_per_m2', 'summary', 'source_file')
+
+    def __init__(self, latitude: float, longitude: float, size: float, price: float,
+                 summary: Dict, source_file: str):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.size = size
+        self.price = price
+        self.price_per_m2 = round(price / size, 2)
+        self.summary = summary
+        self.source_file = source_file
+
+    @classmethod
+    def from_gold_record(cls, record: Dict, source_file: str) -> Optional['Listing']:
+        """Build a listing from a gold record, or None if it lacks location, price or size"""
+        latitude = _to_float(record.get('latitude'))
+        longitude = _to_float(record.get('longitude'))
+        price = _to_float(record.get('price'))
+        size = _to_float(record.get('size'))
+        if latitude is None or longitude is None or not price or not size or price <= 0 or size <= 0:
+            return None
+        if record.get('is_price_anomaly'):
+            return None
+
+        summary = {
+            'listingId': record.get('listing_id'),
+            'title': record.get('title'),
+            'sourceUrl': record.get('source_url'),
+            'governorate': record.get('governorate'),
+            'delegation': record.get('delegation'),
+            'bedrooms': record.get('bedrooms'),
+        }
+        return cls(latitude, longitude, size, price, summary, source_file)
+
+    def as_comparable(self, distance: float) -> Dict:
+        comparable = dict(self.summary)
+        comparable.update({
+            'price': self.price,
+            'size': self.size,
+            'pricePerM2': self.price_per_m2,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'distanceKm': round(distance, 3),
+        })
+        return comparable
+
+
+def scan_gold_dir(gold_dir: str) -> Dict[str, Tuple[int, float]]:
+    """Size and mtime of every gold file in a directory"""
+    current = {}
+    if os.path.isdir(gold_dir):
+        with os.scandir(gold_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith('_gold.json'):
+                    stat = entry.stat()
+                    current[entry.name] = (stat.st_size, stat.st_mtime)
+    return current
+
+
+def partition_key(property_type: Optional[str], transaction_type: Optional[str]) -> Tuple[str, str]:
+    return ((property_type or '').upper(), (transaction_type or '').upper())
+
+
+class ComparablesIndex:
+    """
+    Spatial index of gold-layer listings for k-nearest-similar queries
+
+    Listings are partitioned by (property_type, transaction_type) and bucketed
+    into a fixed lat/lng grid; a query scans rings of cells outward from the
+    subject until no cell of the next ring can be closer than its kth
+    candidate of similar size, so it gets the exact k nearest within
+    MAX_SEARCH_RINGS. Once probing the next ring would cost more than listing
+    the partition's non-empty cells, only those are visited, which bounds the
+    work for sparse partitions. Batches of queries are answered per grid cell
+    with one vectorized distance matrix per ring.
+
+    refresh() only stats the gold directory and loads files that are new or
+    whose size/mtime changed; listings of changed or deleted files are
+    removed from the cells they occupy.
+    """
+
+    def __init__(self, gold_dir: str):
+        self.gold_dir = gold_dir
+        self._partitions: Dict[Tuple[str, str], Dict[Tuple[int, int], List[Listing]]] = {}
+        self._files: Dict[str, Tuple[int, float]] = {}
+        self._file_cells: Dict[str, List[Tuple[Tuple[str, str], Tuple[int, int]]]] = {}
+        # (partition, cell) -> (listing list, [[lat, lng, size], ...]) for the list it was built from
+        self._cell_arrays: Dict[Tuple[Tuple[str, str], Tuple[int, int]], Tuple[List[Listing], np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.listing_count = 0
+        self.generation = 0
+        self.last_refresh = 0.0
+
+    def refresh(self) -> 'ComparablesIndex':
+        """Load new or changed gold files and drop deleted ones"""
+        with self._lock:
+            current = scan_gold_dir(self.gold_dir)
+
+            changed = False
+            for name in list(self._files):
+                if current.get(name) != self._files[name]:
+                    self._remove_file(name)
+                    changed = True
+
+            for name, signature in current.items():
+                if name not in self._files and self._load_file(name, signature):
+                    changed = True
+
+            if changed:
+                self.generation += 1
+                logger.info(f"Comparables index: {self.listing_count} listings from {len(self._files)} gold files")
+            self.last_refresh = time.monotonic()
+        return self
+
+    def maybe_refresh(self, max_age_seconds: float) -> 'ComparablesIndex':
+        """Refresh if the last scan is older than max_age_seconds"""
+        if time.monotonic() - self.last_refresh >= max_age_seconds:
+            self.refresh()
+        return self
+
+    def _load_file(self, name: str, signature: Tuple[int, float]) -> bool:
+        """Index the listings of a gold file; unreadable files are retried on the next refresh"""
+        path = os.path.join(self.gold_dir, name)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Comparables index: skipping {name}: {e}")
+            return False
+
+        records = data.get('data', []) if isinstance(data, dict) else data
+        added: Dict[Tuple[Tuple[str, str], Tuple[int, int]], List[Listing]] = {}
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            listing = Listing.from_gold_record(record, name)
+            if listing is None:
+                continue
+            key = partition_key(record.get('property_type'), record.get('transaction_type'))
+            added.setdefault((key, cell_of(listing.latitude, listing.longitude)), []).append(listing)
+
+        # Cells are replaced, never mutated, so concurrent queries see a consistent list
+        for (key, cell), listings in added.items():
+            cells = self._partitions.setdefault(key, {})
+            cells[cell] = cells.get(cell, []) + listings
+            self.listing_count += len(listings)
+
+        self._files[name] = signature
+        self._file_cells[name] = list(added)
+        return True
+
+    def _remove_file(self, name: str):
+        for key, cell in self._file_cells.pop(name, []):
+            cells = self._partitions.get(key, {})
+            kept = [listing for listing in cells.get(cell, []) if listing.source_file != name]
+            self.listing_count -= len(cells.get(cell, [])) - len(kept)
+            if kept:
+                cells[cell] = kept
+            else:
+                cells.pop(cell, None)
+                self._cell_arrays.pop((key, cell), None)
+        self._files.pop(name, None)
+
+    def query(self, latitude: float, longitude: float, property_type: Optional[str],
+              transaction_type: Optional[str], size: Optional[float] = None,
+              k: int = DEFAULT_COMPARABLES) -> List[Dict]:
+        """k nearest listings of the same type and transaction with a similar size"""
+        return self.query_batch([(latitude, longitude, property_type, transaction_type, size)], k)[0]
+
+    def query_batch(self, queries: List[Tuple], k: int = DEFAULT_COMPARABLES) -> List[List[Dict]]:
+        """
+        Comparables for many (latitude, longitude, property_type, transaction_type, size) queries
+
+        Queries are grouped by partition and grid cell; each group shares one
+        ring traversal and one vectorized distance matrix. Every query gets
+        exactly the answer query() would give it alone.
+        """
+        results: List[List[Dict]] = [[] for _ in queries]
+        if k <= 0:
+            return results
+
+        # Read once: a refresh during the batch must not mix two versions of the index
+        snapshot = self._snapshot()
+        partitions = snapshot[0]
+        groups: Dict[Tuple[Tuple[str, str], Tuple[int, int]], List[Tuple[int, float, float, float]]] = {}
+        for i, (latitude, longitude, property_type, transaction_type, size) in enumerate(queries):
+            key = partition_key(property_type, transaction_type)
+            latitude = _to_float(latitude)
+            longitude = _to_float(longitude)
+            if key not in partitions or latitude is None or longitude is None:
+                continue
+            size = _to_float(size)
+            groups.setdefault((key, cell_of(latitude, longitude)), []).append(
+                (i, latitude, longitude, size if size and size > 0 else math.nan)
+            )
+
+        for (key, cell), members in groups.items():
+            for start in range(0, len(members), MAX_GROUP_QUERIES):
+                self._answer_group(snapshot, key, cell, members[start:start + MAX_GROUP_QUERIES], k, results)
+        return results
+
+    def _snapshot(self) -> Tuple[Dict, object]:
+        """(partitions, backing data) a query reads; cell lists are replaced, never mutated"""
+        return self._partitions, None
+
+    def _cell_entry(self, snapshot: Tuple[Dict, object], key: Tuple[str, str], cells: Dict,
+                    cell: Tuple[int, int]):
+        """Listings of a cell with their [lat, lng, size] array, built once per cell version"""
+        listings = cells.get(cell)
+        if not listings:
+            return None
+        cached = self._cell_arrays.get((key, cell))
+        if cached is not None and cached[0] is listings:
+            return cached
+        entry = (listings, np.array([(l.latitude, l.longitude, l.size) for l in listings], dtype=np.float64))
+        self._cell_arrays[(key, cell)] = entry
+        return entry
+
+    def _cell_count(self, snapshot: Tuple[Dict, object], key: Tuple[str, str], cells: Dict) -> int:
+        """Number of non-empty cells in a partition"""
+        return len(cells)
+
+    def _occupied_cells(self, snapshot: Tuple[Dict, object], key: Tuple[str, str], cells: Dict) -> np.ndarray:
+        """[[row, col], ...] of the non-empty cells of a partition"""
+        return np.array(list(cells), dtype=np.int64).reshape(-1, 2)
+
+    def _cells_by_ring(self, snapshot: Tuple[Dict, object], key: Tuple[str, str], cells: Dict,
+                       cell: Tuple[int, int], first_ring: int) -> Dict[int, List[Tuple[int, int]]]:
+        """Non-empty cells from first_ring to MAX_SEARCH_RINGS around cell, by ring, sorted within a ring"""
+        occupied = self._occupied_cells(snapshot, key, cells)
+        rings = np.maximum(np.abs(occupied[:, 0] - cell[0]), np.abs(occupied[:, 1] - cell[1]))
+        keep = (rings >= first_ring) & (rings <= MAX_SEARCH_RINGS)
+        occupied, rings = occupied[keep], rings[keep]
+        order = np.lexsort((occupied[:, 1], occupied[:, 0], rings))
+        by_ring: Dict[int, List[Tuple[int, int]]] = {}
+        for ring, row, col in zip(rings[order].tolist(), occupied[order, 0].tolist(), occupied[order, 1].tolist()):
+            by_ring.setdefault(ring, []).append((row, col))
+        return by_ring
+
+    def _answer_group(self, snapshot: Tuple[Dict, object], key: Tuple[str, str], cell: Tuple[int, int],
+                      members: List[Tuple[int, float, float, float]], k: int,
+                      results: List[List[Dict]]):
+        """Answer queries that share a partition and grid cell"""
+        cells = snapshot[0].get(key, {})
+        count = len(members)
+        latitude = np.array([m[1] for m in members], dtype=np.float64)
+        longitude = np.array([m[2] for m in members], dtype=np.float64)
+        size = np.array([m[3] for m in members], dtype=np.float64)
+        has_size = ~np.isnan(size)
+        min_size = (size * MIN_SIZE_RATIO)[:, None]
+        max_size = (size * MAX_SIZE_RATIO)[:, None]
+
+        listings: List[Listing] = []
+        distance_blocks = []
+        # k smallest distances to similar candidates so far, per query
+        kth_nearest = np.full((count, k), np.inf)
+        row, col = cell
+        occupied = self._cell_count(snapshot, key, cells)
+        probed = 0
+        by_ring = None
+        for ring in range(MAX_SEARCH_RINGS + 1):
+            # Probe rings while that is cheaper than listing the partition's cells; a
+            # sparse partition is then walked through its occupied cells only
+            if by_ring is None and probed + _ring_size(ring) > occupied:
+                by_ring = self._cells_by_ring(snapshot, key, cells, cell, ring)
+            if by_ring is None:
+                ring_cells = _ring_cells(row, col, ring)
+                probed += _ring_size(ring)
+            else:
+                ring_cells = by_ring.get(ring, ())
+
+            blocks = []
+            for ring_cell in ring_cells:
+                entry = self._cell_entry(snapshot, key, cells, ring_cell)
+                if entry is not None:
+                    listings.extend(entry[0])
+                    blocks.append(entry[1])
+            if blocks:
+                # One distance matrix per ring
+                block = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+                similar = ~has_size[:, None] | ((min_size <= block[:, 2]) & (block[:, 2] <= max_size))
+                distances = np.where(
+                    similar, distance_matrix_km(latitude, longitude, block[:, 0], block[:, 1]), np.inf
+                )
+                distance_blocks.append(distances)
+                kth_nearest = np.partition(np.concatenate([kth_nearest, distances], axis=1), k - 1, axis=1)[:, :k]
+
+            # Done once no cell of the next ring can hold anything closer than every query's kth candidate
+            if np.all(kth_nearest[:, k - 1] < _ring_min_distance_km(latitude, longitude, cell, ring + 1)):
+                break
+            if by_ring is not None and not any(later > ring for later in by_ring):
+                break
+
+        if not listings:
+            return
+
+        # Candidates from rings scanned for other queries of the group are farther than
+        # this query's kth candidate, so they never change its answer
+        distances = np.concatenate(distance_blocks, axis=1)
+        nearest = np.argsort(distances, axis=1, kind='stable')[:, :k]
+
+        for position, member in enumerate(members):
+            comparables = []
+            for column in nearest[position]:
+                distance = distances[position, column]
+                if not math.isfinite(distance):
+                    break
+                comparables.append(self._as_comparable(snapshot, listings[column], float(distance)))
+            results[member[0]] = comparables
+
+    def _as_comparable(self, snapshot: Tuple[Dict, object], listing: Listing, distance: float) -> Dict:
+        return listing.as_comparable(distance)
+
+    def cells(self):
+        """(partition, cell, listings) for every non-empty cell, in a stable order"""
+        for key in sorted(self._partitions):
+            cells = self._partitions[key]
+            for cell in sorted(cells):
+                yield key, cell, cells[cell]
+
+    def stats(self) -> Dict:
+        return {
+            'listings': self.listing_count,
+            'files': len(self._files),
+            'partitions': len(self._partitions),
+            'generation': self.generation,
+        }
+
+
+def _ring_size(ring: int) -> int:
+    return 8 * ring if ring else 1
+
+
+def _ring_min_distance_km(latitude: np.ndarray, longitude: np.ndarray, cell: Tuple[int, int],
+                          ring: int) -> np.ndarray:
+    """Lower bound of the distance from each query point (inside cell) to any cell of a ring"""
+    row, col = cell
+    # Cells of the ring lie outside the block of rings 0 .. ring-1
+    lat_gap = np.minimum(latitude - (row - ring + 1) * CELL_SIZE_DEG, (row + ring) * CELL_SIZE_DEG - latitude)
+    lng_gap = np.minimum(longitude - (col - ring + 1) * CELL_SIZE_DEG, (col + ring) * CELL_SIZE_DEG - longitude)
+    # A degree of longitude is shortest at the latitude farthest from the equator the ring reaches
+    farthest_latitude = min(90.0, max(abs(row - ring), abs(row + ring + 1)) * CELL_SIZE_DEG)
+    km_per_deg_lng = KM_PER_DEG_LNG_EQUATOR * math.cos(math.radians(farthest_latitude))
+    return np.minimum(lat_gap * KM_PER_DEG_LAT, lng_gap * km_per_deg_lng)
+
+
+def _ring_cells(row: int, col: int, ring: int):
+    """Cells at Chebyshev distance `ring` from (row, col)"""
+    if ring == 0:
+        yield (row, col)
+        return
+    for c in range(col - ring, col + ring + 1):
+        yield (row - ring, c)
+        yield (row + ring, c)
+    for r in range(row - ring + 1, row + ring):
+        yield (r, col - ring)
+        yield (r, col + ring)
@@ -0,0 +1,133 @@
+"""
+Learned valuation models
+Pluggable price-per-m² predictors fitted on gold-layer data, loaded from memory-mapped artifacts
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from valuation_model import normalize_location_key
+
+# Numeric inputs of the linear model, in weight order (None counts as 0)
+NUMERIC_FEATURES = [
+    'size', 'bedrooms', 'bathrooms', 'floor',
+    'hasParking', 'hasElevator', 'hasGarden', 'hasPool', 'hasSeaView',
+]
+# Categorical inputs, each with its own block of effects
+CATEGORICAL_FEATURES = ['governorate', 'region', 'propertyType', 'transactionType']
+
+ARTIFACT_METADATA_FILE = 'model.json'
+ARTIFACT_WEIGHTS_FILE = 'weights.npy'
+# Optional refreshed regional price table (governorate -> delegation -> TND/m²)
+REGIONAL_PRICES_FILE = 'regional_prices.json'
+# Name of the newest artifact in a directory of versioned artifacts (see train_model.py)
+LATEST_FILE = 'LATEST'
+
+
+def category_value(property_data: Dict, feature: str) -> str:
+    """Canonical category of a property for one categorical feature"""
+    if feature == 'governorate':
+        return normalize_location_key(property_data.get('governorate') or '')
+    if feature == 'region':
+        return '{}|{}'.format(
+            normalize_location_key(property_data.get('governorate') or ''),
+            normalize_location_key(property_data.get('delegation') or ''),
+        )
+    return (property_data.get(feature) or '').upper()
+
+
+class FeatureEncoder:
+    """
+    Precompiled encoder from property dicts to weight indices
+
+    The artifact's vocabularies are compiled once into dicts mapping each
+    category to the absolute index of its effect in the weight vector;
+    unknown categories map to -1 and contribute nothing.
+    """
+
+    def __init__(self, metadata: Dict):
+        self.numeric_offset = metadata['offsets']['numeric']
+        self.categorical_indices: Dict[str, Dict[str, int]] = {}
+        for feature in CATEGORICAL_FEATURES:
+            offset = metadata['offsets'][feature]
+            vocabulary = metadata['vocabularies'][feature]
+            self.categorical_indices[feature] = {value: offset + i for i, value in enumerate(vocabulary)}
+
+    def encode(self, properties: List[Dict]):
+        """Numeric matrix (rows x NUMERIC_FEATURES) and one index column per categorical feature"""
+        count = len(properties)
+        numeric = np.zeros((count, len(NUMERIC_FEATURES)), dtype=np.float64)
+        for j, feature in enumerate(NUMERIC_FEATURES):
+            numeric[:, j] = [float(p.get(feature) or 0) for p in properties]
+
+        categorical = {}
+        for feature, indices in self.categorical_indices.items():
+            categorical[feature] = np.fromiter(
+                (indices.get(category_value(p, feature), -1) for p in properties),
+                dtype=np.intp,
+                count=count
+            )
+        return numeric, categorical
+
+
+class LinearPricePredictor:
+    """
+    Additive linear model of price per m²
+
+    price_per_m2 = intercept + Σ weight·numeric feature + governorate effect
+                   + delegation effect + property type effect + transaction effect
+
+    Weights live in a memory-mapped .npy next to a model.json holding the
+    version, vocabularies, weight offsets and default blend weight; an
+    optional regional_prices.json replaces the rule table's base prices. The sum
+    is accumulated term by term with element-wise operations only, so a row
+    gets the same prediction whether it is valued alone or in a batch.
+    """
+
+    def __init__(self, artifact_dir: str):
+        with open(os.path.join(artifact_dir, ARTIFACT_METADATA_FILE), 'r', encoding='utf-8') as f:
+            self.metadata = json.load(f)
+        self.artifact_dir = artifact_dir
+        self.version = self.metadata['version']
+        self.blend_weight = float(self.metadata.get('blend_weight', 0.5))
+        self.weights = np.load(os.path.join(artifact_dir, ARTIFACT_WEIGHTS_FILE), mmap_mode='r')
+        self.encoder = FeatureEncoder(self.metadata)
+        self.regional_prices: Optional[Dict[str, Dict[str, float]]] = None
+        regional_prices_path = os.path.join(artifact_dir, REGIONAL_PRICES_FILE)
+        if os.path.exists(regional_prices_path):
+            with open(regional_prices_path, 'r', encoding='utf-8') as f:
+                self.regional_prices = json.load(f)
+
+    def predict(self, properties: List[Dict]) -> np.ndarray:
+        """Predicted price per m² for every property"""
+        numeric, categorical = self.encoder.encode(properties)
+        weights = self.weights
+        prediction = np.full(len(properties), float(weights[0]))
+        offset = self.encoder.numeric_offset
+        for j in range(len(NUMERIC_FEATURES)):
+            prediction = prediction + numeric[:, j] * float(weights[offset + j])
+        for feature in CATEGORICAL_FEATURES:
+            indices = categorical[feature]
+            prediction = prediction + np.where(indices >= 0, weights[np.maximum(indices, 0)], 0.0)
+        return prediction
+
+
+def resolve_artifact_dir(path: str) -> str:
+    """An artifact directory, or the one named by LATEST in a directory of versioned artifacts"""
+    if os.path.exists(os.path.join(path, ARTIFACT_METADATA_FILE)):
+        return path
+    latest_path = os.path.join(path, LATEST_FILE)
+    if os.path.exists(latest_path):
+        with open(latest_path, 'r', encoding='utf-8') as f:
+            return os.path.join(path, f.read().strip())
+    return path
+
+
+def load_predictor(artifact_dir: Optional[str]) -> Optional[LinearPricePredictor]:
+    """Load a predictor artifact, or None when no artifact is configured"""
+    if not artifact_dir:
+        return None
+    return LinearPricePredictor(resolve_artifact_dir(artifact_dir))
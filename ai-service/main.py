@@ -1,17 +1,69 @@
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Request, Response, Depends
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, ValidationError
+from typing import AsyncIterator, List, Optional, Dict
+import json
+import logging
 import os
+import time
 from dotenv import load_dotenv
-from valuation_model import PropertyValuationModel
+from model_registry import ModelRegistry, ModelVersion, UnknownModelVersion
+from shared_state import ensure_comparables_snapshot
+from serialization import (
+    NDJSON_MEDIA_TYPE,
+    batch_payload,
+    encode_stream_item,
+    negotiate_media_type,
+    render,
+    valuation_payload,
+)
+from valuation_cache import feature_key
+from micro_batcher import MicroBatcher
+from metrics import (
+    BATCH_SIZE,
+    CACHE_ENTRIES,
+    CACHE_HIT_RATIO,
+    CACHE_HITS,
+    CACHE_MISSES,
+    COMPARABLES_LISTINGS,
+    MODEL_ACTIVE,
+    PROMETHEUS_CONTENT_TYPE,
+    REGISTRY,
+    RequestMetricsMiddleware,
+    STAGE_SECONDS,
+    VALUATIONS,
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load and warm the model, run background refresh tasks, then stop the worker pools"""
+    # Not at import: spawned worker processes (and uvicorn workers) import this module too
+    await run_in_threadpool(model_registry.load, activate=True)
+    tasks = []
+    if COMPARABLES_REFRESH_SECONDS > 0 and model_registry.comparables_index is not None:
+        tasks.append(asyncio.create_task(_refresh_comparables_periodically()))
+    if MODEL_WATCH_SECONDS > 0 and MODEL_OPTIONS["artifact_dir"]:
+        tasks.append(asyncio.create_task(_watch_model_artifact()))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        model_registry.shutdown()
+
 app = FastAPI(
     title="EstateMind AI Service",
     version="1.0.0",
-    description="AI-powered property valuation service for Tunisia real estate"
+    description="AI-powered property valuation service for Tunisia real estate",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -23,8 +75,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize valuation model
-valuation_model = PropertyValuationModel()
+# Request latency by route, exposed on /metrics
+app.add_middleware(RequestMetricsMiddleware)
+
+# Gold-layer listings used as comparables
+COMPARABLES_GOLD_DIR = os.getenv(
+    "COMPARABLES_GOLD_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scrapers", "data", "gold")
+)
+COMPARABLES_REFRESH_SECONDS = float(os.getenv("COMPARABLES_REFRESH_SECONDS", "300"))
+
+# Directory for memory-mapped comparables snapshots shared by all worker processes
+# on the host (unset = every process indexes the gold files in memory)
+MODEL_SHARED_STATE_DIR = os.getenv("MODEL_SHARED_STATE_DIR") or None
+
+# Optional learned model artifact blended with the rules
+VALUATION_MODEL_ARTIFACT = os.getenv("VALUATION_MODEL_ARTIFACT") or None
+VALUATION_MODEL_BLEND = os.getenv("VALUATION_MODEL_BLEND")
+
+MODEL_OPTIONS = {
+    "gold_dir": COMPARABLES_GOLD_DIR,
+    "artifact_dir": VALUATION_MODEL_ARTIFACT,
+    "blend_weight": float(VALUATION_MODEL_BLEND) if VALUATION_MODEL_BLEND else None,
+    "shared_state_dir": MODEL_SHARED_STATE_DIR,
+}
+
+# Seconds between checks for a newly published model artifact (0 disables)
+MODEL_WATCH_SECONDS = float(os.getenv("MODEL_WATCH_SECONDS", "30"))
+
+# Loaded model versions; each gets its own worker pool and result cache
+model_registry = ModelRegistry(
+    MODEL_OPTIONS,
+    # Batch valuation worker pool (0 workers = single background thread)
+    pool_options={
+        "workers": int(os.getenv("VALUATION_WORKERS", "0")),
+        "chunk_size": int(os.getenv("VALUATION_WORKER_CHUNK_SIZE", "2000")),
+        "min_parallel_batch": int(os.getenv("VALUATION_PARALLEL_MIN_BATCH", "2000")),
+        "refresh_seconds": COMPARABLES_REFRESH_SECONDS,
+    },
+    # Valuation result cache (size 0 disables it)
+    cache_options={
+        "max_size": int(os.getenv("VALUATION_CACHE_SIZE", "10000")),
+        "ttl_seconds": float(os.getenv("VALUATION_CACHE_TTL", "3600")),
+    },
+    max_versions=int(os.getenv("MODEL_REGISTRY_MAX_VERSIONS", "3"))
+)
+
+# Coalescing of concurrent single estimates (window 0 disables it)
+MICROBATCH_WINDOW_MS = float(os.getenv("VALUATION_MICROBATCH_WINDOW_MS", "0"))
+MICROBATCH_MAX_SIZE = int(os.getenv("VALUATION_MICROBATCH_MAX_SIZE", "64"))
+
+# Rows valued together by the streaming endpoint
+STREAM_CHUNK_SIZE = int(os.getenv("VALUATION_STREAM_CHUNK_SIZE", "256"))
+# Longest NDJSON row accepted by the streaming endpoint (bytes)
+STREAM_MAX_LINE_BYTES = int(os.getenv("VALUATION_STREAM_MAX_LINE_BYTES", str(64 * 1024)))
 
 # API Key authentication
 API_KEY = os.getenv("AI_SERVICE_API_KEY", "dev-api-key")
@@ -57,9 +161,13 @@ class ValuationRequest(BaseModel):
     propertyId: str
     features: PropertyFeatures
     comparables: Optional[List[dict]] = []
+    includeInsights: bool = True  # Skip aiInsights generation when False
+    includeBreakdown: bool = True  # Skip the price breakdown when False
 
 class BatchValuationRequest(BaseModel):
     properties: List[ValuationRequest]
+    includeInsights: bool = True  # Applies to every property in the batch
+    includeBreakdown: bool = True
 
 class ValuationResponse(BaseModel):
     propertyId: str
@@ -71,7 +179,7 @@ class ValuationResponse(BaseModel):
     sizeScore: int
     conditionScore: int
     amenitiesScore: int
-    aiInsights: str
+    aiInsights: Optional[str] = None
     isPriceFair: str
     breakdown: Optional[Dict] = None
 
@@ -81,6 +189,103 @@ class BatchValuationResponse(BaseModel):
     results: List[ValuationResponse]
     errors: List[Dict]
 
+class ModelLoadRequest(BaseModel):
+    artifactDir: Optional[str] = None  # Defaults to VALUATION_MODEL_ARTIFACT
+    blendWeight: Optional[float] = None
+    rulesOnly: bool = False  # Load the rule-based model without an artifact
+    activate: bool = True
+
+# Request-level stage timers
+_VALIDATION_TIMER = STAGE_SECONDS.labels("request", "validation")
+_SERIALIZATION_TIMER = STAGE_SECONDS.labels("request", "serialization")
+
+def _observe_validation(http_request: Request):
+    """Time from request arrival to the handler: body parsing and model validation"""
+    started = getattr(http_request.state, "request_started", None)
+    if started is not None:
+        _VALIDATION_TIMER.observe(time.perf_counter() - started)
+
+def _count_outcomes(model: ModelVersion, endpoint: str, outcomes: List):
+    failed = sum(1 for outcome in outcomes if isinstance(outcome, Exception))
+    if failed:
+        VALUATIONS.labels(model.version, endpoint, "error").inc(failed)
+    if len(outcomes) > failed:
+        VALUATIONS.labels(model.version, endpoint, "success").inc(len(outcomes) - failed)
+
+def _render_timed(payload, media_type: str, model: ModelVersion):
+    started = time.perf_counter()
+    response = render(payload, media_type, headers={"X-Model-Version": model.version})
+    _SERIALIZATION_TIMER.observe(time.perf_counter() - started)
+    return response
+
+def get_model_version(
+    response: Response,
+    model_version: Optional[str] = Header(None, alias="X-Model-Version")
+) -> ModelVersion:
+    """Model serving this request: the X-Model-Version pin, or the active version"""
+    try:
+        entry = model_registry.get(model_version)
+    except UnknownModelVersion:
+        raise HTTPException(status_code=404, detail=f"Model version not loaded: {model_version}")
+    response.headers["X-Model-Version"] = entry.version
+    return entry
+
+async def _estimate_batch(model: ModelVersion, properties: List[Dict], include_insights: bool,
+                          include_breakdown: bool, endpoint: str = "batch") -> List:
+    """Value a batch, serving cached rows and sending only misses to the worker pool"""
+    BATCH_SIZE.labels(endpoint).observe(len(properties))
+    if not model.cache.enabled:
+        outcomes = await model.worker_pool.estimate(properties, include_insights, include_breakdown)
+        _count_outcomes(model, endpoint, outcomes)
+        return outcomes
+    
+    outcomes, keys = await run_in_threadpool(
+        model.cache.lookup_many, properties, include_insights, include_breakdown
+    )
+    misses = [i for i, outcome in enumerate(outcomes) if outcome is None]
+    if misses:
+        computed = await model.worker_pool.estimate(
+            [properties[i] for i in misses], include_insights, include_breakdown
+        )
+        for i, outcome in zip(misses, computed):
+            outcomes[i] = outcome
+        await run_in_threadpool(model.cache.store_many, [keys[i] for i in misses], computed)
+    _count_outcomes(model, endpoint, outcomes)
+    return outcomes
+
+async def _estimate_coalesced(model: ModelVersion, properties: List[Dict], include_insights: bool,
+                              include_breakdown: bool) -> List:
+    """Value a micro-batch of single estimates (cache lookups already done by each request)"""
+    BATCH_SIZE.labels("estimate").observe(len(properties))
+    outcomes = await model.worker_pool.estimate(properties, include_insights, include_breakdown)
+    model.cache.store_many(
+        [feature_key(p, include_insights, include_breakdown) for p in properties], outcomes
+    )
+    return outcomes
+
+micro_batcher = (
+    MicroBatcher(_estimate_coalesced, window_ms=MICROBATCH_WINDOW_MS, max_batch=MICROBATCH_MAX_SIZE)
+    if MICROBATCH_WINDOW_MS > 0 else None
+)
+
+async def _refresh_comparables_periodically():
+    """Load gold batches that landed since the last scan"""
+    while True:
+        await asyncio.sleep(COMPARABLES_REFRESH_SECONDS)
+        try:
+            await run_in_threadpool(model_registry.comparables_index.refresh)
+        except Exception as e:
+            logger.error(f"Comparables refresh failed: {e}")
+
+async def _watch_model_artifact():
+    """Load and switch to a model artifact published after startup"""
+    while True:
+        await asyncio.sleep(MODEL_WATCH_SECONDS)
+        try:
+            await run_in_threadpool(model_registry.check_for_update)
+        except Exception as e:
+            logger.error(f"Model reload failed: {e}")
+
 @app.get("/")
 def read_root():
     return {
@@ -90,23 +295,92 @@ def read_root():
         "endpoints": {
             "/api/v1/valuations/estimate": "Single property valuation",
             "/api/v1/valuations/batch": "Batch property valuation",
-            "/health": "Health check"
+            "/api/v1/valuations/batch/stream": "Streaming NDJSON batch valuation",
+            "/api/v1/models": "Loaded model versions (admin)",
+            "/health": "Health check",
+            "/metrics": "Prometheus metrics"
         }
     }
 
 @app.get("/health")
 def health_check():
+    active = model_registry.active
+    comparables_index = model_registry.comparables_index
     return {
         "status": "healthy",
         "service": "ai-valuation",
-        "model": "rule-based-v1",
-        "regions_supported": len(valuation_model.regional_prices)
+        "model": active.version,
+        "models_loaded": len(model_registry.versions()),
+        "regions_supported": len(active.model.regional_prices),
+        "comparables": comparables_index.stats() if comparables_index is not None else None,
+        "cache": active.cache.stats()
     }
 
-@app.post("/api/v1/valuations/estimate", response_model=ValuationResponse)
+def _collect_model_metrics():
+    """Refresh scrape-time gauges from the model registry"""
+    active = model_registry.active
+    for metric in (CACHE_HITS, CACHE_MISSES, CACHE_HIT_RATIO, CACHE_ENTRIES, MODEL_ACTIVE):
+        metric.clear()
+    for info in model_registry.versions():
+        version = info["version"]
+        stats = model_registry.get(version).cache.stats()
+        CACHE_HITS.labels(version).set(stats["hits"])
+        CACHE_MISSES.labels(version).set(stats["misses"])
+        CACHE_HIT_RATIO.labels(version).set(stats["hitRate"])
+        CACHE_ENTRIES.labels(version).set(stats["size"])
+        MODEL_ACTIVE.labels(version).set(1 if version == active.version else 0)
+    comparables_index = model_registry.comparables_index
+    if comparables_index is not None:
+        COMPARABLES_LISTINGS.set(comparables_index.stats()["listings"])
+
+REGISTRY.add_collector(_collect_model_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics: stage and request latency, batch sizes, cache and per-version counters"""
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/api/v1/models", dependencies=[Depends(verify_api_key)])
+def list_models():
+    """Loaded model versions; requests pin one with the X-Model-Version header"""
+    return {"active": model_registry.active.version, "models": model_registry.versions()}
+
+@app.post("/api/v1/models/load", dependencies=[Depends(verify_api_key)])
+async def load_model(request: ModelLoadRequest):
+    """
+    Load and warm up a model version, then optionally make it the active one
+    
+    The current version keeps serving while the new one loads; requests
+    already running finish on the version they started with.
+    """
+    try:
+        entry = await run_in_threadpool(
+            model_registry.load,
+            artifact_dir=request.artifactDir,
+            blend_weight=request.blendWeight,
+            activate=request.activate,
+            use_defaults=not request.rulesOnly
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Model load error: {str(e)}")
+    return dict(entry.describe(), active=model_registry.active is entry)
+
+@app.post("/api/v1/models/{version}/activate", dependencies=[Depends(verify_api_key)])
+def activate_model(version: str):
+    """Serve unpinned requests with an already loaded version"""
+    try:
+        entry = model_registry.activate(version)
+    except UnknownModelVersion:
+        raise HTTPException(status_code=404, detail=f"Model version not loaded: {version}")
+    return dict(entry.describe(), active=True)
+
+@app.post("/api/v1/valuations/estimate", response_model=ValuationResponse, response_model_exclude_none=True)
 async def estimate_property_value(
     request: ValuationRequest,
-    api_key: str = Header(None, alias="X-API-Key")
+    http_request: Request,
+    api_key: str = Header(None, alias="X-API-Key"),
+    accept: Optional[str] = Header(None),
+    model: ModelVersion = Depends(get_model_version)
 ):
     """
     Estimate property value using rule-based valuation model
@@ -116,96 +390,229 @@ async def estimate_property_value(
     - Property type and features
     - Location desirability
     - Amenities and condition
+    
+    Set includeInsights / includeBreakdown to false to skip those fields.
+    With VALUATION_MICROBATCH_WINDOW_MS set, concurrent requests are valued
+    together by the batch engine (same results). Send X-Model-Version to
+    pin a loaded model version, and Accept: application/msgpack for a
+    msgpack response.
     """
+    _observe_validation(http_request)
+    
     # Verify API key in production
     if os.getenv("NODE_ENV") == "production" and api_key != API_KEY:
         raise HTTPException(status_code=401, detail="Invalid API key")
     
     try:
         # Convert features to dict
-        property_data = request.features.dict()
+        property_data = request.features.model_dump()
         
-        # Run valuation
-        result = valuation_model.estimate_value(property_data)
+        # Run valuation, reusing a cached result for identical features
+        cache_key = feature_key(property_data, request.includeInsights, request.includeBreakdown)
+        result = model.cache.get(cache_key)
+        if result is None and micro_batcher is not None:
+            # Value together with concurrent single requests
+            result = await micro_batcher.submit(
+                model, property_data, request.includeInsights, request.includeBreakdown
+            )
+        elif result is None:
+            result = model.model.estimate_value(
+                property_data,
+                include_insights=request.includeInsights,
+                include_breakdown=request.includeBreakdown
+            )
+            model.cache.put(cache_key, result)
         
-        # Format response
-        return ValuationResponse(
-            propertyId=request.propertyId,
-            estimatedValue=result['estimatedValue'],
-            confidenceScore=result['confidenceScore'],
-            minValue=result['minValue'],
-            maxValue=result['maxValue'],
-            locationScore=result['locationScore'],
-            sizeScore=result['sizeScore'],
-            conditionScore=result['conditionScore'],
-            amenitiesScore=result['amenitiesScore'],
-            aiInsights=result['aiInsights'],
-            isPriceFair=result['isPriceFair'],
-            breakdown=result.get('breakdown')
-        )
-    
     except Exception as e:
+        VALUATIONS.labels(model.version, "estimate", "error").inc()
         raise HTTPException(status_code=500, detail=f"Valuation error: {str(e)}")
+    VALUATIONS.labels(model.version, "estimate", "success").inc()
+    
+    # Format response, encoding the result dict directly
+    return _render_timed(valuation_payload(request.propertyId, result), negotiate_media_type(accept), model)
 
-@app.post("/api/v1/valuations/batch", response_model=BatchValuationResponse)
+@app.post("/api/v1/valuations/batch", response_model=BatchValuationResponse, response_model_exclude_none=True)
 async def batch_valuation(
     request: BatchValuationRequest,
-    api_key: str = Header(None, alias="X-API-Key")
+    http_request: Request,
+    api_key: str = Header(None, alias="X-API-Key"),
+    accept: Optional[str] = Header(None),
+    model: ModelVersion = Depends(get_model_version)
 ):
     """
     Batch valuation for multiple properties
     
     Useful for investors who need to value multiple properties at once.
-    Processes properties in parallel for faster results.
+    Properties are valued together by the columnar batch engine, off the
+    event loop; large batches are split across VALUATION_WORKERS processes.
+    Set includeInsights / includeBreakdown to false to skip those fields
+    for the whole batch. Results are encoded straight from the model's
+    dicts, as JSON or (Accept: application/msgpack) msgpack.
     """
+    _observe_validation(http_request)
+    
     # Verify API key in production
     if os.getenv("NODE_ENV") == "production" and api_key != API_KEY:
         raise HTTPException(status_code=401, detail="Invalid API key")
     
     results = []
     errors = []
-    success_count = 0
-    failed_count = 0
     
-    for prop_request in request.properties:
-        try:
-            # Convert features to dict
-            property_data = prop_request.features.dict()
-            
-            # Run valuation
-            result = valuation_model.estimate_value(property_data)
-            
-            # Add to results
-            results.append(ValuationResponse(
-                propertyId=prop_request.propertyId,
-                estimatedValue=result['estimatedValue'],
-                confidenceScore=result['confidenceScore'],
-                minValue=result['minValue'],
-                maxValue=result['maxValue'],
-                locationScore=result['locationScore'],
-                sizeScore=result['sizeScore'],
-                conditionScore=result['conditionScore'],
-                amenitiesScore=result['amenitiesScore'],
-                aiInsights=result['aiInsights'],
-                isPriceFair=result['isPriceFair'],
-                breakdown=result.get('breakdown')
-            ))
-            success_count += 1
-            
-        except Exception as e:
+    # Value the whole batch in one columnar pass
+    outcomes = await _estimate_batch(
+        model,
+        [p.features.model_dump() for p in request.properties],
+        include_insights=request.includeInsights,
+        include_breakdown=request.includeBreakdown
+    )
+    
+    for prop_request, result in zip(request.properties, outcomes):
+        if isinstance(result, Exception):
             errors.append({
                 "propertyId": prop_request.propertyId,
-                "error": str(e)
+                "error": str(result)
             })
-            failed_count += 1
+            continue
+        
+        # Add to results
+        results.append(valuation_payload(prop_request.propertyId, result))
+    
+    return _render_timed(batch_payload(results, errors), negotiate_media_type(accept), model)
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body iterator is still reading the request
+    
+    Starlette's disconnect listener would consume the remaining request body
+    messages, so it is skipped; the iterator sees client disconnects through
+    request.stream() instead.
+    """
+    
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+class StreamRowTooLarge(Exception):
+    """An NDJSON row exceeded STREAM_MAX_LINE_BYTES"""
+
+async def _read_ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """Yield NDJSON lines from the request body as they arrive"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+        if len(pending) > STREAM_MAX_LINE_BYTES:
+            raise StreamRowTooLarge(f"NDJSON row exceeds {STREAM_MAX_LINE_BYTES} bytes")
+    yield pending
+
+async def _value_stream_chunk(
+    model: ModelVersion,
+    rows: List[ValuationRequest],
+    include_insights: bool,
+    include_breakdown: bool,
+    media_type: str
+) -> List[bytes]:
+    """Value a chunk of streamed rows and encode one output item per row"""
+    outcomes = await _estimate_batch(
+        model,
+        [row.features.model_dump() for row in rows],
+        include_insights=include_insights,
+        include_breakdown=include_breakdown,
+        endpoint="stream"
+    )
+    started = time.perf_counter()
+    lines = []
+    for row, result in zip(rows, outcomes):
+        if isinstance(result, Exception):
+            payload = {"propertyId": row.propertyId, "error": str(result)}
+        else:
+            payload = valuation_payload(row.propertyId, result)
+        lines.append(encode_stream_item(payload, media_type))
+    _SERIALIZATION_TIMER.observe(time.perf_counter() - started)
+    return lines
+
+@app.post("/api/v1/valuations/batch/stream")
+async def stream_batch_valuation(
+    request: Request,
+    includeInsights: bool = True,
+    includeBreakdown: bool = True,
+    api_key: str = Header(None, alias="X-API-Key"),
+    accept: Optional[str] = Header(None),
+    model: ModelVersion = Depends(get_model_version)
+):
+    """
+    Streaming batch valuation over NDJSON
+    
+    The request body holds one ValuationRequest per line. Rows are read
+    incrementally, valued in chunks of STREAM_CHUNK_SIZE and written back as
+    one NDJSON line per row, in input order, so memory stays bounded by the
+    chunk size. Failed rows are reported inline as {"propertyId", "error"}
+    (or {"line", "error"} when the row cannot be parsed). The whole stream
+    is valued by one model version. With Accept: application/msgpack the
+    output is a sequence of msgpack objects instead of NDJSON lines.
+    """
+    # Verify API key in production
+    if os.getenv("NODE_ENV") == "production" and api_key != API_KEY:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    
+    media_type = negotiate_media_type(accept, default=NDJSON_MEDIA_TYPE)
+    
+    async def results() -> AsyncIterator[bytes]:
+        chunk: List[ValuationRequest] = []
+        line_number = 0
+        try:
+            async for line in _read_ndjson_lines(request):
+                line_number += 1
+                if not line.strip():
+                    continue
+                
+                try:
+                    started = time.perf_counter()
+                    chunk.append(ValuationRequest(**json.loads(line)))
+                    _VALIDATION_TIMER.observe(time.perf_counter() - started)
+                except (ValueError, TypeError, ValidationError) as e:
+                    # Flush pending rows first so output keeps input order
+                    if chunk:
+                        for output in await _value_stream_chunk(model, chunk, includeInsights, includeBreakdown, media_type):
+                            yield output
+                        chunk = []
+                    yield encode_stream_item({"line": line_number, "error": str(e)}, media_type)
+                    continue
+                
+                if len(chunk) >= STREAM_CHUNK_SIZE:
+                    for output in await _value_stream_chunk(model, chunk, includeInsights, includeBreakdown, media_type):
+                        yield output
+                    chunk = []
+        except StreamRowTooLarge as e:
+            # The rest of the body cannot be framed
+            if chunk:
+                for output in await _value_stream_chunk(model, chunk, includeInsights, includeBreakdown, media_type):
+                    yield output
+            yield encode_stream_item({"line": line_number + 1, "error": str(e)}, media_type)
+            return
+        
+        if chunk:
+            for output in await _value_stream_chunk(model, chunk, includeInsights, includeBreakdown, media_type):
+                yield output
     
-    return BatchValuationResponse(
-        success=success_count,
-        failed=failed_count,
-        results=results,
-        errors=errors
+    return DuplexStreamingResponse(
+        results(),
+        media_type=media_type,
+        headers={"X-Model-Version": model.version}
     )
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Several server processes each load the model in their lifespan; set
+    # MODEL_SHARED_STATE_DIR so they share one comparables snapshot instead of one index each
+    workers = int(os.getenv("AI_SERVICE_WORKERS", "1"))
+    if workers > 1:
+        if MODEL_SHARED_STATE_DIR and COMPARABLES_GOLD_DIR:
+            # Built once here; the workers only attach to it
+            ensure_comparables_snapshot(COMPARABLES_GOLD_DIR, MODEL_SHARED_STATE_DIR)
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
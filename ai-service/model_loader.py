@@ -0,0 +1,39 @@
+"""
+Valuation model assembly
+Builds a PropertyValuationModel with its optional comparables index and learned predictor
+"""
+
+from typing import Optional
+
+from valuation_model import PropertyValuationModel
+from comparables import ComparablesIndex
+from learned_model import load_predictor
+from shared_state import MappedComparablesIndex
+
+
+def open_comparables_index(gold_dir: str, shared_state_dir: Optional[str] = None) -> ComparablesIndex:
+    """Comparables index over gold_dir, memory-mapped from shared_state_dir when given"""
+    if shared_state_dir:
+        return MappedComparablesIndex(gold_dir, shared_state_dir).refresh()
+    return ComparablesIndex(gold_dir).refresh()
+
+
+def load_valuation_model(gold_dir: Optional[str] = None, artifact_dir: Optional[str] = None,
+                         blend_weight: Optional[float] = None,
+                         comparables_index: Optional[ComparablesIndex] = None,
+                         shared_state_dir: Optional[str] = None) -> PropertyValuationModel:
+    """
+    Build a valuation model
+
+    Args:
+        gold_dir: Gold-layer directory to index for comparables (None disables them)
+        artifact_dir: Learned model artifact to blend with the rules (None = rules only)
+        blend_weight: Overrides the artifact's default blend weight
+        comparables_index: Already loaded index to share instead of indexing gold_dir again
+        shared_state_dir: Directory of memory-mapped snapshots shared by worker processes
+            (None = each process indexes gold_dir in memory)
+    """
+    if comparables_index is None and gold_dir:
+        comparables_index = open_comparables_index(gold_dir, shared_state_dir)
+    predictor = load_predictor(artifact_dir)
+    return PropertyValuationModel(comparables_index, predictor, blend_weight)
@@ -0,0 +1,234 @@
+"""
+Registry of loaded valuation model versions
+Loads and warms new versions in the background and switches between them without dropping requests
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from batch_engine import BatchValuationEngine
+from comparables import ComparablesIndex
+from learned_model import ARTIFACT_METADATA_FILE, resolve_artifact_dir
+from model_loader import load_valuation_model, open_comparables_index
+from valuation_cache import ValuationCache
+from valuation_model import PropertyValuationModel
+from worker_pool import ValuationWorkerPool
+
+logger = logging.getLogger(__name__)
+
+# Where warm-up properties are placed when comparables are enabled (Tunis centre)
+WARMUP_LOCATION = (36.8065, 10.1815)
+
+
+class UnknownModelVersion(KeyError):
+    """No model with the requested version is loaded"""
+
+
+class ModelVersion:
+    """
+    One loaded model with everything that serves it
+
+    Requests take a ModelVersion once and use it until they finish, so a
+    version switch never changes the model under an in-flight request.
+    """
+
+    def __init__(self, model: PropertyValuationModel, options: Dict,
+                 pool_options: Dict, cache_options: Dict, version: Optional[str] = None):
+        self.model = model
+        self.version = version or model.version
+        self.options = options
+        self.engine = BatchValuationEngine(model)
+        self.worker_pool = ValuationWorkerPool(self.engine, model_options=options, **pool_options)
+        self.cache = ValuationCache(model, **cache_options)
+        self.loaded_at = time.time()
+
+    def warm_up(self):
+        """Value one property per region so lookups, weights and worker processes are hot"""
+        latitude, longitude = WARMUP_LOCATION
+        properties = [
+            {
+                'governorate': governorate,
+                'delegation': delegation,
+                'propertyType': 'APARTMENT',
+                'transactionType': 'SALE',
+                'size': 100.0,
+                'latitude': latitude,
+                'longitude': longitude,
+            }
+            for governorate, delegation in self.model.price_index.regions
+            if delegation
+        ]
+        self.engine.estimate(properties)
+        if properties:
+            self.model.estimate_value(properties[0])
+        self.worker_pool.warm_up()
+
+    def describe(self) -> Dict:
+        return {
+            'version': self.version,
+            'artifactDir': self.options.get('artifact_dir'),
+            'blendWeight': self.model.blend_weight,
+            'loadedAt': self.loaded_at,
+        }
+
+
+def artifact_signature(artifact_dir: Optional[str]) -> Optional[Tuple[str, float]]:
+    """Resolved artifact directory and model.json mtime, used to detect a new artifact"""
+    if not artifact_dir:
+        return None
+    resolved = resolve_artifact_dir(artifact_dir)
+    try:
+        return resolved, os.stat(os.path.join(resolved, ARTIFACT_METADATA_FILE)).st_mtime
+    except OSError:
+        return None
+
+
+class ModelRegistry:
+    """
+    Loaded model versions and the one serving unpinned requests
+
+    load() builds and warms a version on the calling thread (run it off the
+    event loop) while the current version keeps serving; activate() then
+    swaps the active reference under a lock. Up to max_versions stay loaded
+    so requests can pin one; the oldest inactive versions are retired once
+    their queued work is done. All versions share one comparables index.
+
+    Loading a model whose version is already taken (the same artifact again,
+    or with another blend weight) registers it as "<version>-2", "<version>-3"
+    and so on, so a pinned version always names the same weights.
+    """
+
+    def __init__(self, base_options: Dict, pool_options: Optional[Dict] = None,
+                 cache_options: Optional[Dict] = None, max_versions: int = 3):
+        self.base_options = dict(base_options)
+        self.pool_options = pool_options or {}
+        self.cache_options = cache_options or {}
+        self.max_versions = max(1, max_versions)
+        # Opened by the first load(), so constructing a registry does no work
+        self.comparables_index: Optional[ComparablesIndex] = None
+
+        # Last seen state of the configured artifact, for check_for_update
+        self._watched_signature = artifact_signature(self.base_options.get('artifact_dir'))
+        self._versions: Dict[str, ModelVersion] = {}
+        self._active: Optional[ModelVersion] = None
+        # Loads per model version, used to give reloads a version of their own
+        self._load_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Serializes loads so a burst of reload triggers builds each version once
+        self._load_lock = threading.Lock()
+
+    @property
+    def active(self) -> ModelVersion:
+        return self._active
+
+    def load(self, artifact_dir: Optional[str] = None, blend_weight: Optional[float] = None,
+             activate: bool = False, use_defaults: bool = True) -> ModelVersion:
+        """
+        Build, warm up and register a model version (blocking)
+
+        Args:
+            artifact_dir: Learned model artifact or versioned artifact directory
+            blend_weight: Overrides the artifact's default blend weight
+            activate: Serve unpinned requests with the new version once it is warm
+            use_defaults: Fall back to the configured artifact/blend weight when not given
+        """
+        if use_defaults:
+            artifact_dir = artifact_dir or self.base_options.get('artifact_dir')
+            if blend_weight is None:
+                blend_weight = self.base_options.get('blend_weight')
+
+        with self._load_lock:
+            gold_dir = self.base_options.get('gold_dir')
+            if self.comparables_index is None and gold_dir:
+                self.comparables_index = open_comparables_index(gold_dir, self.base_options.get('shared_state_dir'))
+
+            # Pin the concrete artifact so worker processes build the same version
+            options = {
+                'gold_dir': self.base_options.get('gold_dir'),
+                'artifact_dir': resolve_artifact_dir(artifact_dir) if artifact_dir else None,
+                'blend_weight': blend_weight,
+                'shared_state_dir': self.base_options.get('shared_state_dir'),
+            }
+            model = load_valuation_model(comparables_index=self.comparables_index, **options)
+            loads = self._load_counts.get(model.version, 0) + 1
+            self._load_counts[model.version] = loads
+            version = model.version if loads == 1 else f"{model.version}-{loads}"
+            entry = ModelVersion(model, options, self.pool_options, self.cache_options, version=version)
+            entry.warm_up()
+
+            with self._lock:
+                self._versions[entry.version] = entry
+                if activate or self._active is None:
+                    self._active = entry
+                retired = self._evict()
+
+        logger.info(f"Loaded model {entry.version}" + (" (active)" if self._active is entry else ""))
+        self._retire(retired)
+        return entry
+
+    def activate(self, version: str) -> ModelVersion:
+        """Serve unpinned requests with an already loaded version"""
+        with self._lock:
+            entry = self._versions.get(version)
+            if entry is None:
+                raise UnknownModelVersion(version)
+            self._active = entry
+        logger.info(f"Activated model {version}")
+        return entry
+
+    def get(self, version: Optional[str] = None) -> ModelVersion:
+        """The pinned version, or the active one when version is None"""
+        if version is None:
+            return self._active
+        entry = self._versions.get(version)
+        if entry is None:
+            raise UnknownModelVersion(version)
+        return entry
+
+    def versions(self) -> List[Dict]:
+        with self._lock:
+            entries = sorted(self._versions.values(), key=lambda entry: entry.loaded_at)
+            active = self._active
+        return [dict(entry.describe(), active=entry is active) for entry in entries]
+
+    def check_for_update(self) -> Optional[ModelVersion]:
+        """Load and activate the configured artifact if a new one was published"""
+        artifact_dir = self.base_options.get('artifact_dir')
+        if not artifact_dir:
+            return None
+        signature = artifact_signature(artifact_dir)
+        if signature is None or signature == self._watched_signature:
+            return None
+        self._watched_signature = signature
+        logger.info(f"Model artifact changed: {signature[0]}")
+        return self.load(activate=True)
+
+    def _evict(self) -> List[ModelVersion]:
+        """Drop the oldest inactive versions beyond max_versions (lock held)"""
+        retired = []
+        inactive = sorted(
+            (entry for entry in self._versions.values() if entry is not self._active),
+            key=lambda entry: entry.loaded_at
+        )
+        while len(self._versions) > self.max_versions and inactive:
+            entry = inactive.pop(0)
+            del self._versions[entry.version]
+            retired.append(entry)
+        return retired
+
+    def _retire(self, entries: List[ModelVersion]):
+        """Stop the worker pools of retired versions once their queued chunks finish"""
+        for entry in entries:
+            logger.info(f"Retiring model {entry.version}")
+            threading.Thread(
+                target=entry.worker_pool.shutdown, kwargs={'cancel_futures': False}, daemon=True
+            ).start()
+
+    def shutdown(self):
+        with self._lock:
+            entries = list(self._versions.values())
+        for entry in entries:
+            entry.worker_pool.shutdown()
@@ -0,0 +1,145 @@
+"""
+Response serialization for the valuation endpoints
+Encodes valuation results straight from the model's dicts as JSON or, when negotiated, msgpack
+"""
+
+import json
+import math
+from typing import Any, Dict, List, Optional
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the standard library encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: msgpack is only offered when installed
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# Accepted spellings of the msgpack media type
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+# ValuationResponse fields that are integers, in field order
+_INT_FIELDS = ('estimatedValue', 'minValue', 'maxValue', 'locationScore', 'sizeScore',
+               'conditionScore', 'amenitiesScore')
+
+
+def _replace_non_finite(value: Any) -> Any:
+    """Copy of a payload with NaN and infinite floats replaced by None"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_non_finite(item) for item in value]
+    return value
+
+
+def dumps_json(payload: Any) -> bytes:
+    """
+    Compact UTF-8 JSON, the same document Starlette's JSONResponse would produce
+
+    NaN and infinite floats, which JSON cannot represent, are written as null
+    whether or not orjson is installed.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the standard encoder handles
+            pass
+    try:
+        return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        # Same output as orjson, which writes non-finite floats as null
+        return json.dumps(
+            _replace_non_finite(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+def dumps_msgpack(payload: Any) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def negotiate_media_type(accept: Optional[str], default: str = JSON_MEDIA_TYPE) -> str:
+    """
+    Pick the response format from an Accept header
+
+    msgpack is chosen only when it is installed and the client ranks it
+    above JSON; anything else gets the default format.
+    """
+    if not accept or msgpack is None:
+        return default
+
+    msgpack_quality = 0.0
+    json_quality = 0.0
+    for item in accept.split(","):
+        media_type, _, params = item.strip().partition(";")
+        media_type = media_type.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type in MSGPACK_MEDIA_TYPES:
+            msgpack_quality = max(msgpack_quality, quality)
+        elif media_type in (JSON_MEDIA_TYPE, default, "*/*", "application/*"):
+            json_quality = max(json_quality, quality)
+
+    return MSGPACK_MEDIA_TYPE if msgpack_quality > json_quality else default
+
+
+def valuation_payload(property_id: str, result: Dict) -> Dict:
+    """
+    A model result as a ValuationResponse body, without building the model
+
+    Same fields, order and types as ValuationResponse serialized with
+    exclude_none, so JSON clients see an identical document.
+    """
+    payload = {'propertyId': property_id}
+    payload['estimatedValue'] = int(result['estimatedValue'])
+    payload['confidenceScore'] = float(result['confidenceScore'])
+    for field in _INT_FIELDS[1:]:
+        payload[field] = int(result[field])
+    if result['aiInsights'] is not None:
+        payload['aiInsights'] = result['aiInsights']
+    payload['isPriceFair'] = result['isPriceFair']
+    if result.get('breakdown') is not None:
+        payload['breakdown'] = result['breakdown']
+    return payload
+
+
+def batch_payload(results: List[Dict], errors: List[Dict]) -> Dict:
+    """A BatchValuationResponse body"""
+    return {
+        'success': len(results),
+        'failed': len(errors),
+        'results': results,
+        'errors': errors,
+    }
+
+
+def render(payload: Any, media_type: str = JSON_MEDIA_TYPE, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Encode a payload in the negotiated format"""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        body = dumps_msgpack(payload)
+    else:
+        body = dumps_json(payload)
+        media_type = JSON_MEDIA_TYPE
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def encode_stream_item(payload: Any, media_type: str) -> bytes:
+    """One item of a streamed response: an NDJSON line or a msgpack object"""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return dumps_msgpack(payload)
+    return dumps_json(payload) + b"\n"
@@ -0,0 +1,406 @@
+"""
+Shared read-only model state for multi-worker deployments
+Comparables snapshots built once into memory-mapped files that every worker process attaches to
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from comparables import CELL_SIZE_DEG, ComparablesIndex, Listing, scan_gold_dir
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: snapshot builds are not serialized there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Snapshot layout: <state_dir>/CURRENT names the live snapshot-<sequence> directory
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = '.lock'
+# Held shared while opening a snapshot and exclusive while removing old ones
+ATTACH_LOCK_FILE = '.attach.lock'
+META_FILE = 'meta.json'
+# [latitude, longitude, size, price] per listing, grouped by partition and cell
+LISTINGS_FILE = 'listings.npy'
+# Sorted cell keys and the [start, end) listing range of each cell
+CELL_KEYS_FILE = 'cell_keys.npy'
+CELL_RANGES_FILE = 'cell_ranges.npy'
+# UTF-8 JSON summary of every listing, concatenated, with int64 offsets
+SUMMARIES_FILE = 'summaries.bin'
+SUMMARY_OFFSETS_FILE = 'summary_offsets.npy'
+# Position in meta's 'files' of the gold file each listing came from
+LISTING_FILES_FILE = 'listing_files.npy'
+# Snapshots kept on disk besides the current one, for workers still attached to them
+KEEP_OLD_SNAPSHOTS = 1
+
+# Cell keys pack partition code, row and column into one int64
+_COORD_BITS = 20
+_COORD_OFFSET = 1 << (_COORD_BITS - 1)
+
+
+def cell_key(partition_code: int, row: int, col: int) -> int:
+    return (partition_code << (2 * _COORD_BITS)) | ((row + _COORD_OFFSET) << _COORD_BITS) | (col + _COORD_OFFSET)
+
+
+def split_cell_key(key: int) -> Tuple[int, int, int]:
+    """(partition code, row, col) packed by cell_key"""
+    mask = (1 << _COORD_BITS) - 1
+    return key >> (2 * _COORD_BITS), ((key >> _COORD_BITS) & mask) - _COORD_OFFSET, (key & mask) - _COORD_OFFSET
+
+
+@contextmanager
+def _locked(state_dir: str, lock_file: str, exclusive: bool = True):
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, lock_file), 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _exclusive(state_dir: str):
+    """Cross-process lock so only one worker builds a snapshot at a time"""
+    return _locked(state_dir, LOCK_FILE)
+
+
+def _attaching(state_dir: str):
+    """Shared lock held while a worker opens a snapshot, so it isn't removed underneath"""
+    return _locked(state_dir, ATTACH_LOCK_FILE, exclusive=False)
+
+
+def current_snapshot(state_dir: str) -> Optional[str]:
+    """Directory of the live snapshot, or None"""
+    try:
+        with open(os.path.join(state_dir, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(state_dir, name)
+    return path if os.path.exists(os.path.join(path, META_FILE)) else None
+
+
+def _read_meta(snapshot_dir: Optional[str]) -> Optional[Dict]:
+    if snapshot_dir is None:
+        return None
+    with open(os.path.join(snapshot_dir, META_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _is_current(meta: Optional[Dict], gold_dir: str, files: Dict[str, Tuple[int, float]]) -> bool:
+    if meta is None:
+        return False
+    recorded = {name: tuple(signature) for name, signature in meta['files'].items()}
+    return meta['goldDir'] == os.path.abspath(gold_dir) and recorded == files
+
+
+def _index_rows(index: ComparablesIndex, partitions: Dict[Tuple[str, str], int],
+                file_codes: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[bytes]]:
+    """Coordinates, cell keys, gold file codes and encoded summaries of an index's listings"""
+    coordinates: List[Tuple[float, float, float, float]] = []
+    keys: List[int] = []
+    files: List[int] = []
+    summaries: List[bytes] = []
+    for key, (row, col), listings in index.cells():
+        packed = cell_key(partitions.setdefault(key, len(partitions)), row, col)
+        for listing in listings:
+            coordinates.append((listing.latitude, listing.longitude, listing.size, listing.price))
+            keys.append(packed)
+            files.append(file_codes[listing.source_file])
+            summaries.append(json.dumps(listing.summary, ensure_ascii=False).encode('utf-8'))
+    return (
+        np.array(coordinates, dtype=np.float64).reshape(-1, 4),
+        np.array(keys, dtype=np.int64),
+        np.array(files, dtype=np.int32),
+        summaries,
+    )
+
+
+def _snapshot_rows(snapshot_dir: str, meta: Dict,
+                   file_codes: Dict[str, int]) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, List[bytes]]]:
+    """Rows of a snapshot whose gold file is in file_codes, renumbered; None if it doesn't record files"""
+    files_path = os.path.join(snapshot_dir, LISTING_FILES_FILE)
+    if meta.get('cellSizeDeg') != CELL_SIZE_DEG or not os.path.exists(files_path):
+        return None
+    renumber = np.array([file_codes.get(name, -1) for name in meta['files']] + [-1], dtype=np.int32)
+    listing_files = renumber[np.load(files_path)]
+    kept = np.flatnonzero(listing_files >= 0)
+
+    cell_ranges = np.load(os.path.join(snapshot_dir, CELL_RANGES_FILE))
+    keys = np.repeat(np.load(os.path.join(snapshot_dir, CELL_KEYS_FILE)), cell_ranges[:, 1] - cell_ranges[:, 0])
+    offsets = np.load(os.path.join(snapshot_dir, SUMMARY_OFFSETS_FILE))
+    with open(os.path.join(snapshot_dir, SUMMARIES_FILE), 'rb') as f:
+        summaries = f.read()
+    return (
+        np.load(os.path.join(snapshot_dir, LISTINGS_FILE))[kept],
+        keys[kept],
+        listing_files[kept],
+        [summaries[offsets[row]:offsets[row + 1]] for row in kept.tolist()],
+    )
+
+
+def write_comparables_snapshot(gold_dir: str, state_dir: str, sequence: int,
+                               previous_dir: Optional[str] = None) -> Tuple[str, int, int]:
+    """
+    Write a snapshot of gold_dir and make it current
+
+    Listings of gold files unchanged since the previous snapshot are copied
+    from it; only new and changed files are read and parsed.
+
+    Returns:
+        (snapshot directory, listings, listings reused from previous_dir)
+    """
+    current = scan_gold_dir(gold_dir)
+    meta = _read_meta(previous_dir)
+    if meta is not None and meta['goldDir'] != os.path.abspath(gold_dir):
+        meta = None
+    reused_files = {
+        name: tuple(signature) for name, signature in (meta['files'].items() if meta else ())
+        if current.get(name) == tuple(signature)
+    }
+    loader = ComparablesIndex(gold_dir)
+    for name, signature in current.items():
+        if name not in reused_files:
+            loader._load_file(name, signature)
+    files = dict(reused_files, **loader._files)
+    file_codes = {name: code for code, name in enumerate(files)}
+
+    partitions: Dict[Tuple[str, str], int] = {}
+    parts = []
+    if meta is not None:
+        partitions = {tuple(key): code for code, key in enumerate(meta['partitions'])}
+        previous = _snapshot_rows(previous_dir, meta, {name: file_codes[name] for name in reused_files})
+        if previous is None:
+            # Snapshot from before listing files were recorded: read every file again
+            for name, signature in reused_files.items():
+                loader._load_file(name, signature)
+        else:
+            parts.append(previous)
+    reused = len(parts[0][1]) if parts else 0
+    parts.append(_index_rows(loader, partitions, file_codes))
+
+    # Old rows come first within a cell, as in an index refreshed in place
+    keys = np.concatenate([part[1] for part in parts])
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    coordinates = np.concatenate([part[0] for part in parts])[order]
+    listing_files = np.concatenate([part[2] for part in parts])[order]
+    encoded = [summary for part in parts for summary in part[3]]
+    summaries = [encoded[row] for row in order.tolist()]
+    cell_keys, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    cell_ranges = np.stack([starts, starts + counts], axis=1).astype(np.int64)
+
+    offsets = np.zeros(len(summaries) + 1, dtype=np.int64)
+    np.cumsum([len(summary) for summary in summaries], out=offsets[1:])
+
+    name = f"snapshot-{sequence:06d}"
+    staging = tempfile.mkdtemp(prefix=f".{name}.", dir=state_dir)
+    try:
+        np.save(os.path.join(staging, LISTINGS_FILE), coordinates)
+        np.save(os.path.join(staging, CELL_KEYS_FILE), cell_keys.astype(np.int64))
+        np.save(os.path.join(staging, CELL_RANGES_FILE), cell_ranges.reshape(-1, 2))
+        np.save(os.path.join(staging, SUMMARY_OFFSETS_FILE), offsets)
+        np.save(os.path.join(staging, LISTING_FILES_FILE), listing_files)
+        with open(os.path.join(staging, SUMMARIES_FILE), 'wb') as f:
+            f.write(b''.join(summaries))
+        with open(os.path.join(staging, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'sequence': sequence,
+                'goldDir': os.path.abspath(gold_dir),
+                'cellSizeDeg': CELL_SIZE_DEG,
+                'files': files,
+                'partitions': [list(key) for key in partitions],
+                'listings': len(coordinates),
+                'createdAt': time.time(),
+            }, f)
+        snapshot_dir = os.path.join(state_dir, name)
+        os.rename(staging, snapshot_dir)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    current_tmp = os.path.join(state_dir, f".{CURRENT_FILE}.tmp")
+    with open(current_tmp, 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(state_dir, CURRENT_FILE))
+    _remove_old_snapshots(state_dir, name)
+    return snapshot_dir, len(coordinates), reused
+
+
+def _remove_old_snapshots(state_dir: str, current: str):
+    # Workers still mapping a removed snapshot keep reading it until they reattach;
+    # the exclusive attach lock waits for any worker still opening one
+    with _locked(state_dir, ATTACH_LOCK_FILE):
+        snapshots = sorted(n for n in os.listdir(state_dir) if n.startswith('snapshot-') and n != current)
+        for name in snapshots[:max(0, len(snapshots) - KEEP_OLD_SNAPSHOTS)]:
+            shutil.rmtree(os.path.join(state_dir, name), ignore_errors=True)
+
+
+def ensure_comparables_snapshot(gold_dir: str, state_dir: str) -> str:
+    """
+    Current snapshot of gold_dir, building it first if the gold files changed
+
+    Safe to call from every worker at once: the first one to take the lock
+    builds, the others find the fresh snapshot once they get the lock.
+    """
+    files = scan_gold_dir(gold_dir)
+    with _attaching(state_dir):
+        snapshot_dir = current_snapshot(state_dir)
+        if _is_current(_read_meta(snapshot_dir), gold_dir, files):
+            return snapshot_dir
+
+    with _exclusive(state_dir):
+        snapshot_dir = current_snapshot(state_dir)
+        meta = _read_meta(snapshot_dir)
+        files = scan_gold_dir(gold_dir)
+        if _is_current(meta, gold_dir, files):
+            return snapshot_dir
+
+        started = time.perf_counter()
+        sequence = (meta['sequence'] + 1) if meta else 1
+        snapshot_dir, listings, reused = write_comparables_snapshot(gold_dir, state_dir, sequence, snapshot_dir)
+        logger.info(
+            f"Comparables snapshot {sequence}: {listings} listings ({reused} reused) "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        return snapshot_dir
+
+
+class MappedComparablesIndex(ComparablesIndex):
+    """
+    ComparablesIndex answering from a memory-mapped snapshot
+
+    Every array is opened with mmap, so all worker processes on a host share
+    the same page-cache copy and attaching costs no parsing. Cells are found
+    by binary search over the sorted cell keys; listing summaries are only
+    decoded for returned comparables. refresh() rebuilds the snapshot when
+    the gold files changed (one worker does the work) and reattaches to the
+    newest one. Answers are identical to an in-memory index over the same
+    gold files.
+    """
+
+    def __init__(self, gold_dir: str, state_dir: str):
+        super().__init__(gold_dir)
+        self.state_dir = state_dir
+        self.snapshot_dir: Optional[str] = None
+        # (partition codes, mapped arrays) of the attached snapshot, swapped as one value
+        self._state: Tuple[Dict, Optional[Tuple]] = ({}, None)
+        self._attach_lock = threading.Lock()
+
+    def refresh(self) -> 'MappedComparablesIndex':
+        ensure_comparables_snapshot(self.gold_dir, self.state_dir)
+        with _attaching(self.state_dir):
+            # Read CURRENT again: another worker may have replaced the snapshot since
+            snapshot_dir = current_snapshot(self.state_dir)
+            if snapshot_dir is not None and snapshot_dir != self.snapshot_dir:
+                self._attach(snapshot_dir)
+        self.last_refresh = time.monotonic()
+        return self
+
+    def _attach(self, snapshot_dir: str):
+        meta = _read_meta(snapshot_dir)
+        listings = np.load(os.path.join(snapshot_dir, LISTINGS_FILE), mmap_mode='r')
+        cell_keys = np.load(os.path.join(snapshot_dir, CELL_KEYS_FILE), mmap_mode='r')
+        cell_ranges = np.load(os.path.join(snapshot_dir, CELL_RANGES_FILE), mmap_mode='r')
+        offsets = np.load(os.path.join(snapshot_dir, SUMMARY_OFFSETS_FILE), mmap_mode='r')
+        summaries_path = os.path.join(snapshot_dir, SUMMARIES_FILE)
+        summaries = (
+            np.memmap(summaries_path, dtype=np.uint8, mode='r')
+            if os.path.getsize(summaries_path) else np.zeros(0, dtype=np.uint8)
+        )
+
+        with self._attach_lock:
+            partitions = {tuple(key): code for code, key in enumerate(meta['partitions'])}
+            # Queries take this once (see _snapshot), so one query never sees two snapshots
+            self._state = (partitions, (listings, cell_keys, cell_ranges, offsets, summaries))
+            self._partitions = partitions
+            self._files = {name: tuple(signature) for name, signature in meta['files'].items()}
+            self.listing_count = meta['listings']
+            self.generation = meta['sequence']
+            self.snapshot_dir = snapshot_dir
+        logger.info(f"Attached comparables snapshot {snapshot_dir}")
+
+    def _snapshot(self) -> Tuple[Dict, Optional[Tuple]]:
+        return self._state
+
+    def _cell_entry(self, snapshot: Tuple[Dict, Tuple], key: Tuple[str, str], cells, cell: Tuple[int, int]):
+        # cells is the partition code here (see _state)
+        listings, cell_keys, cell_ranges, _, _ = snapshot[1]
+        target = cell_key(cells, cell[0], cell[1])
+        position = int(np.searchsorted(cell_keys, target))
+        if position >= len(cell_keys) or cell_keys[position] != target:
+            return None
+        start, end = (int(value) for value in cell_ranges[position])
+        return (range(start, end), listings[start:end, :3])
+
+    def _code_range(self, snapshot: Tuple[Dict, Tuple], code: int) -> Tuple[int, int]:
+        """[start, end) positions of a partition's cells among the sorted cell keys"""
+        cell_keys = snapshot[1][1]
+        start = int(np.searchsorted(cell_keys, code << (2 * _COORD_BITS)))
+        end = int(np.searchsorted(cell_keys, (code + 1) << (2 * _COORD_BITS)))
+        return start, end
+
+    def _cell_count(self, snapshot: Tuple[Dict, Tuple], key: Tuple[str, str], cells) -> int:
+        start, end = self._code_range(snapshot, cells)
+        return end - start
+
+    def _occupied_cells(self, snapshot: Tuple[Dict, Tuple], key: Tuple[str, str], cells) -> np.ndarray:
+        start, end = self._code_range(snapshot, cells)
+        keys = np.asarray(snapshot[1][1][start:end])
+        mask = (1 << _COORD_BITS) - 1
+        rows = ((keys >> _COORD_BITS) & mask) - _COORD_OFFSET
+        cols = (keys & mask) - _COORD_OFFSET
+        return np.stack([rows, cols], axis=1)
+
+    def _as_comparable(self, snapshot: Tuple[Dict, Tuple], listing: int, distance: float) -> Dict:
+        latitude, longitude, size, price, summary = self._listing_fields(snapshot[1], listing)
+        comparable = dict(summary)
+        comparable.update({
+            'price': price,
+            'size': size,
+            'pricePerM2': round(price / size, 2),
+            'latitude': latitude,
+            'longitude': longitude,
+            'distanceKm': round(distance, 3),
+        })
+        return comparable
+
+    @staticmethod
+    def _listing_fields(mapped: Tuple, listing: int) -> Tuple[float, float, float, float, Dict]:
+        listings, _, _, offsets, summaries = mapped
+        latitude, longitude, size, price = (float(value) for value in listings[listing])
+        summary = json.loads(bytes(summaries[offsets[listing]:offsets[listing + 1]]).decode('utf-8'))
+        return latitude, longitude, size, price, summary
+
+    def cells(self):
+        """(partition, cell, listings) for every cell of the attached snapshot, in the same order as written"""
+        partitions, mapped = self._state
+        if mapped is None:
+            return
+        keys = {code: key for key, code in partitions.items()}
+        _, cell_keys, cell_ranges, _, _ = mapped
+        for packed, (start, end) in zip(cell_keys.tolist(), cell_ranges.tolist()):
+            code, row, col = split_cell_key(packed)
+            listings = []
+            for listing in range(start, end):
+                latitude, longitude, size, price, summary = self._listing_fields(mapped, listing)
+                # Snapshots don't record which gold file a listing came from
+                listings.append(Listing(latitude, longitude, size, price, summary, None))
+            yield keys[code], (row, col), listings
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats['snapshot'] = os.path.basename(self.snapshot_dir) if self.snapshot_dir else None
+        return stats
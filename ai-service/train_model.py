@@ -0,0 +1,338 @@
+"""
+Offline training for the learned valuation model
+Streams gold-layer listings into per-delegation price statistics and a linear
+price-per-m² model, and writes a versioned artifact the service can hot-load
+
+Usage:
+    python train_model.py --gold-dir ../scrapers/data/gold --output-dir models
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from learned_model import (
+    ARTIFACT_METADATA_FILE,
+    ARTIFACT_WEIGHTS_FILE,
+    CATEGORICAL_FEATURES,
+    LATEST_FILE,
+    NUMERIC_FEATURES,
+    REGIONAL_PRICES_FILE,
+    category_value,
+)
+from valuation_model import TUNISIA_REGIONAL_PRICES, RegionalPriceIndex, normalize_location_key
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Listings outside this price-per-m² range (TND) are treated as noise
+MIN_PRICE_PER_M2 = 100
+MAX_PRICE_PER_M2 = 20000
+# Observations a category needs to get its own effect / a delegation its own price
+MIN_CATEGORY_COUNT = 5
+# Ridge penalty on every weight except the intercept
+RIDGE_LAMBDA = 1.0
+DEFAULT_BLEND_WEIGHT = 0.5
+
+# Gold-layer field -> service feature
+GOLD_FIELD_MAP = {
+    'governorate': 'governorate',
+    'delegation': 'delegation',
+    'property_type': 'propertyType',
+    'transaction_type': 'transactionType',
+    'size': 'size',
+    'bedrooms': 'bedrooms',
+    'bathrooms': 'bathrooms',
+    'floor': 'floor',
+    'has_parking': 'hasParking',
+    'has_elevator': 'hasElevator',
+    'has_garden': 'hasGarden',
+    'has_pool': 'hasPool',
+    'has_sea_view': 'hasSeaView',
+}
+
+
+def iter_gold_files(gold_dir: str) -> List[str]:
+    return sorted(
+        os.path.join(gold_dir, name)
+        for name in os.listdir(gold_dir)
+        if name.endswith('_gold.json')
+    )
+
+
+def iter_training_rows(gold_dir: str) -> Iterator[Tuple[Dict, float]]:
+    """
+    Yield (features, price_per_m2) for usable SALE listings, one gold file at a time
+
+    Only one file is held in memory at once, so the total number of records
+    does not matter.
+    """
+    for path in iter_gold_files(gold_dir):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping {path}: {e}")
+            continue
+
+        records = data.get('data', []) if isinstance(data, dict) else data
+        for record in records:
+            row = gold_record_to_features(record)
+            if row is not None:
+                yield row
+
+
+def gold_record_to_features(record: Dict) -> Optional[Tuple[Dict, float]]:
+    """Map a gold record to service features and its price per m², or None if unusable"""
+    if not isinstance(record, dict) or record.get('is_price_anomaly'):
+        return None
+    if (record.get('transaction_type') or '').upper() != 'SALE':
+        return None
+    try:
+        price = float(record.get('price'))
+        size = float(record.get('size'))
+    except (TypeError, ValueError):
+        return None
+    if not (price > 0 and size > 0 and math.isfinite(price) and math.isfinite(size)):
+        return None
+
+    price_per_m2 = price / size
+    if not (MIN_PRICE_PER_M2 <= price_per_m2 <= MAX_PRICE_PER_M2):
+        return None
+
+    features = {feature: record.get(field) for field, feature in GOLD_FIELD_MAP.items()}
+    features['size'] = size
+    for feature in NUMERIC_FEATURES:
+        try:
+            features[feature] = float(features.get(feature) or 0)
+        except (TypeError, ValueError):
+            features[feature] = 0.0
+    return features, price_per_m2
+
+
+class RunningStats:
+    """Count, mean and variance in one pass (Welford)"""
+
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def as_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'mean': round(self.mean, 2),
+            'std': round(math.sqrt(self.m2 / (self.count - 1)), 2) if self.count > 1 else 0.0,
+            'min': round(self.min, 2),
+            'max': round(self.max, 2),
+        }
+
+
+def collect_statistics(gold_dir: str) -> Tuple[Dict[Tuple[str, str], RunningStats], Dict[str, Dict[str, int]]]:
+    """First pass: per-delegation price statistics and category counts"""
+    known_regions = RegionalPriceIndex(TUNISIA_REGIONAL_PRICES)
+    region_stats: Dict[Tuple[str, str], RunningStats] = {}
+    category_counts: Dict[str, Dict[str, int]] = {feature: {} for feature in CATEGORICAL_FEATURES}
+    display_names: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+    for features, price_per_m2 in iter_training_rows(gold_dir):
+        for feature in CATEGORICAL_FEATURES:
+            value = category_value(features, feature)
+            counts = category_counts[feature]
+            counts[value] = counts.get(value, 0) + 1
+
+        governorate = features.get('governorate') or ''
+        delegation = features.get('delegation') or ''
+        if not governorate or not delegation:
+            continue
+
+        # Known regions keep the canonical spelling of the rule table
+        code = known_regions.region_code(governorate, delegation)
+        known_governorate, known_delegation = known_regions.regions[code]
+        if known_delegation:
+            key = (known_governorate, known_delegation)
+        else:
+            key = (governorate.strip().title(), delegation.strip().title())
+            key = display_names.setdefault(
+                (normalize_location_key(governorate), normalize_location_key(delegation)), key
+            )
+        region_stats.setdefault(key, RunningStats()).add(price_per_m2)
+
+    return region_stats, category_counts
+
+
+def build_layout(category_counts: Dict[str, Dict[str, int]]) -> Tuple[Dict, Dict, int]:
+    """Vocabularies and weight offsets: [intercept, numeric..., categorical blocks...]"""
+    vocabularies = {}
+    offsets = {'numeric': 1}
+    position = 1 + len(NUMERIC_FEATURES)
+    for feature in CATEGORICAL_FEATURES:
+        vocabulary = sorted(
+            value for value, count in category_counts[feature].items()
+            if count >= MIN_CATEGORY_COUNT and value not in ('', '|')
+        )
+        vocabularies[feature] = vocabulary
+        offsets[feature] = position
+        position += len(vocabulary)
+    return vocabularies, offsets, position
+
+
+def fit_linear_model(gold_dir: str, vocabularies: Dict, offsets: Dict, width: int,
+                     chunk_size: int = 10000) -> Tuple[np.ndarray, int, float]:
+    """
+    Second pass: ridge regression of price per m² via streamed normal equations
+
+    Only XᵀX (width x width) and Xᵀy are kept, accumulated chunk by chunk, so
+    memory does not grow with the number of records.
+    """
+    indices = {
+        feature: {value: offsets[feature] + i for i, value in enumerate(vocabularies[feature])}
+        for feature in CATEGORICAL_FEATURES
+    }
+    xtx = np.zeros((width, width), dtype=np.float64)
+    xty = np.zeros(width, dtype=np.float64)
+    count = 0
+    sum_squares = 0.0
+
+    def accumulate(rows: List[np.ndarray], targets: List[float]):
+        nonlocal xtx, xty
+        design = np.vstack(rows)
+        target = np.asarray(targets)
+        xtx += design.T @ design
+        xty += design.T @ target
+
+    rows, targets = [], []
+    for features, price_per_m2 in iter_training_rows(gold_dir):
+        row = np.zeros(width, dtype=np.float64)
+        row[0] = 1.0
+        offset = offsets['numeric']
+        for j, feature in enumerate(NUMERIC_FEATURES):
+            row[offset + j] = features[feature]
+        for feature in CATEGORICAL_FEATURES:
+            index = indices[feature].get(category_value(features, feature))
+            if index is not None:
+                row[index] = 1.0
+        rows.append(row)
+        targets.append(price_per_m2)
+        count += 1
+        sum_squares += price_per_m2 * price_per_m2
+        if len(rows) >= chunk_size:
+            accumulate(rows, targets)
+            rows, targets = [], []
+    if rows:
+        accumulate(rows, targets)
+
+    if count == 0:
+        raise ValueError(f"No usable SALE listings found in {gold_dir}")
+
+    penalty = np.full(width, RIDGE_LAMBDA)
+    penalty[0] = 0.0
+    weights = np.linalg.solve(xtx + np.diag(penalty), xty)
+
+    # Training RMSE from the accumulated moments: (yᵀy - 2wᵀXᵀy + wᵀXᵀXw) / n
+    residual = sum_squares - 2 * weights @ xty + weights @ xtx @ weights
+    rmse = math.sqrt(max(residual, 0.0) / count)
+    return weights, count, rmse
+
+
+def build_regional_prices(region_stats: Dict[Tuple[str, str], RunningStats]) -> Dict[str, Dict[str, float]]:
+    """Rule table refreshed with observed means; sparse regions keep their current price"""
+    regional_prices = {governorate: dict(delegations) for governorate, delegations in TUNISIA_REGIONAL_PRICES.items()}
+    for (governorate, delegation), stats in region_stats.items():
+        if stats.count >= MIN_CATEGORY_COUNT:
+            regional_prices.setdefault(governorate, {})[delegation] = int(round(stats.mean))
+    return regional_prices
+
+
+def write_artifact(output_dir: str, version: str, weights: np.ndarray, metadata: Dict,
+                   regional_prices: Dict, region_stats: Dict) -> str:
+    """Write the artifact to a temporary directory, then move it into place and update LATEST"""
+    os.makedirs(output_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{version}.", dir=output_dir)
+    try:
+        np.save(os.path.join(staging, ARTIFACT_WEIGHTS_FILE), weights)
+        with open(os.path.join(staging, ARTIFACT_METADATA_FILE), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(staging, REGIONAL_PRICES_FILE), 'w', encoding='utf-8') as f:
+            json.dump(regional_prices, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(staging, 'delegation_stats.json'), 'w', encoding='utf-8') as f:
+            json.dump(
+                {f"{g}|{d}": stats.as_dict() for (g, d), stats in sorted(region_stats.items())},
+                f, ensure_ascii=False, indent=2
+            )
+        artifact_dir = os.path.join(output_dir, version)
+        os.rename(staging, artifact_dir)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    latest_tmp = os.path.join(output_dir, f".{LATEST_FILE}.tmp")
+    with open(latest_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(latest_tmp, os.path.join(output_dir, LATEST_FILE))
+    return artifact_dir
+
+
+def train(gold_dir: str, output_dir: str, version: Optional[str] = None,
+          blend_weight: float = DEFAULT_BLEND_WEIGHT) -> str:
+    """Train on every gold file and write a new artifact; returns its directory"""
+    version = version or datetime.utcnow().strftime("linear-%Y%m%d-%H%M%S")
+
+    logger.info(f"Pass 1: collecting statistics from {gold_dir}")
+    region_stats, category_counts = collect_statistics(gold_dir)
+    vocabularies, offsets, width = build_layout(category_counts)
+
+    logger.info(f"Pass 2: fitting {width} weights")
+    weights, count, rmse = fit_linear_model(gold_dir, vocabularies, offsets, width)
+
+    metadata = {
+        'version': version,
+        'type': 'linear-price-per-m2',
+        'created_at': datetime.utcnow().isoformat(),
+        'blend_weight': blend_weight,
+        'numeric_features': NUMERIC_FEATURES,
+        'offsets': offsets,
+        'vocabularies': vocabularies,
+        'training': {
+            'records': count,
+            'rmse_price_per_m2': round(rmse, 2),
+            'ridge_lambda': RIDGE_LAMBDA,
+        },
+    }
+    artifact_dir = write_artifact(
+        output_dir, version, weights, metadata, build_regional_prices(region_stats), region_stats
+    )
+    logger.info(f"Trained on {count} listings (RMSE {rmse:.0f} TND/m²), artifact: {artifact_dir}")
+    return artifact_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the learned valuation model from gold-layer data")
+    parser.add_argument("--gold-dir", default=os.path.join("..", "scrapers", "data", "gold"))
+    parser.add_argument("--output-dir", default="models")
+    parser.add_argument("--version", default=None)
+    parser.add_argument("--blend-weight", type=float, default=DEFAULT_BLEND_WEIGHT)
+    args = parser.parse_args()
+
+    artifact = train(args.gold_dir, args.output_dir, args.version, args.blend_weight)
+    print(f"\n✅ Model artifact written to {artifact}")
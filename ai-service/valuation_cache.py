@@ -0,0 +1,138 @@
+"""
+In-process cache of valuation results
+estimate_value is deterministic given the property features, so repeated valuations are served from memory
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from valuation_model import PropertyValuationModel
+
+# Fields that define a valuation, in canonical order
+FEATURE_FIELDS = (
+    'governorate', 'delegation', 'propertyType', 'transactionType', 'size',
+    'bedrooms', 'bathrooms', 'floor', 'hasParking', 'hasElevator', 'hasGarden',
+    'hasPool', 'hasSeaView', 'latitude', 'longitude', 'price',
+)
+
+
+def feature_key(property_data: Dict, include_insights: bool, include_breakdown: bool) -> bytes:
+    """Canonical hash of the features and output options of a valuation"""
+    canonical = tuple(property_data.get(field) for field in FEATURE_FIELDS)
+    canonical += (bool(include_insights), bool(include_breakdown))
+    return hashlib.blake2b(repr(canonical).encode('utf-8'), digest_size=16).digest()
+
+
+class ValuationCache:
+    """
+    LRU cache with TTL for valuation results
+
+    Entries are tagged with the model version, regional price table
+    fingerprint and comparables index generation they were computed with;
+    when any of them changes, the whole cache is dropped. Failed valuations
+    are never cached.
+    """
+
+    def __init__(self, model: PropertyValuationModel, max_size: int = 10000, ttl_seconds: float = 3600):
+        self.model = model
+        self.max_size = max(0, max_size)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = self._model_generation()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _model_generation(self) -> Tuple:
+        comparables_index = self.model.comparables_index
+        return (
+            self.model.version,
+            self.model.price_index.fingerprint,
+            comparables_index.generation if comparables_index is not None else None,
+        )
+
+    def _check_generation(self):
+        """Drop every entry if the model or price table changed (lock held)"""
+        generation = self._model_generation()
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+            self.invalidations += 1
+
+    def get(self, key: bytes) -> Optional[Dict]:
+        """Cached result for a key, or None"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, result = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: bytes, result: Dict):
+        """Store a result, evicting the least recently used entries"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._check_generation()
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def lookup_many(self, properties: List[Dict], include_insights: bool,
+                    include_breakdown: bool) -> Tuple[List[Optional[Dict]], List[bytes]]:
+        """Cached results for a batch (None for misses) and the key of every row"""
+        keys = [feature_key(p, include_insights, include_breakdown) for p in properties]
+        return [self.get(key) for key in keys], keys
+
+    def store_many(self, keys: List[bytes], results: List):
+        """Store the successful results of a batch"""
+        for key, result in zip(keys, results):
+            if not isinstance(result, Exception):
+                self.put(key, result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Counters reported on /health"""
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'size': len(self._entries),
+            'maxSize': self.max_size,
+            'ttlSeconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
@@ -3,7 +3,15 @@ Comprehensive Property Valuation Model for Tunisia Real Estate
 Rule-based MVP with regional pricing and detailed adjustments
 """
 
-from typing import Dict, List, Optional
+import hashlib
+import json
+import re
+import sys
+import time
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from metrics import STAGE_SECONDS
 
 # Comprehensive Tunisia Regional Base Prices (TND per m²)
 TUNISIA_REGIONAL_PRICES = {
@@ -75,39 +83,197 @@ TUNISIA_REGIONAL_PRICES = {
     },
 }
 
+# Identifier reported by /health and used to invalidate cached valuations
+MODEL_VERSION = 'rule-based-v1'
+
+# Location tiers by delegation
+PREMIUM_AREAS = ['La Marsa', 'Carthage', 'Gammarth', 'Sidi Bou Said',
+                 'Port El Kantaoui', 'Yasmine Hammamet']
+MID_TIER_AREAS = ['Ariana', 'Menzah', 'Ennasr', 'Sousse Ville', 'Hammamet']
+
+# Location multiplier per tier code
+TIER_PREMIUM = 0
+TIER_MID = 1
+TIER_STANDARD = 2
+LOCATION_TIER_MULTIPLIERS = (1.2, 1.0, 0.9)
+
+# Base price (TND per m²) for unknown governorates
+DEFAULT_BASE_PRICE = 1500
+
+# Property type adjustments
+PROPERTY_TYPE_MULTIPLIERS = {
+    'APARTMENT': 1.0,
+    'HOUSE': 1.15,
+    'VILLA': 1.4,
+    'LAND': 0.6,
+    'COMMERCIAL': 1.3,
+    'OFFICE': 1.2,
+}
+
+
+# AI insights templates (French)
+INSIGHTS_HEADER_TEMPLATE = (
+    "Analyse de la propriété:\n\n"
+    "Type: {property_type}\n"
+    "Localisation: {delegation}, {governorate}\n"
+    "Valeur estimée: {estimated_value:,} TND\n\n"
+)
+INSIGHTS_STRONG_POINT_LINES = [
+    ('hasSeaView', "• Vue sur mer (prime de 15-20%)\n"),
+    ('hasPool', "• Piscine privée\n"),
+    ('hasGarden', "• Jardin/espace extérieur\n"),
+    ('hasParking', "• Parking privé\n"),
+    ('hasElevator', "• Ascenseur\n"),
+]
+INSIGHTS_MARKET_TEMPLATE = (
+    "Prix moyen du marché: {base_price:,} TND/m²\n"
+    "\nRecommandation: Cette propriété représente "
+)
+INSIGHTS_RECOMMENDATIONS = {
+    'prestige': "un excellent investissement pour une résidence de prestige.",
+    'sought_after': "une opportunité dans un quartier très recherché.",
+    'default': "une bonne opportunité d'investissement.",
+}
+PRESTIGE_PROPERTY_TYPES = frozenset(['VILLA', 'HOUSE'])
+SOUGHT_AFTER_AREAS = frozenset(['La Marsa', 'Carthage', 'Gammarth'])
+
+_SEPARATORS = re.compile(r"[\s\-_'’]+")
+
+
+def normalize_location_key(name: str) -> str:
+    """Case, accent and separator insensitive key for a place name"""
+    if not name:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return sys.intern(_SEPARATORS.sub(' ', stripped.casefold()).strip())
+
+
+# Matched like regional prices, so "la marsa" reads as sought after wherever it is priced as premium
+_SOUGHT_AFTER_KEYS = frozenset(normalize_location_key(area) for area in SOUGHT_AFTER_AREAS)
+
+
+class RegionalPriceIndex:
+    """
+    Compiled, integer-coded view of a regional price table
+    
+    Every known (governorate, delegation) pair gets a region code, followed
+    by one fallback code per governorate (priced at its precomputed mean) and
+    a final default code. Lookups are a single dict probe on the exact names,
+    falling back to case/accent-normalized keys.
+    """
+    
+    def __init__(self, regional_prices: Dict[str, Dict[str, float]]):
+        self.regions: List[Tuple[str, str]] = []
+        self.base_prices: List[float] = []
+        self._exact: Dict[Tuple[str, str], int] = {}
+        self._normalized: Dict[Tuple[str, str], int] = {}
+        self._governorate_codes: Dict[str, int] = {}
+        self._normalized_governorates: Dict[str, int] = {}
+        
+        for governorate, delegations in regional_prices.items():
+            governorate = sys.intern(governorate)
+            for delegation, price in delegations.items():
+                delegation = sys.intern(delegation)
+                code = self._add_region(governorate, delegation, price)
+                self._exact[(governorate, delegation)] = code
+                self._normalized.setdefault(
+                    (normalize_location_key(governorate), normalize_location_key(delegation)), code
+                )
+        
+        # Governorate fallbacks: mean over the governorate's delegations
+        for governorate, delegations in regional_prices.items():
+            governorate = sys.intern(governorate)
+            code = self._add_region(governorate, '', sum(delegations.values()) / len(delegations))
+            self._governorate_codes[governorate] = code
+            self._normalized_governorates.setdefault(normalize_location_key(governorate), code)
+        
+        self.default_code = self._add_region('', '', DEFAULT_BASE_PRICE)
+        
+        # Content hash of the table, changes whenever any price changes
+        self.fingerprint = hashlib.sha256(
+            json.dumps(regional_prices, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:16]
+        
+        # Location tiers
+        self._tiers: Dict[str, int] = {}
+        self._normalized_tiers: Dict[str, int] = {}
+        for tier, areas in ((TIER_PREMIUM, PREMIUM_AREAS), (TIER_MID, MID_TIER_AREAS)):
+            for area in areas:
+                self._tiers.setdefault(sys.intern(area), tier)
+                self._normalized_tiers.setdefault(normalize_location_key(area), tier)
+    
+    def _add_region(self, governorate: str, delegation: str, price: float) -> int:
+        self.regions.append((governorate, delegation))
+        self.base_prices.append(price)
+        return len(self.base_prices) - 1
+    
+    def region_code(self, governorate: str, delegation: str) -> int:
+        """Region code for a location, falling back to governorate then default"""
+        code = self._exact.get((governorate, delegation))
+        if code is not None:
+            return code
+        
+        governorate_key = normalize_location_key(governorate)
+        code = self._normalized.get((governorate_key, normalize_location_key(delegation)))
+        if code is not None:
+            return code
+        
+        code = self._governorate_codes.get(governorate)
+        if code is None:
+            code = self._normalized_governorates.get(governorate_key, self.default_code)
+        return code
+    
+    def base_price(self, governorate: str, delegation: str) -> float:
+        """Base price per m² for a location"""
+        return self.base_prices[self.region_code(governorate, delegation)]
+    
+    def tier(self, delegation: str) -> int:
+        """Location tier code for a delegation"""
+        tier = self._tiers.get(delegation)
+        if tier is None:
+            tier = self._normalized_tiers.get(normalize_location_key(delegation), TIER_STANDARD)
+        return tier
+
+
+# Stage timers of estimate_value, resolved once
+_STAGE_TIMERS = {
+    stage: STAGE_SECONDS.labels('single', stage)
+    for stage in ('base_price', 'multipliers', 'learned_model', 'comparables', 'insights')
+}
+
 
 class PropertyValuationModel:
     """Rule-based valuation model for Tunisia real estate"""
     
-    def __init__(self):
+    def __init__(self, comparables_index=None, predictor=None, blend_weight: Optional[float] = None):
         self.regional_prices = TUNISIA_REGIONAL_PRICES
+        if predictor is not None and getattr(predictor, 'regional_prices', None):
+            # Trained artifacts may ship a regional price table refreshed from listings
+            self.regional_prices = predictor.regional_prices
+        self.price_index = RegionalPriceIndex(self.regional_prices)
+        # Optional comparables.ComparablesIndex over gold-layer listings
+        self.comparables_index = comparables_index
+        # Optional learned price-per-m² predictor (see learned_model), blended
+        # with the rule-based estimate: (1 - blend_weight) * rules + blend_weight * learned
+        self.predictor = predictor
+        self.blend_weight = 0.0
+        self.version = MODEL_VERSION
+        if predictor is not None:
+            self.blend_weight = blend_weight if blend_weight is not None else predictor.blend_weight
+            self.version = f"{MODEL_VERSION}+{predictor.version}"
     
     def get_regional_base_price(self, governorate: str, delegation: str) -> float:
         """Get base price per m² for a specific region"""
-        if governorate in self.regional_prices:
-            if delegation in self.regional_prices[governorate]:
-                return self.regional_prices[governorate][delegation]
-            # Return average for governorate if delegation not found
-            return sum(self.regional_prices[governorate].values()) / len(self.regional_prices[governorate])
-        # Default fallback
-        return 1500
+        # Falls back to the governorate average, then to the default price
+        return self.price_index.base_price(governorate, delegation)
     
     def calculate_location_score(self, property_data: Dict) -> float:
         """Calculate location multiplier based on area desirability"""
-        governorate = property_data.get('governorate', '')
         delegation = property_data.get('delegation', '')
         
         # Premium locations get higher multipliers
-        premium_areas = ['La Marsa', 'Carthage', 'Gammarth', 'Sidi Bou Said', 
-                        'Port El Kantaoui', 'Yasmine Hammamet']
-        mid_tier_areas = ['Ariana', 'Menzah', 'Ennasr', 'Sousse Ville', 'Hammamet']
-        
-        if delegation in premium_areas:
-            return 1.2
-        elif delegation in mid_tier_areas:
-            return 1.0
-        else:
-            return 0.9
+        return LOCATION_TIER_MULTIPLIERS[self.price_index.tier(delegation)]
     
     def calculate_floor_bonus(self, floor: Optional[int], property_type: str) -> float:
         """Calculate floor adjustment for apartments"""
@@ -147,54 +313,66 @@ class PropertyValuationModel:
         return min(confidence, 0.95)
     
     def find_comparables(self, property_data: Dict) -> List[Dict]:
-        """Find comparable properties (simplified - would use database in production)"""
-        # This is a placeholder. In production, this would query the database
-        # for similar properties in the same area
-        return []
+        """Find the nearest similar gold-layer listings of the same type and transaction"""
+        if self.comparables_index is None:
+            return []
+        return self.comparables_index.query(
+            property_data.get('latitude'),
+            property_data.get('longitude'),
+            property_data.get('propertyType'),
+            property_data.get('transactionType'),
+            size=property_data.get('size'),
+        )
+    
+    def find_comparables_batch(self, properties: List[Dict]) -> List[List[Dict]]:
+        """find_comparables for a whole batch, sharing the index traversal per grid cell"""
+        if self.comparables_index is None:
+            return [[] for _ in properties]
+        return self.comparables_index.query_batch([
+            (
+                p.get('latitude'),
+                p.get('longitude'),
+                p.get('propertyType'),
+                p.get('transactionType'),
+                p.get('size'),
+            )
+            for p in properties
+        ])
     
-    def generate_insights(self, property_data: Dict, estimated_value: int) -> str:
-        """Generate AI insights about the property"""
+    def generate_insights(self, property_data: Dict, estimated_value: int,
+                          base_price: Optional[float] = None) -> str:
+        """Generate AI insights about the property from the precompiled templates"""
         property_type = property_data.get('propertyType', 'property')
         delegation = property_data.get('delegation', '')
         governorate = property_data.get('governorate', '')
         
-        insights = f"Analyse de la propriété:\n\n"
-        insights += f"Type: {property_type}\n"
-        insights += f"Localisation: {delegation}, {governorate}\n"
-        insights += f"Valeur estimée: {estimated_value:,} TND\n\n"
+        parts = [INSIGHTS_HEADER_TEMPLATE.format(
+            property_type=property_type,
+            delegation=delegation,
+            governorate=governorate,
+            estimated_value=estimated_value,
+        )]
         
         # Add specific insights based on features
-        strong_points = []
-        if property_data.get('hasSeaView'):
-            strong_points.append("Vue sur mer (prime de 15-20%)")
-        if property_data.get('hasPool'):
-            strong_points.append("Piscine privée")
-        if property_data.get('hasGarden'):
-            strong_points.append("Jardin/espace extérieur")
-        if property_data.get('hasParking'):
-            strong_points.append("Parking privé")
-        if property_data.get('hasElevator'):
-            strong_points.append("Ascenseur")
-        
+        strong_points = [line for field, line in INSIGHTS_STRONG_POINT_LINES if property_data.get(field)]
         if strong_points:
-            insights += "Points forts:\n"
-            for point in strong_points:
-                insights += f"• {point}\n"
-            insights += "\n"
+            parts.append("Points forts:\n")
+            parts.extend(strong_points)
+            parts.append("\n")
         
         # Market context
-        base_price = self.get_regional_base_price(governorate, delegation)
-        insights += f"Prix moyen du marché: {base_price:,} TND/m²\n"
-        insights += f"\nRecommandation: Cette propriété représente "
+        if base_price is None:
+            base_price = self.get_regional_base_price(governorate, delegation)
+        parts.append(INSIGHTS_MARKET_TEMPLATE.format(base_price=base_price))
         
-        if property_type in ['VILLA', 'HOUSE'] and property_data.get('hasPool'):
-            insights += "un excellent investissement pour une résidence de prestige."
-        elif delegation in ['La Marsa', 'Carthage', 'Gammarth']:
-            insights += "une opportunité dans un quartier très recherché."
+        if property_type in PRESTIGE_PROPERTY_TYPES and property_data.get('hasPool'):
+            parts.append(INSIGHTS_RECOMMENDATIONS['prestige'])
+        elif normalize_location_key(delegation) in _SOUGHT_AFTER_KEYS:
+            parts.append(INSIGHTS_RECOMMENDATIONS['sought_after'])
         else:
-            insights += "une bonne opportunité d'investissement."
+            parts.append(INSIGHTS_RECOMMENDATIONS['default'])
         
-        return insights
+        return ''.join(parts)
     
     def assess_listing_price(self, listing_price: Optional[int], estimated_value: int) -> str:
         """Assess if the listing price is fair"""
@@ -214,9 +392,17 @@ class PropertyValuationModel:
         else:
             return "very_high"  # Overpriced
     
-    def estimate_value(self, property_data: Dict) -> Dict:
-        """Main valuation function"""
+    def estimate_value(self, property_data: Dict, include_insights: bool = True,
+                       include_breakdown: bool = True) -> Dict:
+        """
+        Main valuation function
+        
+        AI insights and the price breakdown are only built when requested;
+        skipped ones are returned as None.
+        """
         try:
+            started = time.perf_counter()
+            
             # Extract property features
             governorate = property_data.get('governorate', '')
             delegation = property_data.get('delegation', '')
@@ -228,20 +414,14 @@ class PropertyValuationModel:
             # Get base price per m²
             base_price_per_m2 = self.get_regional_base_price(governorate, delegation)
             base_value = base_price_per_m2 * size
+            timed = time.perf_counter()
+            _STAGE_TIMERS['base_price'].observe(timed - started)
             
             # Location adjustments
             location_multiplier = self.calculate_location_score(property_data)
             
             # Property type adjustments
-            type_multipliers = {
-                'APARTMENT': 1.0,
-                'HOUSE': 1.15,
-                'VILLA': 1.4,
-                'LAND': 0.6,
-                'COMMERCIAL': 1.3,
-                'OFFICE': 1.2,
-            }
-            type_multiplier = type_multipliers.get(property_type, 1.0)
+            type_multiplier = PROPERTY_TYPE_MULTIPLIERS.get(property_type, 1.0)
             
             # Amenities adjustments
             amenities_bonus = 0
@@ -263,7 +443,7 @@ class PropertyValuationModel:
             age_multiplier = self.estimate_property_age_impact(property_data)
             
             # Final calculation
-            estimated_value = int(
+            estimated_value = (
                 base_value 
                 * location_multiplier 
                 * type_multiplier
@@ -271,10 +451,26 @@ class PropertyValuationModel:
                 * floor_multiplier
                 * age_multiplier
             )
+            started, timed = timed, time.perf_counter()
+            _STAGE_TIMERS['multipliers'].observe(timed - started)
+            
+            # Blend with the learned model, if one is plugged in
+            learned_price_per_m2 = None
+            if self.predictor is not None:
+                learned_price_per_m2 = float(self.predictor.predict([property_data])[0])
+                estimated_value = (
+                    (1 - self.blend_weight) * estimated_value
+                    + self.blend_weight * learned_price_per_m2 * size
+                )
+                started, timed = timed, time.perf_counter()
+                _STAGE_TIMERS['learned_model'].observe(timed - started)
+            estimated_value = int(estimated_value)
             
             # Calculate confidence
             comparables = self.find_comparables(property_data)
             confidence = self.calculate_confidence(property_data, comparables)
+            started, timed = timed, time.perf_counter()
+            _STAGE_TIMERS['comparables'].observe(timed - started)
             
             # Calculate range (±7%)
             min_value = int(estimated_value * 0.93)
@@ -294,11 +490,29 @@ class PropertyValuationModel:
             amenities_score = 60 + (amenities_count * 8)
             
             # Generate insights
-            insights = self.generate_insights(property_data, estimated_value)
+            insights = None
+            if include_insights:
+                insights = self.generate_insights(property_data, estimated_value, base_price_per_m2)
+                _STAGE_TIMERS['insights'].observe(time.perf_counter() - timed)
             
             # Assess price fairness
             is_fair_price = self.assess_listing_price(listing_price, estimated_value)
             
+            breakdown = None
+            if include_breakdown:
+                breakdown = {
+                    'basePricePerM2': base_price_per_m2,
+                    'baseValue': base_value,
+                    'locationMultiplier': location_multiplier,
+                    'typeMultiplier': type_multiplier,
+                    'amenitiesBonus': amenities_bonus,
+                    'floorMultiplier': floor_multiplier,
+                    'ageMultiplier': age_multiplier,
+                }
+                if learned_price_per_m2 is not None:
+                    breakdown['learnedPricePerM2'] = learned_price_per_m2
+                    breakdown['blendWeight'] = self.blend_weight
+            
             return {
                 'estimatedValue': estimated_value,
                 'minValue': min_value,
@@ -311,16 +525,9 @@ class PropertyValuationModel:
                 'comparables': comparables,
                 'aiInsights': insights,
                 'isPriceFair': is_fair_price,
-                'breakdown': {
-                    'basePricePerM2': base_price_per_m2,
-                    'baseValue': base_value,
-                    'locationMultiplier': location_multiplier,
-                    'typeMultiplier': type_multiplier,
-                    'amenitiesBonus': amenities_bonus,
-                    'floorMultiplier': floor_multiplier,
-                    'ageMultiplier': age_multiplier,
-                }
+                'breakdown': breakdown
             }
         
         except Exception as e:
             raise Exception(f"Valuation error: {str(e)}")
+
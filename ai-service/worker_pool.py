@@ -0,0 +1,126 @@
+"""
+Worker pool for valuation batches
+Keeps CPU-bound valuation work off the event loop and spreads large batches across cores
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Union
+
+from batch_engine import BatchValuationEngine
+from model_loader import load_valuation_model
+
+# Engine of the current worker process, built once by _init_worker
+_worker_engine: Optional[BatchValuationEngine] = None
+_worker_refresh_seconds = 0.0
+
+
+def _init_worker(model_options: Dict, refresh_seconds: float):
+    """Build the valuation model once per worker process"""
+    global _worker_engine, _worker_refresh_seconds
+    _worker_engine = BatchValuationEngine(load_valuation_model(**model_options))
+    _worker_refresh_seconds = refresh_seconds
+
+
+def _estimate_chunk(properties: List[Dict], include_insights: bool,
+                    include_breakdown: bool) -> List[Union[Dict, Exception]]:
+    """Value one chunk inside a worker process"""
+    comparables_index = _worker_engine.model.comparables_index
+    if comparables_index is not None:
+        # Pick up gold batches that landed since this worker last looked
+        comparables_index.maybe_refresh(_worker_refresh_seconds)
+    return _worker_engine.estimate(properties, include_insights, include_breakdown)
+
+
+def _ping() -> bool:
+    return _worker_engine is not None
+
+
+class ValuationWorkerPool:
+    """
+    Run batch valuations without blocking the event loop
+
+    With workers=0 batches run on a thread of the default executor, which
+    keeps the loop free for /health and single estimates. With workers>0,
+    batches of at least min_parallel_batch properties are split into chunks
+    of chunk_size and valued concurrently in a process pool; smaller batches
+    still use a thread, since shipping them to a process costs more than
+    valuing them. Worker processes build their own model from
+    model_options (see load_valuation_model) and refresh its comparables
+    index every refresh_seconds.
+    """
+
+    def __init__(self, engine: BatchValuationEngine, workers: int = 0,
+                 chunk_size: int = 2000, min_parallel_batch: Optional[int] = None,
+                 model_options: Optional[Dict] = None, refresh_seconds: float = 300):
+        self.engine = engine
+        self.model_options = model_options or {}
+        self.refresh_seconds = refresh_seconds
+        self.workers = max(0, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.min_parallel_batch = min_parallel_batch if min_parallel_batch is not None else self.chunk_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Set by shutdown(); a closed pool never starts worker processes again
+        self._closed = False
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self._closed:
+            return None
+        if self._executor is None:
+            # spawn: forking a process that runs an event loop and threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_options, self.refresh_seconds)
+            )
+        return self._executor
+
+    async def estimate(self, properties: List[Dict], include_insights: bool = True,
+                       include_breakdown: bool = True) -> List[Union[Dict, Exception]]:
+        """Value a batch off the event loop; same contract as BatchValuationEngine.estimate"""
+        loop = asyncio.get_running_loop()
+
+        executor = None
+        if self.workers > 0 and len(properties) >= self.min_parallel_batch:
+            executor = self._get_executor()
+        if executor is None:
+            # Small batch, no workers, or a retired version finishing in-flight requests
+            return await loop.run_in_executor(
+                None, self.engine.estimate, properties, include_insights, include_breakdown
+            )
+
+        chunks = [
+            properties[start:start + self.chunk_size]
+            for start in range(0, len(properties), self.chunk_size)
+        ]
+        chunk_results = await asyncio.gather(*[
+            loop.run_in_executor(executor, _estimate_chunk, chunk, include_insights, include_breakdown)
+            for chunk in chunks
+        ])
+
+        results = []
+        for chunk_result in chunk_results:
+            results.extend(chunk_result)
+        return results
+
+    def warm_up(self):
+        """Start the worker processes and build their models ahead of the first batch"""
+        executor = self._get_executor() if self.workers > 0 else None
+        if executor is None:
+            return
+        futures = [executor.submit(_ping) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self, cancel_futures: bool = True):
+        """
+        Stop the worker processes; with cancel_futures=False queued chunks still finish
+
+        Batches that arrive afterwards run on a thread instead of starting a new pool.
+        """
+        self._closed = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=cancel_futures)
+            self._executor = None
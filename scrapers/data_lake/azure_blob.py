@@ -0,0 +1,158 @@
+"""
+Azure Blob storage for the bronze layer
+Streams NDJSON batches into block blobs through one long-lived container client
+"""
+import gzip
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+from .bronze import SEGMENT_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# Azure accepts up to 4000 MiB per block and 50,000 blocks per blob
+DEFAULT_BLOCK_BYTES = 4 * 1024 * 1024
+MAX_BLOCKS_PER_BLOB = 50000
+DEFAULT_BLOB_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_BLOB_MAX_SECONDS = 3600
+
+
+def container_client_from_connection_string(connection_string: str, container: str):
+    """
+    Container client for a connection string, creating the container if needed
+
+    Works with Azurite too (connection string "UseDevelopmentStorage=true").
+    """
+    from azure.core.exceptions import ResourceExistsError
+    from azure.storage.blob import BlobServiceClient
+
+    service_client = BlobServiceClient.from_connection_string(connection_string)
+    container_client = service_client.get_container_client(container)
+    try:
+        container_client.create_container()
+    except ResourceExistsError:
+        pass
+    return container_client
+
+
+class AzureSegmentUploader:
+    """
+    Appends bronze records of one source to block blobs in Azure
+
+    Each append() compresses its records once into a gzip member and stages
+    it as blocks of at most block_bytes, then commits the blob's full block
+    list, so the blob is a valid .ndjson.gz holding every record appended so
+    far. Staging and committing are idempotent, so a failed call is retried
+    with the same bytes and block ids. A blob rolls over like a local segment
+    (size or age) or before it runs out of blocks. Blob names carry the
+    process id and a random token besides the sequence, so a restarted or
+    second uploader never commits over an existing blob.
+
+    container_client is anything with get_blob_client(name) returning an
+    object that has stage_block(block_id, data) and commit_block_list(ids),
+    such as azure.storage.blob.ContainerClient or a local stand-in.
+    """
+
+    def __init__(self, container_client, source: str,
+                 block_bytes: int = DEFAULT_BLOCK_BYTES,
+                 max_blob_bytes: int = DEFAULT_BLOB_MAX_BYTES,
+                 max_blob_seconds: float = DEFAULT_BLOB_MAX_SECONDS,
+                 max_attempts: int = 4, retry_backoff: float = 0.5,
+                 compression_level: int = 6):
+        self.container_client = container_client
+        self.source = source
+        self.block_bytes = block_bytes
+        self.max_blob_bytes = max_blob_bytes
+        self.max_blob_seconds = max_blob_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+        self.compression_level = compression_level
+
+        self._blob_client = None
+        self._blob_name = None
+        self._block_ids: List[str] = []
+        self._bytes = 0
+        self._opened_at = 0.0
+        self._sequence = 0
+        # Sequence numbers restart with every uploader; this keeps its blob names apart
+        self._writer_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    @classmethod
+    def from_connection_string(cls, connection_string: str, container: str, source: str, **options):
+        return cls(container_client_from_connection_string(connection_string, container), source, **options)
+
+    @property
+    def current_blob(self) -> Optional[str]:
+        return self._blob_name
+
+    def append_lines(self, lines: List[str]) -> Optional[str]:
+        """
+        Upload records already encoded as JSON (one per line, no newline)
+
+        Returns:
+            Name of the blob the records went to
+        """
+        if not lines:
+            return self._blob_name
+
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        member = gzip.compress(payload, compresslevel=self.compression_level, mtime=0)
+        blocks = [member[i:i + self.block_bytes] for i in range(0, len(member), self.block_bytes)]
+
+        if self._blob_client is not None and self._should_roll(len(blocks)):
+            self.roll()
+        if self._blob_client is None:
+            self._open()
+
+        staged = []
+        for block in blocks:
+            # Block ids must have the same length within a blob
+            block_id = f"{len(self._block_ids) + len(staged):08d}"
+            self._retry(self._blob_client.stage_block, block_id, block)
+            staged.append(block_id)
+        self._retry(self._blob_client.commit_block_list, self._block_ids + staged)
+
+        self._block_ids.extend(staged)
+        self._bytes += len(member)
+        return self._blob_name
+
+    def _should_roll(self, new_blocks: int) -> bool:
+        return (self._bytes >= self.max_blob_bytes
+                or time.monotonic() - self._opened_at >= self.max_blob_seconds
+                or len(self._block_ids) + new_blocks > MAX_BLOCKS_PER_BLOB)
+
+    def _open(self):
+        self._sequence += 1
+        stamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        self._blob_name = f"{self.source}_{stamp}_{self._sequence:06d}_{self._writer_id}{SEGMENT_SUFFIX}"
+        self._blob_client = self.container_client.get_blob_client(self._blob_name)
+        self._block_ids = []
+        self._bytes = 0
+        self._opened_at = time.monotonic()
+
+    def roll(self) -> Optional[str]:
+        """Start a new blob on the next append; returns the finished blob's name"""
+        name = self._blob_name
+        if name is not None:
+            logger.info(f"Bronze layer: Finished blob {name} ({self._bytes} bytes, {len(self._block_ids)} blocks)")
+        self._blob_client = None
+        self._blob_name = None
+        return name
+
+    def close(self) -> Optional[str]:
+        return self.roll()
+
+    def _retry(self, function, *args):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return function(*args)
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    raise
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(f"Azure upload to {self._blob_name} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
@@ -2,23 +2,348 @@
 Bronze Layer - Raw data ingestion
 Store all scraped data as-is without modification
 """
+import gzip
 import json
 import os
+import time
+import zlib
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Storage formats: one pretty-printed JSON file per batch, or rolling segments
+FORMAT_JSON = "json"
+FORMAT_SEGMENTS = "segments"
+
+# Finalized segments: gzip-compressed NDJSON, one raw record per line
+SEGMENT_SUFFIX = ".ndjson.gz"
+# Segments still being written: hidden, and removed from view until finalized
+PART_SUFFIX = ".part"
+# Append-only log of finalized segments, one JSON object per line
+MANIFEST_FILE = "_manifest.jsonl"
+
+DEFAULT_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_SEGMENT_MAX_SECONDS = 3600
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class SegmentManifest:
+    """
+    Append-only manifest of finalized bronze segments
+
+    A segment is listed only after it has been completely written and
+    renamed into place, so readers never see partial data. A writer that
+    dies between the rename and the append leaves a segment that
+    recover_segments() lists later; entries() keeps the first entry of a
+    segment listed twice.
+    """
+
+    def __init__(self, storage_path: str):
+        self.path = os.path.join(storage_path, MANIFEST_FILE)
+
+    def append(self, entry: Dict[str, Any]):
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        # One write on an O_APPEND descriptor: lines from concurrent writers don't interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def entries(self, source: str = None) -> List[Dict[str, Any]]:
+        """Finalized segments in the order they were finalized"""
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        seen = set()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line after a crash
+                    logger.warning(f"Skipping unreadable manifest line in {self.path}")
+                    continue
+                if entry.get("segment") in seen:
+                    continue
+                seen.add(entry.get("segment"))
+                if source is None or entry.get("source") == source:
+                    entries.append(entry)
+        return entries
+
+
+def iter_segment_records(filepath: str) -> Iterator[Dict[str, Any]]:
+    """Records of a bronze segment, streamed"""
+    with gzip.open(filepath, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class BronzeSegmentWriter:
+    """
+    Appends raw records of one source to rolling compressed NDJSON segments
+
+    Every append() writes one complete gzip member, so a segment is always
+    readable up to the last append even if the process dies. The open
+    segment is rolled over once it reaches max_segment_bytes or is older
+    than max_segment_seconds, and on close(). Age is checked on append;
+    callers that may go quiet also call roll_if_expired() periodically so
+    an idle segment doesn't stay open. Finalizing fsyncs the file,
+    renames it from its hidden .part name and records it in the manifest.
+    """
+
+    def __init__(self, storage_path: str, source: str,
+                 max_segment_bytes: int = DEFAULT_SEGMENT_MAX_BYTES,
+                 max_segment_seconds: float = DEFAULT_SEGMENT_MAX_SECONDS,
+                 compression_level: int = 6):
+        self.storage_path = storage_path
+        self.source = source
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        self.compression_level = compression_level
+        self.manifest = SegmentManifest(storage_path)
+        os.makedirs(storage_path, exist_ok=True)
+
+        self._file = None
+        self._name = None
+        self._part_path = None
+        self._opened_at = 0.0
+        self._first_ingestion = None
+        self._records = 0
+        self._bytes = 0
+
+        recover_segments(storage_path, source)
+
+    @property
+    def current_segment(self) -> Optional[str]:
+        return self._name
+
+    def append(self, records: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        Append records to the open segment, opening or rolling over as needed
+
+        Returns:
+            Name of the segment the records went to
+        """
+        return self.append_lines([json.dumps(record, ensure_ascii=False) for record in records])
+
+    def append_lines(self, lines: List[str]) -> Optional[str]:
+        """Like append(), for records already encoded as JSON (one per line, no newline)"""
+        if not lines:
+            return self._name
+        if self._file is not None and self._should_roll():
+            self.roll()
+        if self._file is None:
+            self._open()
+
+        payload = "\n".join(lines) + "\n"
+        member = gzip.compress(payload.encode("utf-8"), compresslevel=self.compression_level, mtime=0)
+        self._file.write(member)
+        self._file.flush()
+        self._records += len(lines)
+        self._bytes += len(member)
+        name = self._name
+
+        if self._bytes >= self.max_segment_bytes:
+            self.roll()
+        return name
+
+    def _should_roll(self) -> bool:
+        return (self._bytes >= self.max_segment_bytes
+                or time.monotonic() - self._opened_at >= self.max_segment_seconds)
+
+    def roll_if_expired(self) -> Optional[str]:
+        """Finalize the open segment if it is older than max_segment_seconds; returns its path"""
+        if self._file is not None and time.monotonic() - self._opened_at >= self.max_segment_seconds:
+            return self.roll()
+        return None
+
+    def _open(self):
+        stamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        sequence = _next_sequence(self.storage_path, self.source)
+        while True:
+            name = f"{self.source}_{stamp}_{sequence:06d}{SEGMENT_SUFFIX}"
+            part_path = os.path.join(self.storage_path, f".{name}.{os.getpid()}{PART_SUFFIX}")
+            try:
+                # O_EXCL: another writer of the same source may have taken this sequence
+                fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                sequence += 1
+                continue
+            if os.path.exists(os.path.join(self.storage_path, name)):
+                os.close(fd)
+                os.remove(part_path)
+                sequence += 1
+                continue
+            break
+
+        self._file = os.fdopen(fd, "wb")
+        self._name = name
+        self._part_path = part_path
+        self._opened_at = time.monotonic()
+        self._first_ingestion = datetime.utcnow().isoformat()
+        self._records = 0
+        self._bytes = 0
+
+    def roll(self) -> Optional[str]:
+        """Finalize the open segment; returns its path, or None if none was open"""
+        if self._file is None:
+            return None
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+        filepath = _finalize(self.storage_path, self.manifest, self._part_path, self._name, self.source,
+                             self._records, self._first_ingestion)
+        logger.info(f"Bronze layer: Finalized {self._records} records to {filepath}")
+        self._name = None
+        self._part_path = None
+        return filepath
+
+    def close(self) -> Optional[str]:
+        return self.roll()
+
+
+def parse_segment_name(name: str) -> Optional[Tuple[str, str, int]]:
+    """(source, timestamp, sequence) of a segment file name, or None"""
+    stem = name.lstrip(".")
+    if SEGMENT_SUFFIX not in stem:
+        return None
+    parts = stem.split(SEGMENT_SUFFIX)[0].rsplit("_", 3)
+    if len(parts) != 4 or not parts[3].isdigit():
+        return None
+    return parts[0], f"{parts[1]}_{parts[2]}", int(parts[3])
+
+
+def _next_sequence(storage_path: str, source: str) -> int:
+    highest = 0
+    for name in os.listdir(storage_path):
+        parsed = parse_segment_name(name)
+        if parsed and parsed[0] == source:
+            highest = max(highest, parsed[2])
+    return highest + 1
+
+
+def _finalize(storage_path: str, manifest: SegmentManifest, part_path: Optional[str], name: str, source: str,
+              records: int, first_ingestion: Optional[str]) -> str:
+    filepath = os.path.join(storage_path, name)
+    if part_path is not None:
+        os.rename(part_path, filepath)
+    manifest.append({
+        "segment": name,
+        "source": source,
+        "record_count": records,
+        "bytes": os.path.getsize(filepath),
+        "first_ingestion_timestamp": first_ingestion,
+        "finalized_timestamp": datetime.utcnow().isoformat(),
+    })
+    return filepath
+
+
+def recover_segments(storage_path: str, source: str = None) -> List[str]:
+    """
+    Finalize segments left open by writers that died
+
+    The file is cut after its last complete gzip member, so only records
+    from an interrupted append are lost. Segments that were renamed into
+    place but never reached the manifest are listed in it as well.
+    """
+    recovered = []
+    manifest = SegmentManifest(storage_path)
+    listed = {entry["segment"] for entry in manifest.entries()}
+    for name in sorted(os.listdir(storage_path)):
+        parsed = parse_segment_name(name)
+        if (parsed is None or name.startswith(".") or name in listed
+                or (source is not None and parsed[0] != source)):
+            continue
+        records = sum(1 for _ in iter_segment_records(os.path.join(storage_path, name)))
+        recovered.append(_finalize(storage_path, manifest, None, name, parsed[0], records, None))
+        logger.warning(f"Bronze layer: Listed {records} records of unlisted segment {name}")
+
+    for entry in os.listdir(storage_path):
+        if not (entry.startswith(".") and entry.endswith(PART_SUFFIX)):
+            continue
+        name, pid = entry[1:-len(PART_SUFFIX)].rsplit(".", 1)
+        parsed = parse_segment_name(name)
+        if parsed is None or (source is not None and parsed[0] != source):
+            continue
+        if not pid.isdigit() or int(pid) == os.getpid() or _pid_alive(int(pid)):
+            continue
+
+        part_path = os.path.join(storage_path, entry)
+        with open(part_path, "rb") as f:
+            raw = f.read()
+        offset = 0
+        records = 0
+        while offset < len(raw):
+            decompressor = zlib.decompressobj(wbits=31)
+            try:
+                data = decompressor.decompress(raw[offset:])
+            except zlib.error:
+                break
+            if not decompressor.eof:
+                break
+            records += data.count(b"\n")
+            offset = len(raw) - len(decompressor.unused_data)
+
+        if offset == 0:
+            os.remove(part_path)
+            continue
+        if offset < len(raw):
+            with open(part_path, "r+b") as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+        recovered.append(_finalize(storage_path, manifest, part_path, name, parsed[0], records, None))
+        logger.warning(f"Bronze layer: Recovered {records} records from interrupted segment {name}")
+    return recovered
+
 
 class BronzeLayer:
     """
     Bronze layer handles raw data ingestion from scrapers
     """
     
-    def __init__(self, storage_path: str = None):
+    def __init__(self, storage_path: str = None, storage_format: str = FORMAT_JSON,
+                 max_segment_bytes: int = DEFAULT_SEGMENT_MAX_BYTES,
+                 max_segment_seconds: float = DEFAULT_SEGMENT_MAX_SECONDS):
         self.storage_path = storage_path or os.path.join(os.path.dirname(__file__), "..", "data", "bronze")
         os.makedirs(self.storage_path, exist_ok=True)
+        self.storage_format = storage_format
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        self.manifest = SegmentManifest(self.storage_path)
+        self._writers: Dict[str, BronzeSegmentWriter] = {}
+    
+    def segment_writer(self, source: str) -> BronzeSegmentWriter:
+        """The rolling segment writer of a source"""
+        writer = self._writers.get(source)
+        if writer is None:
+            writer = self._writers[source] = BronzeSegmentWriter(
+                self.storage_path, source, self.max_segment_bytes, self.max_segment_seconds
+            )
+        return writer
+    
+    def close(self):
+        """Finalize all open segments"""
+        for writer in self._writers.values():
+            writer.close()
     
     def ingest(self, data: List[Dict[str, Any]], source: str, batch_id: str = None) -> str:
         """
@@ -30,8 +355,17 @@ class BronzeLayer:
             batch_id: Optional batch identifier
         
         Returns:
-            File path where data was stored
+            File path where data was stored. In segments format this is the
+            final path of the segment the records were appended to; the file
+            only exists there, and in list_segments(), once the segment is
+            rolled over or the layer is closed.
         """
+        if self.storage_format == FORMAT_SEGMENTS:
+            writer = self.segment_writer(source)
+            segment = writer.append(data)
+            logger.info(f"Bronze layer: Appended {len(data)} records to segment {segment}")
+            return os.path.join(self.storage_path, segment)
+        
         if batch_id is None:
             batch_id = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         
@@ -60,7 +394,7 @@ class BronzeLayer:
         """
         List all bronze batches, optionally filtered by source
         """
-        files = os.listdir(self.storage_path)
+        files = [f for f in os.listdir(self.storage_path) if not f.startswith((".", "_"))]
         
         if source:
             files = [f for f in files if f.startswith(source)]
@@ -73,5 +407,27 @@ class BronzeLayer:
         """
         filepath = os.path.join(self.storage_path, filename)
         
+        if filename.endswith(SEGMENT_SUFFIX):
+            records = list(iter_segment_records(filepath))
+            entry = next((e for e in self.manifest.entries() if e["segment"] == filename), {})
+            return {
+                "metadata": {
+                    "source": entry.get("source", parse_segment_name(filename)[0]),
+                    "batch_id": filename[:-len(SEGMENT_SUFFIX)],
+                    "ingestion_timestamp": entry.get("first_ingestion_timestamp"),
+                    "record_count": len(records),
+                },
+                "data": records
+            }
+        
         with open(filepath, "r", encoding="utf-8") as f:
             return json.load(f)
+    
+    def list_segments(self, source: str = None) -> List[Dict[str, Any]]:
+        """Manifest entries of finalized segments, optionally filtered by source"""
+        return self.manifest.entries(source)
+    
+    def iter_records(self, source: str = None) -> Iterator[Dict[str, Any]]:
+        """Records of all finalized segments, streamed in manifest order"""
+        for entry in self.manifest.entries(source):
+            yield from iter_segment_records(os.path.join(self.storage_path, entry["segment"]))
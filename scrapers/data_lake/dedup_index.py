@@ -0,0 +1,157 @@
+"""
+Dedup Index - Persistent set of record digests
+SQLite-backed store of binary hashes with an optional in-memory Bloom filter in front
+"""
+import math
+import os
+import sqlite3
+from typing import Iterable, List, Optional
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip when building the Bloom filter
+SCAN_BATCH_SIZE = 100000
+
+
+class BloomFilter:
+    """
+    Bloom filter over digests that are already uniformly random (e.g. SHA-256)
+
+    Bit positions are taken from 4-byte slices of the digest itself, so
+    no extra hashing is needed; digests must be at least 4 * hash_count bytes.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, min(8, round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest: bytes):
+        for i in range(self.hash_count):
+            yield int.from_bytes(digest[4 * i:4 * i + 4], "little") % self.size
+
+    def add(self, digest: bytes):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def add_many(self, digests: List[bytes]):
+        """Add equal-length digests at once (vectorized, for bulk loading)"""
+        if not digests:
+            return
+        words = np.frombuffer(b"".join(digests), dtype="<u4").reshape(len(digests), -1)
+        positions = (words[:, :self.hash_count].astype(np.uint64) % self.size).ravel()
+        bits = np.frombuffer(self.bits, dtype=np.uint8).copy()
+        np.bitwise_or.at(bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+        self.bits = bytearray(bits.tobytes())
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+
+class DedupIndex:
+    """
+    Persistent, compact set of record digests
+
+    Digests are stored as raw bytes in a WITHOUT ROWID SQLite table, so a
+    SHA-256 costs 32 bytes on disk instead of a 65-byte text line, and
+    lookups don't need the whole history in memory. Additions are held
+    in memory and written in one transaction by commit(). With
+    bloom_capacity set, a Bloom filter sized for that many digests is
+    loaded at open and answers most lookups of new digests without
+    touching the database.
+    """
+
+    def __init__(self, path: str, bloom_capacity: int = 0, bloom_error_rate: float = 0.01):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS digests (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.conn.commit()
+        self.pending = set()
+
+        self.bloom: Optional[BloomFilter] = None
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        if bloom_capacity > 0:
+            self.bloom_capacity = max(bloom_capacity, len(self))
+            self.bloom = BloomFilter(self.bloom_capacity, bloom_error_rate)
+            self._load_bloom()
+
+    def _load_bloom(self):
+        cursor = self.conn.execute("SELECT digest FROM digests")
+        while True:
+            rows = cursor.fetchmany(SCAN_BATCH_SIZE)
+            if not rows:
+                break
+            self.bloom.add_many([digest for (digest,) in rows])
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0] + len(self.pending)
+
+    def __contains__(self, digest: bytes) -> bool:
+        if digest in self.pending:
+            return True
+        if self.bloom is not None and digest not in self.bloom:
+            return False
+        return self.conn.execute("SELECT 1 FROM digests WHERE digest = ?", (digest,)).fetchone() is not None
+
+    def add(self, digest: bytes):
+        """Add a digest; persisted on the next commit()"""
+        self.pending.add(digest)
+        if self.bloom is not None:
+            self.bloom.add(digest)
+
+    def update(self, digests: Iterable[bytes]):
+        for digest in digests:
+            self.add(digest)
+
+    def commit(self):
+        """Write pending digests in one transaction"""
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO digests (digest) VALUES (?)",
+                                  ((digest,) for digest in self.pending))
+        self.pending.clear()
+
+    def rollback(self):
+        """Forget digests added since the last commit()"""
+        self.pending.clear()
+        if self.bloom is not None:
+            # A Bloom filter can't drop entries: rebuild it from what is committed
+            self.bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+            self._load_bloom()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def import_hex_file(self, hash_file: str) -> int:
+        """
+        Import a legacy text file of hex digests (one per line) and rename it
+
+        Returns:
+            Number of digests imported
+        """
+        count = 0
+        with open(hash_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self.add(bytes.fromhex(line))
+                except ValueError:
+                    continue
+                count += 1
+                if len(self.pending) >= SCAN_BATCH_SIZE:
+                    self.commit()
+        self.commit()
+        os.replace(hash_file, hash_file + ".migrated")
+        logger.info(f"Dedup index: Imported {count} hashes from {hash_file}")
+        return count
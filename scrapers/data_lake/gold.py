@@ -2,12 +2,13 @@
 Gold Layer - Analytics-ready data
 Feature engineering, enrichment, and database preparation
 """
-import json
 import os
 from datetime import datetime
 from typing import List, Dict, Any
 import logging
 
+from .json_stream import JsonRecordWriter, iter_records
+
 logger = logging.getLogger(__name__)
 
 # Price category thresholds (in TND)
@@ -30,7 +31,7 @@ class GoldLayer:
         Process silver data into gold layer
         
         Args:
-            silver_data: Data from silver layer
+            silver_data: Data from silver layer ("data" may be a generator)
             batch_id: Optional batch identifier
         
         Returns:
@@ -40,33 +41,25 @@ class GoldLayer:
             batch_id = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         
         source = silver_data["metadata"]["source"]
-        records = silver_data["data"]
-        
-        enriched_records = []
-        
-        for record in records:
-            enriched = self._enrich_record(record)
-            if enriched:
-                enriched_records.append(enriched)
         
-        # Save to gold layer
+        # Save to gold layer, enriching one record at a time ("data" may be any iterable)
         filename = f"{source}_{batch_id}_gold.json"
         filepath = os.path.join(self.storage_path, filename)
         
-        gold_data = {
-            "metadata": {
+        with JsonRecordWriter(filepath) as writer:
+            for record in silver_data["data"]:
+                enriched = self._enrich_record(record)
+                if enriched:
+                    writer.write(enriched)
+            
+            writer.metadata = {
                 "source": source,
                 "batch_id": batch_id,
                 "enrichment_timestamp": datetime.utcnow().isoformat(),
-                "record_count": len(enriched_records),
-            },
-            "data": enriched_records
-        }
+                "record_count": writer.count,
+            }
         
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(gold_data, f, ensure_ascii=False, indent=2)
-        
-        logger.info(f"Gold layer: Enriched {len(enriched_records)} records to {filepath}")
+        logger.info(f"Gold layer: Enriched {writer.count} records to {filepath}")
         
         return filepath
     
@@ -166,12 +159,9 @@ class GoldLayer:
         """
         filepath = os.path.join(self.storage_path, gold_file)
         
-        with open(filepath, "r", encoding="utf-8") as f:
-            gold_data = json.load(f)
-        
         # Filter only records ready for import
         ready_records = [
-            r for r in gold_data["data"]
+            r for r in iter_records(filepath)
             if r.get("ready_for_import", False)
         ]
         
@@ -0,0 +1,189 @@
+"""
+JSON Stream - Record-at-a-time reading and writing of data lake files
+Handles the {"metadata", "data"} envelope, bare lists of records and NDJSON segments
+"""
+import json
+import os
+from typing import Any, Dict, Iterator, Optional
+import logging
+
+from .bronze import SEGMENT_SUFFIX, iter_segment_records
+
+logger = logging.getLogger(__name__)
+
+# Characters read per refill; a record larger than this just takes several refills
+READ_CHUNK_CHARS = 64 * 1024
+
+_WHITESPACE = " \t\n\r"
+
+
+class JsonRecordReader:
+    """
+    Streams the records of a layer file without loading the whole document
+
+    Works on an envelope object (records under "data", other keys such as
+    "metadata" in any order), on a bare JSON list of records and on NDJSON
+    segments. Memory is bounded by the largest single record. metadata is
+    filled in as it is parsed: before iteration starts if it precedes
+    "data" in the file, otherwise once iteration is finished.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.metadata: Optional[Dict[str, Any]] = None
+        self._decoder = json.JSONDecoder()
+        self._file = None
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.path.endswith(SEGMENT_SUFFIX):
+            yield from iter_segment_records(self.path)
+            return
+
+        with open(self.path, "r", encoding="utf-8") as self._file:
+            self._buffer, self._pos, self._eof = "", 0, False
+            first = self._peek()
+            if first == "[":
+                yield from self._iter_array()
+            elif first == "{":
+                yield from self._iter_envelope()
+            else:
+                raise ValueError(f"Expected a JSON object or list in {self.path}")
+
+    def _fill(self) -> bool:
+        """Read more text into the buffer; False at end of file"""
+        if self._eof:
+            return False
+        chunk = self._file.read(READ_CHUNK_CHARS)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Next non-whitespace character, without consuming it ('' at end of file)"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, characters: str) -> str:
+        character = self._peek()
+        if character not in characters:
+            raise ValueError(f"Malformed JSON in {self.path}: expected one of {characters!r}, got {character!r}")
+        self._pos += 1
+        return character
+
+    def _value(self) -> Any:
+        """Decode the next complete JSON value, reading more text as needed"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Most likely cut off at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and not self._eof and isinstance(value, (int, float)):
+                if self._fill():
+                    continue
+            self._pos = end
+            return value
+
+    def _iter_array(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(",]") == "]":
+                return
+
+    def _iter_envelope(self) -> Iterator[Dict[str, Any]]:
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "data":
+                yield from self._iter_array()
+            elif key == "metadata":
+                self.metadata = self._value()
+            else:
+                self._value()
+            if self._expect(",}") == "}":
+                return
+
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Records of a layer file, streamed"""
+    return iter(JsonRecordReader(path))
+
+
+class JsonRecordWriter:
+    """
+    Writes an envelope file one record at a time
+
+    Records are streamed under "data" and "metadata" is written last, once
+    counts are known, so the document is the same as
+    json.dump({"data": [...], "metadata": {...}}, f, ensure_ascii=False, indent=2).
+    The file is written next to its destination and renamed into place on
+    close, so readers never see a partial file.
+
+    Usage:
+        with JsonRecordWriter(path) as writer:
+            for record in records:
+                writer.write(record)
+            writer.metadata = {...}
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.metadata: Dict[str, Any] = {}
+        self.count = 0
+        self._tmp_path = f"{self.path}.tmp"
+        self._file = open(self._tmp_path, "w", encoding="utf-8")
+        self._file.write('{\n  "data": [')
+
+    def write(self, record: Dict[str, Any]):
+        text = json.dumps(record, ensure_ascii=False, indent=2)
+        # Encoded strings never contain raw newlines, so this only re-indents structure
+        self._file.write(("\n    " if self.count == 0 else ",\n    ") + text.replace("\n", "\n    "))
+        self.count += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.write("\n  ]" if self.count else "]")
+        metadata = json.dumps(self.metadata, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        self._file.write(f',\n  "metadata": {metadata}\n}}')
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Drop the partial file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._tmp_path)
+
+    def __enter__(self) -> "JsonRecordWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
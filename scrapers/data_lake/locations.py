@@ -0,0 +1,127 @@
+"""
+Locations - Canonical Tunisian governorate and delegation names
+Lookup tables built once at import, keyed by a spelling-insensitive form of the name
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Optional
+
+# Leading articles dropped from keys: "Le Kef", "El Kef" and "Kef" are one name
+_ARTICLES = frozenset(["el", "le", "la", "les", "al", "l"])
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+# Arabic letters written interchangeably in place names
+_ARABIC_FOLD = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ة": "ه", "ى": "ي", "ـ": None})
+
+# Canonical name -> other spellings seen in listings (French, English and Arabic).
+# Canonical names of places the AI service prices are spelled as in its regional
+# price table, whose keys ignore case, accents and separators but not articles
+# ("Bardo", not "Le Bardo"), so silver and gold rows land on the same region.
+GOVERNORATE_SPELLINGS = {
+    "Tunis": ["tunis", "تونس"],
+    "Ariana": ["ariana", "aryana", "أريانة"],
+    "Ben Arous": ["ben arous", "benarous", "bin arous", "بن عروس"],
+    "Manouba": ["manouba", "la manouba", "mannouba", "منوبة"],
+    "Nabeul": ["nabeul", "nabel", "نابل"],
+    "Zaghouan": ["zaghouan", "zaghwan", "زغوان"],
+    "Bizerte": ["bizerte", "bizerta", "banzart", "بنزرت"],
+    "Béja": ["beja", "bajah", "باجة"],
+    "Jendouba": ["jendouba", "jandouba", "جندوبة"],
+    "Le Kef": ["kef", "el kef", "al kaf", "الكاف"],
+    "Siliana": ["siliana", "silyana", "سليانة"],
+    "Sousse": ["sousse", "susa", "sousa", "سوسة"],
+    "Monastir": ["monastir", "al munastir", "المنستير"],
+    "Mahdia": ["mahdia", "mehdia", "المهدية"],
+    "Sfax": ["sfax", "safaqis", "صفاقس"],
+    "Kairouan": ["kairouan", "kairuan", "qairouan", "al qayrawan", "القيروان"],
+    "Kasserine": ["kasserine", "kasserin", "al qasrayn", "القصرين"],
+    "Sidi Bouzid": ["sidi bouzid", "sidi bou zid", "سيدي بوزيد"],
+    "Gabès": ["gabes", "qabis", "قابس"],
+    "Médenine": ["medenine", "mednine", "madanin", "مدنين"],
+    "Tataouine": ["tataouine", "tatawin", "تطاوين"],
+    "Gafsa": ["gafsa", "qafsa", "قفصة"],
+    "Tozeur": ["tozeur", "tawzar", "توزر"],
+    "Kébili": ["kebili", "qibili", "قبلي"],
+}
+
+DELEGATION_SPELLINGS = {
+    # Tunis
+    "La Marsa": ["marsa", "المرسى"],
+    "Carthage": ["carthage", "قرطاج"],
+    "La Goulette": ["goulette", "halq al wadi", "حلق الوادي"],
+    "Le Kram": ["kram", "الكرم"],
+    "Bardo": ["le bardo", "باردو"],
+    "Menzah": ["el menzah", "المنزه"],
+    "Cité El Khadra": ["cite el khadra", "cite khadra"],
+    "El Omrane": ["omrane", "العمران"],
+    "El Ouardia": ["ouardia", "الوردية"],
+    "Sidi Hassine": ["sidi hassine", "sidi hsine"],
+    "Séjoumi": ["sejoumi", "sijoumi"],
+    # Ariana
+    "Ariana Ville": ["ariana ville"],
+    "Soukra": ["la soukra", "سكرة"],
+    "Raoued": ["raoued", "rouad", "رواد"],
+    "Ettadhamen": ["ettadhamen", "tadhamen", "التضامن"],
+    "Mnihla": ["mnihla", "المنيهلة"],
+    "Sidi Thabet": ["sidi thabet", "سيدي ثابت"],
+    "Kalâat el-Andalous": ["kalaat el andalous", "kalaat andalous", "قلعة الأندلس"],
+    # Ben Arous
+    "Hammam Lif": ["hammam lif", "hammam-lif", "حمام الأنف"],
+    "Hammam Chott": ["hammam chott", "حمام الشط"],
+    "Radès": ["rades", "رادس"],
+    "Ezzahra": ["ezzahra", "zahra", "الزهراء"],
+    "Mégrine": ["megrine", "مقرين"],
+    "Mornag": ["mornag", "مرناق"],
+    "El Mourouj": ["mourouj", "المروج"],
+    "Fouchana": ["fouchana", "فوشانة"],
+    "Mohamedia": ["mohamedia", "المحمدية"],
+    "Nouvelle Médina": ["nouvelle medina", "المدينة الجديدة"],
+    # Nabeul
+    "Hammamet": ["hammamet", "الحمامات"],
+    "Kélibia": ["kelibia", "قليبية"],
+    "Korba": ["korba", "قربة"],
+    "Dar Chaâbane": ["dar chaabane", "dar chaabane el fehri", "دار شعبان"],
+    # Sousse, Monastir, Sfax
+    "Hammam Sousse": ["hammam sousse", "حمام سوسة"],
+    "Akouda": ["akouda", "أكودة"],
+    "Kalâa Kebira": ["kalaa kebira", "kalaa kbira", "القلعة الكبرى"],
+    "Msaken": ["msaken", "مساكن"],
+    "Sousse Ville": ["sousse ville"],
+    "Sahline": ["sahline", "الساحلين"],
+    "Sakiet Ezzit": ["sakiet ezzit", "ساقية الزيت"],
+    "Sakiet Eddaïer": ["sakiet eddaier", "ساقية الدائر"],
+}
+
+
+def location_key(name: str) -> str:
+    """Spelling-insensitive form of a place name (case, accents, punctuation, article)"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    words = _NON_WORD.sub(" ", stripped.lower().translate(_ARABIC_FOLD)).split()
+    if len(words) > 1 and words[0] in _ARTICLES:
+        words = words[1:]
+    return "".join(words)
+
+
+def _build_table(spellings: Dict[str, list]) -> Dict[str, str]:
+    table = {}
+    for canonical, variants in spellings.items():
+        for name in [canonical] + variants:
+            table[location_key(name)] = canonical
+    return table
+
+
+GOVERNORATES = _build_table(GOVERNORATE_SPELLINGS)
+DELEGATIONS = _build_table(DELEGATION_SPELLINGS)
+
+
+@lru_cache(maxsize=4096)
+def canonical_governorate(name: str) -> Optional[str]:
+    """Canonical governorate for a spelling, or None if it isn't known"""
+    return GOVERNORATES.get(location_key(name))
+
+
+@lru_cache(maxsize=16384)
+def canonical_delegation(name: str) -> Optional[str]:
+    """Canonical delegation for a spelling, or None if it isn't known"""
+    return DELEGATIONS.get(location_key(name))
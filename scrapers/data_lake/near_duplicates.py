@@ -0,0 +1,308 @@
+"""
+Near-Duplicate Detection - Same property listed on several sites
+MinHash signatures of the listing text, LSH buckets per location block and price/size range, distance checks
+"""
+import math
+import pickle
+import re
+import unicodedata
+import zlib
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_PERM = 64
+# 16 bands of 4 rows: pairs above ~0.5 estimated Jaccard collide in some band
+DEFAULT_BANDS = 16
+DEFAULT_SHINGLE_SIZE = 4
+DEFAULT_THRESHOLD = 0.6
+DEFAULT_PRICE_TOLERANCE = 0.1
+DEFAULT_SIZE_TOLERANCE = 0.1
+DEFAULT_MAX_DISTANCE_KM = 1.0
+# Listings compared per lookup, and per LSH bucket, when many share a bucket (generic titles)
+DEFAULT_MAX_CANDIDATES = 256
+
+# Smallest prime above 2**32: permuted hashes stay exact in uint64 arithmetic
+_PRIME = np.uint64(4294967311)
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Lowercase, accents stripped, punctuation collapsed to single spaces"""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_WORD.sub(" ", stripped.lower()).strip()
+
+
+def shingles(text: str, size: int = DEFAULT_SHINGLE_SIZE) -> set:
+    """Character shingles of normalized text (the whole text if shorter)"""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _to_float(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (ValueError, TypeError):
+        return None
+    return number if math.isfinite(number) and number > 0 else None
+
+
+def _magnitude_width(tolerance: float) -> float:
+    """Log-scale bucket width such that values within tolerance are at most one bucket apart"""
+    return -math.log1p(-min(max(tolerance, 1e-6), 0.99))
+
+
+def _within(a: Optional[float], b: Optional[float], tolerance: float) -> bool:
+    """Relative difference at most tolerance; unknown values never rule a pair out"""
+    if a is None or b is None:
+        return True
+    return abs(a - b) <= tolerance * max(a, b)
+
+
+class _Entry:
+    __slots__ = ("block", "signature", "price", "size", "latitude", "longitude", "property_type", "source")
+
+    def __init__(self, block, signature, price, size, latitude, longitude, property_type, source):
+        self.block = block
+        self.signature = signature
+        self.price = price
+        self.size = size
+        self.latitude = latitude
+        self.longitude = longitude
+        self.property_type = property_type
+        self.source = source
+
+
+class NearDuplicateIndex:
+    """
+    Incremental index of listings for near-duplicate lookups
+
+    Title and description are reduced to a MinHash signature of character
+    shingles, so relistings with reworded or reordered titles still look
+    alike. Signatures are split into bands; a listing is compared only with
+    listings sharing a band in the same block (transaction type and
+    governorate) and a neighbouring price or size range (log-scale buckets
+    as wide as the tolerance). At most max_candidates of them are compared,
+    the newest of each bucket first, so a block full of identical generic
+    titles can't make lookups grow with the index. Candidate similarities
+    are computed in one vectorized pass; those reaching `threshold`
+    estimated similarity must also agree on property type, and be within
+    max_distance_km when both have coordinates. Price and size must agree
+    within tolerance, and at least one of them must be known for both
+    listings: similar text alone (e.g. a generic "Appartement S+2 à
+    vendre") is never enough.
+
+    add() and find() are per record, so the index can be fed a stream and
+    saved between runs.
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, bands: int = DEFAULT_BANDS,
+                 threshold: float = DEFAULT_THRESHOLD, shingle_size: int = DEFAULT_SHINGLE_SIZE,
+                 price_tolerance: float = DEFAULT_PRICE_TOLERANCE,
+                 size_tolerance: float = DEFAULT_SIZE_TOLERANCE,
+                 max_distance_km: float = DEFAULT_MAX_DISTANCE_KM,
+                 cross_source_only: bool = False, max_candidates: int = DEFAULT_MAX_CANDIDATES,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.price_tolerance = price_tolerance
+        self.size_tolerance = size_tolerance
+        self.max_distance_km = max_distance_km
+        self.cross_source_only = cross_source_only
+        self.max_candidates = max(1, max_candidates)
+        self._price_width = _magnitude_width(price_tolerance)
+        self._size_width = _magnitude_width(size_tolerance)
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 2 ** 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+
+        self._entries: Dict[str, _Entry] = {}
+        # Band key -> listing keys in insertion order (dict for O(1) removal)
+        self._buckets: Dict[Tuple, Dict[str, None]] = {}
+        # Listing key -> key of the first listing of its duplicate group
+        self._canonical: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def record_key(record: Dict[str, Any]) -> Optional[str]:
+        """Identity of a listing: its site and listing id (or URL, or content hash); None if it has none"""
+        identity = record.get('listing_id') or record.get('source_url') or record.get('content_hash')
+        if not identity:
+            return None
+        return f"{record.get('source_website') or ''}:{identity}"
+
+    def signature(self, record: Dict[str, Any]) -> Optional[np.ndarray]:
+        """MinHash signature of the listing text, or None if it has no text"""
+        text = normalize_text(f"{record.get('title') or ''} {record.get('description') or ''}")
+        grams = shingles(text, self.shingle_size)
+        if not grams:
+            return None
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+        return ((hashes[:, None] * self._a + self._b) % _PRIME).min(axis=0)
+
+    def _block(self, record: Dict[str, Any]) -> Tuple[str, str]:
+        return (
+            (record.get("transaction_type") or "").upper(),
+            normalize_text(record.get("governorate")),
+        )
+
+    def _magnitudes(self, entry: _Entry) -> List[Tuple[str, int]]:
+        """Price and size buckets of an entry; a pair can only match if it shares one"""
+        magnitudes = []
+        if entry.price:
+            magnitudes.append(("price", math.floor(math.log(entry.price) / self._price_width)))
+        if entry.size:
+            magnitudes.append(("size", math.floor(math.log(entry.size) / self._size_width)))
+        return magnitudes
+
+    def _band_keys(self, entry: _Entry, neighbours: bool = False):
+        """Buckets an entry is filed under, or with neighbours=True, the buckets to look it up in"""
+        offsets = (0, -1, 1) if neighbours else (0,)
+        for dimension, bucket in self._magnitudes(entry):
+            for band in range(self.bands):
+                rows = entry.signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for offset in offsets:
+                    yield (entry.block, dimension, bucket + offset, band, rows)
+
+    def _entry(self, record: Dict[str, Any], block: Tuple[str, str], signature: np.ndarray) -> _Entry:
+        latitude = record.get("latitude")
+        longitude = record.get("longitude")
+        try:
+            latitude = float(latitude) if latitude is not None else None
+            longitude = float(longitude) if longitude is not None else None
+        except (ValueError, TypeError):
+            latitude = longitude = None
+        return _Entry(
+            block, signature, _to_float(record.get("price")), _to_float(record.get("size")), latitude, longitude,
+            (record.get("property_type") or "").upper() or None, record.get("source_website"),
+        )
+
+    def _matches(self, entry: _Entry, other: _Entry) -> bool:
+        if self.cross_source_only and entry.source == other.source:
+            return False
+        if entry.property_type and other.property_type and entry.property_type != other.property_type:
+            return False
+        if not (entry.price and other.price) and not (entry.size and other.size):
+            return False
+        if not _within(entry.price, other.price, self.price_tolerance):
+            return False
+        if not _within(entry.size, other.size, self.size_tolerance):
+            return False
+        if None not in (entry.latitude, entry.longitude, other.latitude, other.longitude):
+            if _distance_km(entry.latitude, entry.longitude, other.latitude, other.longitude) > self.max_distance_km:
+                return False
+        return True
+
+    def _find(self, entry: _Entry, exclude: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        per_bucket = max(1, self.max_candidates // self.bands)
+        candidates: Dict[str, None] = {}
+        for band_key in self._band_keys(entry, neighbours=True):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                candidates.update(dict.fromkeys(islice(reversed(bucket), per_bucket)))
+                if len(candidates) > self.max_candidates:
+                    break
+        candidates.pop(exclude, None)
+        if not candidates:
+            return None
+
+        keys = list(islice(candidates, self.max_candidates))
+        signatures = np.stack([self._entries[key].signature for key in keys])
+        similarities = np.count_nonzero(signatures == entry.signature, axis=1) / self.num_perm
+        passing = np.flatnonzero(similarities >= self.threshold)
+        best = None
+        # Most similar first; among equally similar matches the smallest key wins
+        for position in passing[np.argsort(-similarities[passing], kind="stable")].tolist():
+            similarity = float(similarities[position])
+            if best is not None and similarity < best[1]:
+                break
+            key = keys[position]
+            if (best is None or key < best[0]) and self._matches(entry, self._entries[key]):
+                best = (key, similarity)
+        return best
+
+    def find(self, record: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+        """
+        Most similar indexed listing that is a near duplicate of record
+
+        Returns:
+            (canonical listing key, estimated similarity), or None
+        """
+        signature = self.signature(record)
+        if signature is None:
+            return None
+        block = self._block(record)
+        match = self._find(self._entry(record, block, signature), exclude=self.record_key(record))
+        if match is None:
+            return None
+        return self._canonical.get(match[0], match[0]), match[1]
+
+    def add(self, record: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+        """
+        Index a listing, returning the near duplicate it matched as find() does
+
+        A listing that matches joins its match's group; it stays indexed so
+        later relistings can match either of them. A record with no identity
+        (see record_key) is only looked up: indexing it could replace another.
+        """
+        key = self.record_key(record)
+        if key is None:
+            return self.find(record)
+        signature = self.signature(record)
+        if signature is None:
+            return None
+        entry = self._entry(record, self._block(record), signature)
+
+        if key in self._entries:
+            self._remove(key)
+        match = self._find(entry)
+        canonical = self._canonical.get(match[0], match[0]) if match else key
+        self._canonical[key] = canonical
+
+        self._entries[key] = entry
+        for band_key in self._band_keys(entry):
+            self._buckets.setdefault(band_key, {})[key] = None
+        return (canonical, match[1]) if match else None
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        for band_key in self._band_keys(entry):
+            bucket = self._buckets[band_key]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[band_key]
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> "NearDuplicateIndex":
+        index = cls.__new__(cls)
+        with open(path, "rb") as f:
+            index.__dict__.update(pickle.load(f))
+        return index
@@ -2,13 +2,15 @@
 Silver Layer - Data cleaning and standardization
 Clean, validate, and deduplicate data from Bronze layer
 """
-import json
 import os
 import hashlib
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 import logging
 
+from .dedup_index import DedupIndex
+from .json_stream import JsonRecordWriter
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,31 +26,30 @@ class SilverLayer:
         "max_lng": 11.6,
     }
     
-    def __init__(self, storage_path: str = None):
+    def __init__(self, storage_path: str = None, bloom_capacity: int = 0):
+        """
+        Args:
+            storage_path: Silver layer directory
+            bloom_capacity: Expected number of distinct records; when set, an
+                in-memory Bloom filter of that size fronts the dedup index
+        """
         self.storage_path = storage_path or os.path.join(os.path.dirname(__file__), "..", "data", "silver")
         os.makedirs(self.storage_path, exist_ok=True)
-        self.seen_hashes = set()
-        self._load_existing_hashes()
+        self.dedup_index = DedupIndex(os.path.join(self.storage_path, "_dedup.sqlite3"), bloom_capacity)
+        self._migrate_hash_file()
     
-    def _load_existing_hashes(self):
-        """Load hashes of already processed records"""
+    def _migrate_hash_file(self):
+        """Move hashes from the legacy _hashes.txt into the dedup index"""
         hash_file = os.path.join(self.storage_path, "_hashes.txt")
         if os.path.exists(hash_file):
-            with open(hash_file, "r") as f:
-                self.seen_hashes = set(line.strip() for line in f)
-    
-    def _save_hash(self, hash_value: str):
-        """Save a hash to the hash file"""
-        hash_file = os.path.join(self.storage_path, "_hashes.txt")
-        with open(hash_file, "a") as f:
-            f.write(f"{hash_value}\n")
+            self.dedup_index.import_hex_file(hash_file)
     
     def process(self, bronze_data: Dict[str, Any], batch_id: str = None) -> str:
         """
         Process bronze data into silver layer
         
         Args:
-            bronze_data: Data from bronze layer
+            bronze_data: Data from bronze layer ("data" may be a generator)
             batch_id: Optional batch identifier
         
         Returns:
@@ -58,57 +59,59 @@ class SilverLayer:
             batch_id = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         
         source = bronze_data["metadata"]["source"]
-        raw_records = bronze_data["data"]
-        
-        cleaned_records = []
-        duplicates = 0
-        invalid = 0
         
-        for record in raw_records:
-            # Check for duplicates
-            record_hash = self._calculate_hash(record)
-            if record_hash in self.seen_hashes:
-                duplicates += 1
-                continue
-            
-            # Clean and validate
-            cleaned_record = self._clean_record(record)
-            
-            if cleaned_record and self._validate_record(cleaned_record):
-                cleaned_records.append(cleaned_record)
-                self.seen_hashes.add(record_hash)
-                self._save_hash(record_hash)
-            else:
-                invalid += 1
-        
-        # Save to silver layer
         filename = f"{source}_{batch_id}_silver.json"
         filepath = os.path.join(self.storage_path, filename)
         
-        silver_data = {
-            "metadata": {
-                "source": source,
-                "batch_id": batch_id,
-                "processing_timestamp": datetime.utcnow().isoformat(),
-                "input_count": len(raw_records),
-                "output_count": len(cleaned_records),
-                "duplicates_removed": duplicates,
-                "invalid_records": invalid,
-            },
-            "data": cleaned_records
-        }
-        
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(silver_data, f, ensure_ascii=False, indent=2)
-        
-        logger.info(f"Silver layer: Processed {len(cleaned_records)}/{len(raw_records)} records to {filepath}")
+        input_count = 0
+        duplicates = 0
+        invalid = 0
+        
+        # Records are cleaned and written one at a time; "data" may be any iterable
+        try:
+            with JsonRecordWriter(filepath) as writer:
+                for record in bronze_data["data"]:
+                    input_count += 1
+                    
+                    # Check for duplicates
+                    record_hash = self._calculate_hash(record)
+                    if record_hash in self.dedup_index:
+                        duplicates += 1
+                        continue
+                    
+                    # Clean and validate
+                    cleaned_record = self._clean_record(record)
+                    
+                    if cleaned_record and self._validate_record(cleaned_record):
+                        writer.write(cleaned_record)
+                        self.dedup_index.add(record_hash)
+                    else:
+                        invalid += 1
+                
+                writer.metadata = {
+                    "source": source,
+                    "batch_id": batch_id,
+                    "processing_timestamp": datetime.utcnow().isoformat(),
+                    "input_count": input_count,
+                    "output_count": writer.count,
+                    "duplicates_removed": duplicates,
+                    "invalid_records": invalid,
+                }
+        except Exception:
+            # Nothing was written, so none of the batch's hashes may be kept
+            self.dedup_index.rollback()
+            raise
+        
+        # Hashes are persisted once the batch they dedup against is written
+        self.dedup_index.commit()
+        
+        logger.info(f"Silver layer: Processed {writer.count}/{input_count} records to {filepath}")
         logger.info(f"Removed {duplicates} duplicates, {invalid} invalid records")
         
         return filepath
     
-    def _calculate_hash(self, record: Dict[str, Any]) -> str:
-        """Calculate SHA-256 hash for deduplication"""
-        import hashlib
+    def _calculate_hash(self, record: Dict[str, Any]) -> bytes:
+        """Calculate SHA-256 digest for deduplication"""
         key_fields = [
             str(record.get("title", "")),
             str(record.get("price", "")),
@@ -117,7 +120,7 @@ class SilverLayer:
             str(record.get("neighborhood", "")),
         ]
         content = "|".join(key_fields).encode("utf-8")
-        return hashlib.sha256(content).hexdigest()
+        return hashlib.sha256(content).digest()
     
     def _clean_record(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Clean and standardize a record"""
@@ -172,6 +175,10 @@ class SilverLayer:
         
         return True
     
+    def close(self):
+        """Persist pending hashes and close the dedup index"""
+        self.dedup_index.close()
+    
     def list_batches(self, source: str = None) -> List[str]:
         """List all silver batches"""
         files = os.listdir(self.storage_path)
@@ -4,13 +4,19 @@ Item pipelines for data cleaning, validation, and storage
 import json
 import os
 import hashlib
+import time
 from datetime import datetime
 from typing import Any
 import logging
 
 from itemadapter import ItemAdapter
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
 import validators
 
+from data_lake.azure_blob import AzureSegmentUploader
+from data_lake.bronze import BronzeSegmentWriter, FORMAT_SEGMENTS
+
 logger = logging.getLogger(__name__)
 
 
@@ -199,14 +205,45 @@ class DeduplicationPipeline:
 class BronzeLayerPipeline:
     """
     Store raw scraped data in Bronze layer (local JSON files or Azure Blob)
+    
+    Locally, BRONZE_FORMAT = "segments" appends to rolling compressed NDJSON
+    segments (see data_lake.bronze) instead of one JSON file per batch. In
+    Azure, batches are streamed into the same format as staged blocks of a
+    block blob through one client kept for the whole crawl (see
+    data_lake.azure_blob); a batch that still fails after retries goes to a
+    local segment.
+    
+    Items are buffered until BRONZE_BUFFER_ITEMS items or BRONZE_BUFFER_BYTES
+    of encoded JSON are held, or BRONZE_FLUSH_INTERVAL seconds have passed.
+    Flushes run in order on one writer thread so the reactor never waits on
+    disk or Azure; once BRONZE_MAX_PENDING_WRITES flushes are queued, items
+    are held back until one completes.
     """
     
     def __init__(self, settings):
         self.bronze_dir = settings.get("BRONZE_DIR")
         self.azure_connection_string = settings.get("AZURE_STORAGE_CONNECTION_STRING")
         self.azure_container = settings.get("AZURE_CONTAINER_BRONZE")
+        self.bronze_format = settings.get("BRONZE_FORMAT", "json")
+        self.segment_max_bytes = settings.getint("BRONZE_SEGMENT_MAX_BYTES", 64 * 1024 * 1024)
+        self.segment_max_seconds = settings.getfloat("BRONZE_SEGMENT_MAX_SECONDS", 3600)
+        self.segment_writer = None
+        self.azure_uploader = None
+        self.azure_max_attempts = settings.getint("AZURE_UPLOAD_MAX_ATTEMPTS", 4)
+        self.azure_block_bytes = settings.getint("AZURE_UPLOAD_BLOCK_BYTES", 4 * 1024 * 1024)
+        self.buffer_items = max(1, settings.getint("BRONZE_BUFFER_ITEMS", 500))
+        self.buffer_bytes = settings.getint("BRONZE_BUFFER_BYTES", 4 * 1024 * 1024)
+        self.flush_interval = settings.getfloat("BRONZE_FLUSH_INTERVAL", 30)
+        self.max_pending_writes = max(1, settings.getint("BRONZE_MAX_PENDING_WRITES", 4))
         self.items_buffer = []
-        self.buffer_size = 10  # Write every 10 items
+        # Items encoded once on arrival: sizes the buffer and feeds segment writes
+        self.lines_buffer = []
+        self.buffered_bytes = 0
+        self.last_flush = time.monotonic()
+        self.pending_writes = []
+        self.write_waiters = []
+        self.write_pool = None
+        self.flush_loop = None
         
         # Create bronze directory if it doesn't exist
         if self.bronze_dir:
@@ -216,53 +253,131 @@ class BronzeLayerPipeline:
     def from_crawler(cls, crawler):
         return cls(crawler.settings)
     
+    def open_spider(self, spider):
+        # One thread keeps batches in order and the segment writer single-threaded
+        self.write_pool = ThreadPool(minthreads=1, maxthreads=1, name="bronze-writer")
+        self.write_pool.start()
+        # The loop also finalizes segments that reach their age while the spider is idle
+        if self.flush_interval > 0 or self.bronze_format == FORMAT_SEGMENTS:
+            self.flush_loop = task.LoopingCall(self._flush_if_due, spider.name)
+            self.flush_loop.start(min(self.flush_interval or 1.0, 1.0), now=False)
+    
     def process_item(self, item, spider):
-        self.items_buffer.append(dict(ItemAdapter(item)))
+        record = dict(ItemAdapter(item))
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        self.items_buffer.append(record)
+        self.lines_buffer.append(line)
+        self.buffered_bytes += len(line) + 1
         
-        if len(self.items_buffer) >= self.buffer_size:
-            self._write_batch(spider.name)
+        if len(self.items_buffer) >= self.buffer_items or self.buffered_bytes >= self.buffer_bytes:
+            self._flush(spider.name)
         
+        if len(self.pending_writes) >= self.max_pending_writes:
+            # Backpressure: hand the item on only once the writer catches up
+            waiter = defer.Deferred()
+            self.write_waiters.append(waiter)
+            waiter.addCallback(lambda _: item)
+            return waiter
         return item
     
     def close_spider(self, spider):
         """Write remaining items when spider closes"""
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
         if self.items_buffer:
-            self._write_batch(spider.name)
+            self._flush(spider.name)
+        
+        done = defer.DeferredList(list(self.pending_writes))
+        done.addCallback(lambda _: self._run_in_writer(self._close_writer))
+        done.addBoth(self._stop_write_pool)
+        return done
     
-    def _write_batch(self, spider_name):
-        """Write buffered items to storage"""
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        filename = f"{spider_name}_{timestamp}.json"
+    def _flush_if_due(self, spider_name):
+        if self.items_buffer and self.flush_interval > 0 and time.monotonic() - self.last_flush >= self.flush_interval:
+            self._flush(spider_name)
+        elif self.segment_writer is not None and not self.pending_writes:
+            # Runs on the writer thread, after any queued write
+            check = self._run_in_writer(self.segment_writer.roll_if_expired)
+            check.addErrback(lambda failure: logger.error(f"Failed to roll bronze segment: {failure.value}"))
+    
+    def _flush(self, spider_name):
+        """Hand the buffer to the writer thread"""
+        items, lines = self.items_buffer, self.lines_buffer
+        self.items_buffer, self.lines_buffer = [], []
+        self.buffered_bytes = 0
+        self.last_flush = time.monotonic()
         
+        write = self._run_in_writer(self._write_batch, spider_name, items, lines)
+        write.addErrback(lambda failure: logger.error(f"Failed to write bronze batch: {failure.value}"))
+        self.pending_writes.append(write)
+        write.addBoth(self._write_finished, write)
+    
+    def _run_in_writer(self, function, *args):
+        # Imported here so the reactor chosen by TWISTED_REACTOR is the one installed
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self.write_pool, function, *args)
+    
+    def _write_finished(self, result, write):
+        self.pending_writes.remove(write)
+        waiters, self.write_waiters = self.write_waiters, []
+        for waiter in waiters:
+            waiter.callback(None)
+        return result
+    
+    def _stop_write_pool(self, result):
+        if self.write_pool is not None:
+            self.write_pool.stop()
+            self.write_pool = None
+        return result
+    
+    def _close_writer(self):
+        if self.segment_writer is not None:
+            self.segment_writer.close()
+        if self.azure_uploader is not None:
+            self.azure_uploader.close()
+    
+    def _write_batch(self, spider_name, items, lines):
+        """Write one batch to storage (writer thread)"""
         if self.azure_connection_string and self.azure_container:
-            self._write_to_azure(filename)
+            filename = self._write_to_azure(spider_name, lines)
+        elif self.bronze_format == FORMAT_SEGMENTS:
+            filename = self._write_to_segment(spider_name, lines)
         else:
-            self._write_to_local(filename)
+            filename = f"{spider_name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}.json"
+            self._write_to_local(filename, items)
         
-        logger.info(f"Wrote {len(self.items_buffer)} items to {filename}")
-        self.items_buffer = []
+        logger.info(f"Wrote {len(items)} items to {filename}")
+    
+    def _write_to_segment(self, spider_name, lines):
+        """Append to the spider's open bronze segment"""
+        if self.segment_writer is None:
+            self.segment_writer = BronzeSegmentWriter(
+                self.bronze_dir, spider_name,
+                max_segment_bytes=self.segment_max_bytes,
+                max_segment_seconds=self.segment_max_seconds,
+            )
+        return self.segment_writer.append_lines(lines)
     
-    def _write_to_local(self, filename):
+    def _write_to_local(self, filename, items):
         """Write to local filesystem"""
         filepath = os.path.join(self.bronze_dir, filename)
         with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(self.items_buffer, f, ensure_ascii=False, indent=2)
+            json.dump(items, f, ensure_ascii=False, indent=2)
     
-    def _write_to_azure(self, filename):
-        """Write to Azure Blob Storage"""
+    def _write_to_azure(self, spider_name, lines):
+        """Stream to Azure Blob Storage"""
         try:
-            from azure.storage.blob import BlobServiceClient
-            
-            blob_service_client = BlobServiceClient.from_connection_string(self.azure_connection_string)
-            blob_client = blob_service_client.get_blob_client(
-                container=self.azure_container,
-                blob=filename
-            )
-            
-            data = json.dumps(self.items_buffer, ensure_ascii=False, indent=2)
-            blob_client.upload_blob(data, overwrite=True)
+            if self.azure_uploader is None:
+                self.azure_uploader = AzureSegmentUploader.from_connection_string(
+                    self.azure_connection_string, self.azure_container, spider_name,
+                    block_bytes=self.azure_block_bytes,
+                    max_blob_bytes=self.segment_max_bytes,
+                    max_blob_seconds=self.segment_max_seconds,
+                    max_attempts=self.azure_max_attempts,
+                )
+            return self.azure_uploader.append_lines(lines)
             
         except Exception as e:
             logger.error(f"Failed to write to Azure: {e}")
-            # Fallback to local storage
-            self._write_to_local(filename)
+            # Fallback to local storage, reusing the encoded lines
+            return self._write_to_segment(spider_name, lines)
@@ -116,6 +116,9 @@ AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING", "
 AZURE_CONTAINER_BRONZE = os.getenv("AZURE_CONTAINER_BRONZE", "estatemind-bronze")
 AZURE_CONTAINER_SILVER = os.getenv("AZURE_CONTAINER_SILVER", "estatemind-silver")
 AZURE_CONTAINER_GOLD = os.getenv("AZURE_CONTAINER_GOLD", "estatemind-gold")
+# Bronze uploads: attempts per block/commit and staged block size
+AZURE_UPLOAD_MAX_ATTEMPTS = int(os.getenv("AZURE_UPLOAD_MAX_ATTEMPTS", "4"))
+AZURE_UPLOAD_BLOCK_BYTES = int(os.getenv("AZURE_UPLOAD_BLOCK_BYTES", str(4 * 1024 * 1024)))
 
 # Local data storage path (fallback if Azure not configured)
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
@@ -123,6 +126,19 @@ BRONZE_DIR = os.path.join(DATA_DIR, "bronze")
 SILVER_DIR = os.path.join(DATA_DIR, "silver")
 GOLD_DIR = os.path.join(DATA_DIR, "gold")
 
+# Local bronze format: "json" (one file per batch) or "segments" (rolling
+# compressed NDJSON segments listed in data/bronze/_manifest.jsonl)
+BRONZE_FORMAT = os.getenv("BRONZE_FORMAT", "segments")
+# A segment is finalized once it reaches this compressed size or age
+BRONZE_SEGMENT_MAX_BYTES = int(os.getenv("BRONZE_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+BRONZE_SEGMENT_MAX_SECONDS = float(os.getenv("BRONZE_SEGMENT_MAX_SECONDS", "3600"))
+# Bronze pipeline buffer: flushed at this many items, bytes of encoded JSON or seconds
+BRONZE_BUFFER_ITEMS = int(os.getenv("BRONZE_BUFFER_ITEMS", "500"))
+BRONZE_BUFFER_BYTES = int(os.getenv("BRONZE_BUFFER_BYTES", str(4 * 1024 * 1024)))
+BRONZE_FLUSH_INTERVAL = float(os.getenv("BRONZE_FLUSH_INTERVAL", "30"))
+# Flushes queued behind the writer thread before items are held back
+BRONZE_MAX_PENDING_WRITES = int(os.getenv("BRONZE_MAX_PENDING_WRITES", "4"))
+
 # Tunisia bounding box for coordinate validation
 TUNISIA_BBOX = {
     "min_lat": 30.2,
@@ -2,6 +2,7 @@
 Gold Layer Processing Script
 Creates analytics-ready aggregations and insights
 """
+import argparse
 import json
 import pandas as pd
 from pathlib import Path
@@ -9,6 +10,9 @@ from datetime import datetime
 from typing import List, Dict, Any
 import logging
 
+from data_lake.json_stream import iter_records
+from data_lake.near_duplicates import NearDuplicateIndex
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -16,26 +20,38 @@ logger = logging.getLogger(__name__)
 class GoldLayerProcessor:
     """Create analytics-ready gold layer from silver data"""
     
-    def __init__(self, silver_dir: str = "data/silver", gold_dir: str = "data/gold"):
+    def __init__(self, silver_dir: str = "data/silver", gold_dir: str = "data/gold",
+                 drop_near_duplicates: bool = False):
         self.silver_dir = Path(silver_dir)
         self.gold_dir = Path(gold_dir)
         self.gold_dir.mkdir(parents=True, exist_ok=True)
+        # Same property listed on several sites: marked with near_duplicate_of, or dropped
+        self.drop_near_duplicates = drop_near_duplicates
     
     def load_silver_data(self) -> pd.DataFrame:
         """Load all silver layer files into a single DataFrame"""
         all_records = []
+        # Only across sites: two listings of one site are distinct ads, even if alike
+        near_duplicates = NearDuplicateIndex(cross_source_only=True)
+        duplicates = 0
         
-        silver_files = list(self.silver_dir.glob("silver_*.json"))
+        silver_files = sorted(self.silver_dir.glob("silver_*.json"))
         logger.info(f"Loading {len(silver_files)} silver files")
         
         for silver_file in silver_files:
-            with open(silver_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                records = data.get('data', [])
-                all_records.extend(records)
+            # Streamed: only the records are held, never a whole parsed file
+            for record in iter_records(silver_file):
+                match = near_duplicates.add(record)
+                if match:
+                    duplicates += 1
+                    if self.drop_near_duplicates:
+                        continue
+                    record['near_duplicate_of'] = match[0]
+                all_records.append(record)
         
         df = pd.DataFrame(all_records)
-        logger.info(f"Loaded {len(df)} records into DataFrame")
+        action = "dropped" if self.drop_near_duplicates else "marked"
+        logger.info(f"Loaded {len(df)} records into DataFrame ({duplicates} near duplicates {action})")
         
         return df
     
@@ -163,12 +179,17 @@ class GoldLayerProcessor:
             logger.warning("No data found in silver layer")
             return {}
         
+        # Marked near duplicates stay in the export but are counted once in the analytics
+        analytics_df = df
+        if 'near_duplicate_of' in df.columns:
+            analytics_df = df[df['near_duplicate_of'].isna()]
+        
         # Create analytics
         output_files = {}
         
         # 1. Price analytics
         logger.info("Creating price analytics")
-        price_analytics = self.create_price_analytics(df)
+        price_analytics = self.create_price_analytics(analytics_df)
         price_file = self.gold_dir / "price_analytics.json"
         with open(price_file, 'w', encoding='utf-8') as f:
             json.dump(price_analytics, f, ensure_ascii=False, indent=2)
@@ -176,7 +197,7 @@ class GoldLayerProcessor:
         
         # 2. Feature analytics
         logger.info("Creating feature analytics")
-        feature_analytics = self.create_feature_analytics(df)
+        feature_analytics = self.create_feature_analytics(analytics_df)
         feature_file = self.gold_dir / "feature_analytics.json"
         with open(feature_file, 'w', encoding='utf-8') as f:
             json.dump(feature_analytics, f, ensure_ascii=False, indent=2)
@@ -184,7 +205,7 @@ class GoldLayerProcessor:
         
         # 3. Size analytics
         logger.info("Creating size analytics")
-        size_analytics = self.create_size_analytics(df)
+        size_analytics = self.create_size_analytics(analytics_df)
         size_file = self.gold_dir / "size_analytics.json"
         with open(size_file, 'w', encoding='utf-8') as f:
             json.dump(size_analytics, f, ensure_ascii=False, indent=2)
@@ -194,6 +215,8 @@ class GoldLayerProcessor:
         logger.info("Creating summary CSV")
         summary_cols = ['title', 'property_type', 'transaction_type', 'governorate', 
                        'price', 'size', 'bedrooms', 'has_price', 'has_coordinates']
+        if 'near_duplicate_of' in df.columns:
+            summary_cols.append('near_duplicate_of')
         summary_df = df[summary_cols].copy()
         summary_csv = self.gold_dir / "properties_summary.csv"
         summary_df.to_csv(summary_csv, index=False)
@@ -205,7 +228,15 @@ class GoldLayerProcessor:
 
 
 if __name__ == "__main__":
-    processor = GoldLayerProcessor()
+    parser = argparse.ArgumentParser(description="Build gold layer analytics from the silver layer")
+    parser.add_argument("--silver-dir", default="data/silver")
+    parser.add_argument("--gold-dir", default="data/gold")
+    parser.add_argument("--drop-near-duplicates", action="store_true",
+                        help="Drop listings that duplicate another site's listing instead of marking them")
+    args = parser.parse_args()
+    
+    processor = GoldLayerProcessor(args.silver_dir, args.gold_dir,
+                                   drop_near_duplicates=args.drop_near_duplicates)
     output_files = processor.process()
     
     print("\n✅ Gold Layer Analytics Created:")
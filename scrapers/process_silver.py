@@ -2,17 +2,114 @@
 Silver Layer Processing Script
 Reads Bronze layer files and produces cleaned Silver layer data
 """
+import argparse
+import hashlib
 import json
 import os
 import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 import logging
 from pathlib import Path
 
+from data_lake.bronze import SEGMENT_SUFFIX
+from data_lake.json_stream import JsonRecordWriter, iter_records
+from data_lake.locations import canonical_delegation, canonical_governorate
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Processed bronze files, one JSON line per processing run of a file (last one wins)
+PROCESSED_MANIFEST_FILE = "_processed_bronze.jsonl"
+
+# Parallel mode: bronze files from this size on are cleaned in chunks of records
+DEFAULT_SPLIT_FILE_BYTES = 32 * 1024 * 1024
+DEFAULT_CHUNK_RECORDS = 5000
+# Chunks of a large file submitted per worker before the oldest is collected
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# Normalization helpers run for several fields of every record, so their
+# patterns, tables and repeated results are prepared once per process
+_NON_DIGIT = re.compile(r'\D')
+# Every string datetime.fromisoformat accepts starts with a 4-digit year
+_ISO_DATE_START = re.compile(r'\d{4}')
+_TRUE_STRINGS = frozenset(['true', 'yes', '1', 'oui'])
+
+
+@lru_cache(maxsize=65536)
+def _parse_date(date_str: str) -> Optional[str]:
+    """ISO 8601 form of a date string, or None; memoized as listings share dates"""
+    if _ISO_DATE_START.match(date_str):
+        try:
+            return datetime.fromisoformat(date_str.replace('Z', '+00:00')).isoformat()
+        except ValueError:
+            pass
+    logger.warning(f"Could not parse date: {date_str}")
+    return None
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProcessedFileManifest:
+    """
+    Bronze files already turned into silver, with their size, mtime and content hash
+
+    A file is unchanged when its size and mtime match the manifest; when
+    they don't, its content hash decides, so touched-but-identical files
+    are not reprocessed.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['file']] = entry
+    
+    def is_processed(self, bronze_file: Path) -> bool:
+        entry = self.entries.get(bronze_file.name)
+        if entry is None:
+            return False
+        stat = bronze_file.stat()
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return True
+        if entry['size'] != stat.st_size or entry['sha256'] != file_sha256(bronze_file):
+            return False
+        # Same content, new mtime: remember it so the next run skips hashing
+        self.record(bronze_file, entry['silver_file'], entry['sha256'])
+        return True
+    
+    def record(self, bronze_file: Path, silver_file: str, sha256: Optional[str] = None):
+        stat = bronze_file.stat()
+        entry = {
+            'file': bronze_file.name,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': sha256 or file_sha256(bronze_file),
+            'silver_file': silver_file,
+            'processed_at': datetime.utcnow().isoformat(),
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.entries[entry['file']] = entry
+
 
 class SilverLayerProcessor:
     """Process bronze layer data into clean silver layer"""
@@ -28,7 +125,7 @@ class SilverLayerProcessor:
             return None
         
         # Remove all non-digit characters
-        digits = re.sub(r'\D', '', phone)
+        digits = _NON_DIGIT.sub('', phone)
         
         # Handle Tunisian phone numbers
         if digits.startswith('216'):
@@ -54,13 +151,11 @@ class SilverLayerProcessor:
         if not date_str:
             return None
         
-        try:
-            # Try parsing ISO format first
-            dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-            return dt.isoformat()
-        except (ValueError, AttributeError):
+        if not isinstance(date_str, str):
             logger.warning(f"Could not parse date: {date_str}")
             return None
+        
+        return _parse_date(date_str)
     
     def normalize_boolean(self, value: Any) -> bool:
         """Standardize boolean values"""
@@ -71,7 +166,7 @@ class SilverLayerProcessor:
         
         # Handle string representations
         if isinstance(value, str):
-            return value.lower() in ['true', 'yes', '1', 'oui']
+            return value.lower() in _TRUE_STRINGS
         
         return bool(value)
     
@@ -93,36 +188,16 @@ class SilverLayerProcessor:
         if not gov:
             return None
         
-        gov_mapping = {
-            'tunis': 'Tunis',
-            'ariana': 'Ariana',
-            'ben arous': 'Ben Arous',
-            'benarous': 'Ben Arous',
-            'manouba': 'Manouba',
-            'nabeul': 'Nabeul',
-            'zaghouan': 'Zaghouan',
-            'bizerte': 'Bizerte',
-            'beja': 'Béja',
-            'jendouba': 'Jendouba',
-            'kef': 'Le Kef',
-            'siliana': 'Siliana',
-            'sousse': 'Sousse',
-            'monastir': 'Monastir',
-            'mahdia': 'Mahdia',
-            'sfax': 'Sfax',
-            'kairouan': 'Kairouan',
-            'kasserine': 'Kasserine',
-            'sidi bouzid': 'Sidi Bouzid',
-            'gabes': 'Gabès',
-            'medenine': 'Médenine',
-            'tataouine': 'Tataouine',
-            'gafsa': 'Gafsa',
-            'tozeur': 'Tozeur',
-            'kebili': 'Kébili',
-        }
+        # Accents, case, articles and Arabic spellings are handled by the table
+        return canonical_governorate(gov) or gov.title()
+    
+    def normalize_delegation(self, delegation: Optional[str]) -> Optional[str]:
+        """Standardize delegation names, keeping unknown ones as cleaned text"""
+        delegation = self.clean_text(delegation)
+        if not delegation:
+            return None
         
-        gov_lower = gov.lower().strip()
-        return gov_mapping.get(gov_lower, gov.title())
+        return canonical_delegation(delegation) or delegation
     
     def clean_record(self, record: Dict[str, Any]) -> Dict[str, Any]:
         """Clean a single property record"""
@@ -143,7 +218,7 @@ class SilverLayerProcessor:
         
         # Location
         cleaned['governorate'] = self.normalize_governorate(record.get('governorate'))
-        cleaned['delegation'] = self.clean_text(record.get('delegation'))
+        cleaned['delegation'] = self.normalize_delegation(record.get('delegation'))
         cleaned['neighborhood'] = self.clean_text(record.get('neighborhood'))
         
         # Coordinates
@@ -218,102 +293,297 @@ class SilverLayerProcessor:
     
     def remove_duplicates(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Remove duplicate records based on content_hash"""
+        return list(self.iter_unique(records))
+    
+    def iter_unique(self, records: Iterable[Dict[str, Any]],
+                    counts: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Records without duplicates based on content_hash, streamed
+        
+        counts['records_cleaned'] is set to the number of records read once
+        the iteration is finished.
+        """
         seen_hashes = set()
-        unique_records = []
+        total = 0
+        unique = 0
         
         for record in records:
+            total += 1
             content_hash = record.get('content_hash')
             if content_hash and content_hash not in seen_hashes:
                 seen_hashes.add(content_hash)
-                unique_records.append(record)
+                unique += 1
+                yield record
             elif not content_hash:
                 # Keep records without hash (shouldn't happen but be safe)
-                unique_records.append(record)
+                unique += 1
+                yield record
         
-        duplicates_removed = len(records) - len(unique_records)
+        if counts is not None:
+            counts['records_cleaned'] = total
+        duplicates_removed = total - unique
         if duplicates_removed > 0:
             logger.info(f"Removed {duplicates_removed} duplicate records")
-        
-        return unique_records
     
-    def process_file(self, bronze_file: Path) -> str:
-        """Process a single bronze file to silver layer"""
-        logger.info(f"Processing bronze file: {bronze_file}")
-        
-        # Read bronze data
-        with open(bronze_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Extract records (handle both list and dict formats)
-        if isinstance(data, list):
-            records = data
-        elif isinstance(data, dict) and 'data' in data:
-            records = data['data']
-        else:
-            logger.error(f"Unexpected data format in {bronze_file}")
-            return None
-        
-        # Clean records
-        cleaned_records = []
+    def iter_bronze_records(self, bronze_file: Path,
+                            counts: Optional[Dict[str, int]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Records of a bronze file, streamed
+        
+        Handles bare lists, the {"metadata", "data"} envelope and rolling
+        segments; counts['records_in'] tracks the records read so far.
+        """
+        if counts is not None:
+            counts['records_in'] = 0
+        for record in iter_records(bronze_file):
+            if counts is not None:
+                counts['records_in'] += 1
+            yield record
+    
+    def iter_cleaned(self, records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Cleaned records, skipping the ones that fail, streamed"""
         for record in records:
             try:
                 cleaned = self.clean_record(record)
-                cleaned_records.append(cleaned)
             except Exception as e:
                 logger.error(f"Error cleaning record: {e}")
                 continue
+            yield cleaned
+    
+    def clean_records(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Clean records, skipping the ones that fail"""
+        return list(self.iter_cleaned(records))
+    
+    def silver_path(self, bronze_file: Path) -> Path:
+        silver_name = bronze_file.name
+        if silver_name.endswith(SEGMENT_SUFFIX):
+            silver_name = silver_name[:-len(SEGMENT_SUFFIX)] + ".json"
+        return self.silver_dir / f"silver_{silver_name}"
+    
+    def process_file(self, bronze_file: Path) -> str:
+        """Process a single bronze file to silver layer, one record at a time"""
+        logger.info(f"Processing bronze file: {bronze_file}")
         
-        # Remove duplicates
-        unique_records = self.remove_duplicates(cleaned_records)
-        
-        # Create silver layer output
-        silver_data = {
-            "metadata": {
+        counts = {}
+        records = self.iter_bronze_records(bronze_file, counts)
+        try:
+            return self.write_silver(bronze_file, self.iter_cleaned(records), counts)
+        except ValueError as e:
+            logger.error(f"Unexpected data format in {bronze_file}: {e}")
+            return None
+    
+    def write_silver(self, bronze_file: Path, cleaned_records: Iterable[Dict[str, Any]],
+                     counts: Dict[str, int]) -> str:
+        """
+        Deduplicate the cleaned records of a bronze file and stream them to its silver file
+        
+        counts['records_in'] must hold the number of bronze records once
+        cleaned_records is exhausted.
+        """
+        silver_file = self.silver_path(bronze_file)
+        with JsonRecordWriter(silver_file) as writer:
+            for record in self.iter_unique(cleaned_records, counts):
+                writer.write(record)
+            
+            writer.metadata = {
                 "source_file": bronze_file.name,
                 "processing_timestamp": datetime.utcnow().isoformat(),
-                "records_in": len(records),
-                "records_cleaned": len(cleaned_records),
-                "records_unique": len(unique_records),
-                "duplicates_removed": len(cleaned_records) - len(unique_records)
-            },
-            "data": unique_records
-        }
-        
-        # Write to silver layer
-        silver_file = self.silver_dir / f"silver_{bronze_file.name}"
-        with open(silver_file, 'w', encoding='utf-8') as f:
-            json.dump(silver_data, f, ensure_ascii=False, indent=2)
+                "records_in": counts['records_in'],
+                "records_cleaned": counts['records_cleaned'],
+                "records_unique": writer.count,
+                "duplicates_removed": counts['records_cleaned'] - writer.count
+            }
         
         logger.info(f"Silver layer created: {silver_file}")
-        logger.info(f"  Records in: {len(records)}")
-        logger.info(f"  Records cleaned: {len(cleaned_records)}")
-        logger.info(f"  Records unique: {len(unique_records)}")
+        logger.info(f"  Records in: {counts['records_in']}")
+        logger.info(f"  Records cleaned: {counts['records_cleaned']}")
+        logger.info(f"  Records unique: {writer.count}")
         
         return str(silver_file)
     
-    def process_all(self) -> List[str]:
-        """Process all bronze files to silver layer"""
-        bronze_files = list(self.bronze_dir.glob("*.json"))
+    def process_all(self, incremental: bool = False, workers: int = 0,
+                    chunk_records: int = DEFAULT_CHUNK_RECORDS,
+                    split_file_bytes: int = DEFAULT_SPLIT_FILE_BYTES) -> List[str]:
+        """
+        Process all bronze files to silver layer
+        
+        Args:
+            incremental: Skip bronze files recorded in the processed-file
+                manifest with unchanged content
+            workers: Processes to spread the work over (0 or 1 = serial)
+            chunk_records: Records per task when a large file is split
+            split_file_bytes: Files at least this large are split into chunks
+        """
+        bronze_files = list(self.bronze_dir.glob("*.json")) + sorted(self.bronze_dir.glob(f"*{SEGMENT_SUFFIX}"))
         
         if not bronze_files:
             logger.warning(f"No bronze files found in {self.bronze_dir}")
             return []
         
+        manifest = ProcessedFileManifest(self.silver_dir / PROCESSED_MANIFEST_FILE)
+        if incremental:
+            total = len(bronze_files)
+            bronze_files = [f for f in bronze_files if not manifest.is_processed(f)]
+            logger.info(f"Incremental run: {total - len(bronze_files)} of {total} bronze files unchanged")
+        
         logger.info(f"Found {len(bronze_files)} bronze files to process")
         
+        if workers > 1 and len(bronze_files) > 0:
+            results = self._process_parallel(bronze_files, workers, chunk_records, split_file_bytes)
+        else:
+            results = (self.process_file(bronze_file) for bronze_file in bronze_files)
+        
         silver_files = []
-        for bronze_file in bronze_files:
-            silver_file = self.process_file(bronze_file)
+        for bronze_file, silver_file in zip(bronze_files, results):
             if silver_file:
                 silver_files.append(silver_file)
+                manifest.record(bronze_file, silver_file)
         
         return silver_files
+    
+    def _process_parallel(self, bronze_files: List[Path], workers: int, chunk_records: int,
+                          split_file_bytes: int) -> Iterator[Optional[str]]:
+        """
+        Silver files of bronze_files, in order, using a process pool
+        
+        Small files are processed whole by a worker. Large files are
+        streamed here one at a time and cleaned by workers in chunks, with
+        at most CHUNKS_IN_FLIGHT_PER_WORKER chunks per worker submitted at
+        once; the chunks are merged back in order and deduplicated here, so
+        every silver file holds exactly what the serial mode would write and
+        memory stays bounded by the chunks in flight.
+        """
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(str(self.bronze_dir), str(self.silver_dir))) as pool:
+            # Whole-file tasks return only a path, so they can all be queued up front
+            small_files = {
+                bronze_file: pool.submit(_process_file_task, str(bronze_file))
+                for bronze_file in bronze_files
+                if bronze_file.stat().st_size < split_file_bytes
+            }
+            
+            for bronze_file in bronze_files:
+                if bronze_file in small_files:
+                    yield small_files[bronze_file].result()
+                    continue
+                
+                logger.info(f"Splitting bronze file: {bronze_file}")
+                counts = {}
+                records = self.iter_bronze_records(bronze_file, counts)
+                cleaned_records = self._iter_cleaned_in_pool(pool, records, chunk_records,
+                                                             workers * CHUNKS_IN_FLIGHT_PER_WORKER)
+                try:
+                    yield self.write_silver(bronze_file, cleaned_records, counts)
+                except ValueError as e:
+                    logger.error(f"Unexpected data format in {bronze_file}: {e}")
+                    yield None
+    
+    def _iter_cleaned_in_pool(self, pool: ProcessPoolExecutor, records: Iterable[Dict[str, Any]],
+                              chunk_records: int, max_in_flight: int) -> Iterator[Dict[str, Any]]:
+        """Cleaned records, in order, with chunks cleaned by pool workers (a sliding window)"""
+        in_flight = deque()
+        records = iter(records)
+        try:
+            while True:
+                chunk = list(islice(records, chunk_records))
+                if not chunk:
+                    break
+                in_flight.append(pool.submit(_clean_records_task, chunk))
+                del chunk
+                if len(in_flight) >= max_in_flight:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+        finally:
+            # Stopped early (e.g. malformed file): drop chunks nobody will read
+            for future in in_flight:
+                future.cancel()
+
+
+# Processor of a worker process (see SilverLayerProcessor._process_parallel)
+_worker_processor: Optional[SilverLayerProcessor] = None
+
+
+def _init_worker(bronze_dir: str, silver_dir: str):
+    global _worker_processor
+    _worker_processor = SilverLayerProcessor(bronze_dir, silver_dir)
+
+
+def _process_file_task(bronze_file: str) -> Optional[str]:
+    return _worker_processor.process_file(Path(bronze_file))
+
+
+def _clean_records_task(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return _worker_processor.clean_records(records)
+
+
+def benchmark_cleaning(count: int = 50000, repeat: int = 3) -> float:
+    """
+    Records per second through clean_record, on synthetic bronze records
+    
+    Field values are drawn from small pools, like real listings that share
+    governorates, delegations and scrape dates. Returns the best of repeat runs.
+    """
+    governorates = ['tunis', 'Ariana', 'BEN AROUS', 'Sousse ', 'nabeul', 'beja', 'Le Kef', 'Sfax', 'Monastir', 'Kebili']
+    delegations = ['La Marsa', 'la soukra', 'Hammam Lif', 'El Menzah', 'Hammamet', 'Akouda', 'Centre  Ville', None]
+    dates = [f"2024-{month:02d}-{day:02d}T10:{day:02d}:00Z" for month in range(1, 13) for day in range(1, 29)]
+    records = [{
+        'listing_id': str(i),
+        'source_url': f"https://example.tn/annonce/{i}",
+        'source_website': 'tayara',
+        'title': f"  Appartement S+{i % 4 + 1}   haut standing  {i}",
+        'description': "Bel appartement  proche de toutes commodités,\n vue mer. " * 3,
+        'property_type': 'APARTMENT',
+        'transaction_type': 'SALE',
+        'governorate': governorates[i % len(governorates)],
+        'delegation': delegations[i % len(delegations)],
+        'neighborhood': 'Cité Ennasr',
+        'latitude': 36.8 + (i % 100) / 1000,
+        'longitude': 10.2,
+        'price': str(150000 + i % 500 * 1000),
+        'size': str(80 + i % 150),
+        'bedrooms': str(i % 5 + 1),
+        'has_parking': 'oui' if i % 2 else 'non',
+        'has_elevator': i % 3 == 0,
+        'has_pool': None,
+        'contact_phone': f"+216 {20 + i % 80} {i % 1000:03d} {i % 1000:03d}",
+        'contact_name': ' Agence  Immobilière ',
+        'listing_date': dates[i % len(dates)],
+        'scrape_timestamp': dates[(i * 7) % len(dates)],
+    } for i in range(count)]
+    
+    processor = SilverLayerProcessor.__new__(SilverLayerProcessor)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for record in records:
+            processor.clean_record(record)
+        best = min(best, time.perf_counter() - started)
+    return count / best
 
 
 if __name__ == "__main__":
-    # Process all bronze files
-    processor = SilverLayerProcessor()
-    silver_files = processor.process_all()
+    parser = argparse.ArgumentParser(description="Process bronze files into the silver layer")
+    parser.add_argument("--bronze-dir", default="data/bronze")
+    parser.add_argument("--silver-dir", default="data/silver")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process bronze files that are new or changed since the last run")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Worker processes (0 = serial, -1 = one per CPU)")
+    parser.add_argument("--chunk-records", type=int, default=DEFAULT_CHUNK_RECORDS,
+                        help="Records per task when a large bronze file is split across workers")
+    parser.add_argument("--benchmark", type=int, metavar="RECORDS",
+                        help="Only time record cleaning on this many synthetic records and exit")
+    args = parser.parse_args()
+    
+    if args.benchmark:
+        print(f"clean_record: {benchmark_cleaning(args.benchmark):,.0f} records/sec")
+        raise SystemExit(0)
+    
+    workers = (os.cpu_count() or 1) if args.workers < 0 else args.workers
+    processor = SilverLayerProcessor(args.bronze_dir, args.silver_dir)
+    silver_files = processor.process_all(incremental=args.incremental, workers=workers,
+                                         chunk_records=args.chunk_records)
     
     print(f"\n✅ Processed {len(silver_files)} files to Silver layer")
     for f in silver_files: